@@ -0,0 +1,429 @@
+#
+# Copyright 2018 PyWren Team
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+asyncio interface to PyWren (python 3.5+ only).
+
+Waiting for and fetching results is done with non-blocking storage
+requests, so one event loop can follow thousands of calls (from any
+number of maps) without a thread per request.
+
+Usage
+  >>> futures = await pwex.map_async(foo, data)
+  >>> first = await futures[0]
+  >>> async for f in pywren.aio.as_completed(futures):
+  ...     print(f.result())
+
+S3 is accessed through aiobotocore if it is installed. Without it, S3
+requests are run in the event loop's default executor. Its clients are
+closed by `close_async_storages()`, which should be awaited before the
+event loop is closed.
+"""
+
+import asyncio
+import functools
+import json
+import time
+import weakref
+from collections import deque
+
+from pywren import completion, wrenutil
+from pywren.future import JobState, ResponseFuture, load_output
+from pywren.storage import storage_utils
+from pywren.storage.exceptions import StorageNoSuchKeyError, StorageOutputNotFoundError
+from pywren.storage.local_backend import LocalBackend
+from pywren.storage.storage import get_storage_for_path
+
+try:
+    from aiobotocore.session import get_session as aiobotocore_session
+except ImportError:
+    aiobotocore_session = None
+
+# how often to check the completion notifications of a callset, which is
+# just an in-memory lookup
+NOTIFIED_CHECK_SEC = 0.05
+
+# event loop -> {storage path -> AsyncStorage}, see get_async_storage(),
+# which is forgotten along with the loop
+_async_storages = weakref.WeakKeyDictionary()
+
+
+class AsyncLocalBackend(object):
+    """
+    Local filesystem backend. Local reads are fast enough to just do them
+    in the event loop.
+    """
+
+    def __init__(self, local_config):
+        self.backend = LocalBackend(local_config)
+
+    async def put_object(self, key, data):
+        self.backend.put_object(key, data)
+
+    async def get_object(self, key, byte_range=None):
+        return self.backend.get_object(key, byte_range)
+
+    async def list_keys_with_prefix(self, prefix, start_after=None):
+        return self.backend.list_keys_with_prefix(prefix, start_after)
+
+    async def aclose(self):
+        pass
+
+
+class AsyncS3Backend(object):
+    """
+    S3 backend on top of aiobotocore.
+    """
+
+    def __init__(self, s3config):
+        self.s3_bucket = s3config['bucket']
+        self._client_context = None
+        self._client = None
+        self._client_lock = asyncio.Lock()
+
+    async def _get_client(self):
+        async with self._client_lock:
+            if self._client is None:
+                session = aiobotocore_session()
+                # the client is kept open until aclose()
+                self._client_context = session.create_client('s3')
+                self._client = await self._client_context.__aenter__()
+            return self._client
+
+    async def aclose(self):
+        """
+        Close the client, if it was opened
+        """
+        async with self._client_lock:
+            if self._client is not None:
+                client_context = self._client_context
+                self._client_context = None
+                self._client = None
+                await client_context.__aexit__(None, None, None)
+
+    async def put_object(self, key, data):
+        client = await self._get_client()
+        await client.put_object(Bucket=self.s3_bucket, Key=key, Body=data)
+
+    async def get_object(self, key, byte_range=None):
+        client = await self._get_client()
+        extra_get_args = {}
+        if byte_range is not None:
+            extra_get_args['Range'] = 'bytes={}-{}'.format(*byte_range)
+        try:
+            r = await client.get_object(Bucket=self.s3_bucket, Key=key, **extra_get_args)
+        except client.exceptions.NoSuchKey:
+            raise StorageNoSuchKeyError(key)
+        async with r['Body'] as stream:
+            return await stream.read()
+
+    async def list_keys_with_prefix(self, prefix, start_after=None):
+        client = await self._get_client()
+        operation_parameters = {'Bucket': self.s3_bucket,
+                                'Prefix': prefix}
+        if start_after is not None:
+            operation_parameters['StartAfter'] = start_after
+        paginator = client.get_paginator('list_objects_v2')
+
+        key_list = []
+        async for page in paginator.paginate(**operation_parameters):
+            for item in page.get('Contents', []):
+                key_list.append(item['Key'])
+        return key_list
+
+
+class SyncBackendAdapter(object):
+    """
+    Run the methods of a (blocking) storage backend in the event loop's
+    default executor.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    async def _run(self, method, *args):
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(None, functools.partial(method, *args))
+
+    async def put_object(self, key, data):
+        await self._run(self.backend.put_object, key, data)
+
+    async def get_object(self, key, byte_range=None):
+        return await self._run(self.backend.get_object, key, byte_range)
+
+    async def list_keys_with_prefix(self, prefix, start_after=None):
+        return await self._run(self.backend.list_keys_with_prefix, prefix, start_after)
+
+    async def aclose(self):
+        # the backend belongs to the Storage we share it with
+        pass
+
+
+class AsyncStorage(object):
+    """
+    Async counterpart of `storage.Storage` for reading call status and
+    output. It shares its per-callset scan state with the process-wide
+    Storage of the same storage path.
+    """
+
+    def __init__(self, storage_path):
+        self.storage = get_storage_for_path(storage_path)
+        self.prefix = self.storage.prefix
+        backend_config = self.storage.get_storage_config()['backend_config']
+        if self.storage.backend_type == 'local':
+            self.backend_handler = AsyncLocalBackend(backend_config)
+        elif self.storage.backend_type == 's3' and aiobotocore_session is not None:
+            self.backend_handler = AsyncS3Backend(backend_config)
+        else:
+            self.backend_handler = SyncBackendAdapter(self.storage.backend_handler)
+
+    async def get_callset_status(self, callset_id, pending_call_ids=None):
+        """
+        Get the status of a callset, see `Storage.get_callset_status`.
+        :return: A list of call IDs that have updated status.
+        """
+        # pylint: disable=protected-access
+        status_prefix, start_after = self.storage._callset_scan_start(callset_id,
+                                                                      pending_call_ids)
+        if status_prefix is None:
+            return sorted(self.storage._callset_done_ids(callset_id))
+        keys = await self.backend_handler.list_keys_with_prefix(status_prefix, start_after)
+        return self.storage._callset_scan_done(callset_id, keys)
+
+    async def get_call_status(self, callset_id, call_id):
+        """
+        Get status of a call.
+        :return: A dictionary containing call's status, or None if no updated status
+        """
+        status_key = storage_utils.create_status_key(self.prefix, callset_id, call_id)
+        try:
+            data = await self.backend_handler.get_object(status_key)
+        except StorageNoSuchKeyError:
+            return None
+        return json.loads(data.decode('ascii'))
+
+    async def get_call_output(self, callset_id, call_id):
+        """
+        Get the output of a call.
+        :return: Output of the call.
+        """
+        output_key = storage_utils.create_output_key(self.prefix, callset_id, call_id)
+        try:
+            return await self.backend_handler.get_object(output_key)
+        except StorageNoSuchKeyError:
+            raise StorageOutputNotFoundError(callset_id, call_id)
+
+    async def get_call_status_and_output(self, callset_id, call_id):
+        """
+        Get the status and output of a call that writes a combined object.
+        :return: `(status, output)`, `(None, None)` if the call hasn't completed.
+        """
+        combined_key = storage_utils.create_combined_key(self.prefix, callset_id, call_id)
+        try:
+            data = await self.backend_handler.get_object(combined_key)
+        except StorageNoSuchKeyError:
+            return None, None
+        status, output = wrenutil.unpack_combined(data)
+        return json.loads(status.decode('ascii')), output
+
+    async def aclose(self):
+        """
+        Close the connections of the backend
+        """
+        await self.backend_handler.aclose()
+
+
+def get_async_storage(storage_path):
+    """
+    Return the AsyncStorage of a storage path for the current event loop
+    """
+    loop_storages = _async_storages.setdefault(asyncio.get_event_loop(), {})
+    key = tuple(storage_path)
+    if key not in loop_storages:
+        loop_storages[key] = AsyncStorage(storage_path)
+    return loop_storages[key]
+
+
+async def close_async_storages():
+    """
+    Close and forget the AsyncStorages of the current event loop. They are
+    opened again as needed.
+    """
+    loop_storages = _async_storages.pop(asyncio.get_event_loop(), {})
+    await asyncio.gather(*[s.aclose() for s in loop_storages.values()])
+
+
+async def map_async(executor, func, iterdata, **kwargs):
+    """
+    Async version of `Executor.map`. Serializing and invoking run in the
+    loop's default executor, so the event loop stays responsive.
+
+    :return: A list of futures, see `Executor.map`
+    """
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(None, functools.partial(executor.map, func, iterdata,
+                                                              **kwargs))
+
+
+async def _wait_for_status(future, storage):
+    """
+    Block until the status of the future's call is available, and return
+    `(status, output)`. The output is only fetched along with the status
+    for calls that write a combined object, else it is None.
+    """
+    notified = completion.notified(future)
+    poll_delays = future._poll_delays() # pylint: disable=protected-access
+    while True:
+        if future.combined_output:
+            call_status, call_output = await storage.get_call_status_and_output(
+                future.callset_id, future.invoke_call_id)
+        else:
+            call_status = await storage.get_call_status(future.callset_id,
+                                                        future.invoke_call_id)
+            call_output = None
+        future.status_query_count += 1
+        if call_status is not None:
+            return call_status, call_output
+        if notified:
+            # check storage again once we are notified, or every so often
+            # in case the notification got lost
+            deadline = time.time() + ResponseFuture.NOTIFIED_POLL_SECS
+            while time.time() < deadline and \
+                  not completion.done(future):
+                await asyncio.sleep(NOTIFIED_CHECK_SEC)
+            if completion.done(future):
+                # statuses show up right after the notification, but not
+                # necessarily right away
+                await asyncio.sleep(NOTIFIED_CHECK_SEC)
+        else:
+            await asyncio.sleep(next(poll_delays))
+
+
+async def result(future, throw_except=True):
+    """
+    Async version of `ResponseFuture.result`, also used by `await future`.
+    """
+    # pylint: disable=protected-access
+    if future._state == JobState.new:
+        raise ValueError("job not yet invoked")
+
+    if future._state in [JobState.success, JobState.error]:
+        # nothing left to fetch
+        return future.result(throw_except=throw_except)
+
+    storage = get_async_storage(future.storage_path)
+    call_status, call_output = await _wait_for_status(future, storage)
+    if not future._set_call_status(call_status, throw_except):
+        return None
+
+    call_output_time = time.time()
+    if future.combined_output:
+        if not call_output:
+            raise StorageOutputNotFoundError(future.callset_id, future.invoke_call_id)
+        call_invoker_result = future._load_output(call_output)
+    elif future.batch_index is None:
+        call_output = await storage.get_call_output(future.callset_id, future.call_id)
+        call_invoker_result = load_output(call_output)
+    else:
+        batch_outputs = future._batch_output.cached()
+        if batch_outputs is None:
+            call_output = await storage.get_call_output(future.callset_id,
+                                                        future.invoke_call_id)
+            batch_outputs = future._batch_output.set(call_output)
+        call_invoker_result = load_output(batch_outputs[future.batch_index])
+
+    return future._set_call_output(call_invoker_result, throw_except, call_output_time)
+
+
+async def get_all_results(fs):
+    """
+    Async version of `get_all_results`: the results of all the futures, in order.
+    """
+    return await asyncio.gather(*[result(f) for f in fs])
+
+
+class as_completed(object): # pylint: disable=invalid-name
+    """
+    Async iterator over futures, yielding each one as soon as it has
+    completed and its result has been fetched (so `f.result()` returns
+    right away). Completion is checked for all callsets at once, with one
+    listing per callset.
+
+    :param fs: A list of futures.
+    :param poll_interval: Time between storage checks for callsets that
+        don't get completion notifications. Default 5
+
+    Usage
+      >>> async for f in pywren.aio.as_completed(futures):
+      ...     print(f.result())
+    """
+
+    def __init__(self, fs, poll_interval=5):
+        self.poll_interval = poll_interval
+        self._pending = list(fs)
+        self._ready = deque()
+        self._last_scan = None
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while len(self._ready) == 0:
+            if len(self._pending) == 0:
+                raise StopAsyncIteration
+            await self._poll()
+        return self._ready.popleft()
+
+    def _scan_due(self):
+        if self._last_scan is None:
+            return True
+        notified = all(completion.notified(f) for f in self._pending)
+        interval = ResponseFuture.NOTIFIED_POLL_SECS if notified else self.poll_interval
+        return time.time() - self._last_scan >= interval
+
+    async def _poll(self):
+        # pylint: disable=protected-access
+        done_states = [JobState.success, JobState.error]
+        dones = [f for f in self._pending if f._state in done_states or
+                 completion.done(f)]
+
+        if len(dones) == 0 and self._scan_due():
+            self._last_scan = time.time()
+            storage = get_async_storage(self._pending[0].storage_path)
+            pending_call_ids = {}
+            for f in self._pending:
+                pending_call_ids.setdefault(f.callset_id, set()).add(f.invoke_call_id)
+            callset_ids = list(pending_call_ids.keys())
+            callset_statuses = await asyncio.gather(
+                *[storage.get_callset_status(c, pending_call_ids[c]) for c in callset_ids])
+            done_call_ids = set()
+            for callset_id, call_ids in zip(callset_ids, callset_statuses):
+                done_call_ids.update((callset_id, c) for c in call_ids)
+            dones = [f for f in self._pending
+                     if (f.callset_id, f.invoke_call_id) in done_call_ids]
+
+        if len(dones) == 0:
+            if any(completion.notified(f) for f in self._pending):
+                await asyncio.sleep(NOTIFIED_CHECK_SEC)
+            else:
+                await asyncio.sleep(max(0, self._last_scan + self.poll_interval - time.time()))
+            return
+
+        await asyncio.gather(*[result(f, throw_except=False) for f in dones
+                               if f._state not in done_states])
+        done_ids = set(id(f) for f in dones)
+        self._pending = [f for f in self._pending if id(f) not in done_ids]
+        self._ready.extend(dones)
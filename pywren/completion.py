@@ -0,0 +1,333 @@
+#
+# Copyright 2018 PyWren Team
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Completion notifications for invoked calls.
+
+Instead of repeatedly listing the callset in storage, `wait` and
+`ResponseFuture.result` can block until a completion channel tells us
+that a call has written its status. A channel is anything with a
+`receive(max_wait)` method returning a list of `(callset_id, call_id)`
+pairs and a `config()` method returning what the handler needs to publish
+to it (or None if jobs don't publish themselves).
+
+A `CompletionTracker` drains a channel in background threads and records
+completions here, for every callset registered with `register_callset`.
+Recording a completion marks the futures added with `add_future` as done,
+and hands the completion to every open `Subscription`, so waiters only
+look at the futures that completed rather than checking all of theirs.
+Completions of callsets that were not registered (e.g. left over from
+another client) are dropped, and a callset is forgotten once
+`close_callset` was called and its futures are all done, which its
+`on_finished` callback is told about.
+"""
+
+from __future__ import absolute_import
+
+import json
+import logging
+import threading
+import time
+
+import boto3
+from six.moves.queue import Queue, Empty
+
+logger = logging.getLogger(__name__)
+
+# guards _callsets and _subscriptions
+_lock = threading.Lock()
+# callset_id -> _Callset, for the callsets whose completions we record
+_callsets = {}
+# the open subscriptions, see Subscription
+_subscriptions = set()
+
+# one tracker per SQS queue, so trackers don't steal each other's messages
+_sqs_trackers = {}
+_sqs_trackers_lock = threading.Lock()
+
+
+class _Callset(object):
+    def __init__(self, on_finished):
+        self.on_finished = on_finished
+        # invoke call id -> futures waiting for its completion
+        self.futures = {}
+        # completions that came in before their futures were added
+        self.done_call_ids = set()
+        # set once no more calls will be invoked
+        self.closed = False
+
+    def finished(self):
+        return self.closed and len(self.futures) == 0
+
+
+def register_callset(callset_id, on_finished=None):
+    """
+    Start recording completions for `callset_id`. Must be called
+    before any of its calls are invoked.
+
+    :param on_finished: called with `callset_id` once the callset is closed
+                        and all its futures are done. Default None.
+    """
+    with _lock:
+        _callsets.setdefault(callset_id, _Callset(on_finished))
+
+
+def _finished(callsets):
+    for callset_id, callset in callsets:
+        if callset.on_finished is not None:
+            callset.on_finished(callset_id)
+
+
+def add_future(future):
+    """
+    Follow `future` of a registered callset, which is marked done (see
+    `done`) once its completion is recorded.
+    """
+    with _lock:
+        callset = _callsets.get(future.callset_id)
+        if callset is None:
+            return
+        future._completion_notified = True
+        if future.invoke_call_id in callset.done_call_ids:
+            future._completion_recorded = True
+        else:
+            callset.futures.setdefault(future.invoke_call_id, []).append(future)
+
+
+def close_callset(callset_id):
+    """
+    No more calls of `callset_id` will be invoked (and all its futures
+    were added), so forget about it once they are all done.
+    """
+    with _lock:
+        callset = _callsets.get(callset_id)
+        if callset is None:
+            return
+        callset.closed = True
+        # all the futures were added, so these are not needed anymore
+        callset.done_call_ids = set()
+        if not callset.finished():
+            return
+        del _callsets[callset_id]
+    _finished([(callset_id, callset)])
+
+
+def notified(future):
+    """
+    Return True if the completion of `future` is being tracked
+    """
+    return getattr(future, '_completion_notified', False)
+
+
+def done(future):
+    """
+    Return True if the completion of `future` was recorded
+    """
+    return getattr(future, '_completion_recorded', False)
+
+
+def record(completions):
+    """
+    Record a list of `(callset_id, call_id)` completions, marking their
+    futures done and handing the new ones to the subscriptions
+    """
+    new_completions = []
+    finished = []
+    with _lock:
+        for callset_id, call_id in completions:
+            callset = _callsets.get(callset_id)
+            if callset is None:
+                logger.debug("dropping completion of untracked callset {}".format(callset_id))
+                continue
+            futures = callset.futures.pop(call_id, None)
+            if futures is not None:
+                for f in futures:
+                    f._completion_recorded = True
+                if callset.finished():
+                    del _callsets[callset_id]
+                    finished.append((callset_id, callset))
+            elif callset.closed or call_id in callset.done_call_ids:
+                # already recorded
+                continue
+            else:
+                callset.done_call_ids.add(call_id)
+            new_completions.append((callset_id, call_id))
+        subscriptions = list(_subscriptions)
+    if len(new_completions) > 0:
+        for subscription in subscriptions:
+            subscription.queue.put(new_completions)
+    _finished(finished)
+
+
+class Subscription(object):
+    """
+    Receives the completions recorded while it is open, as lists of
+    `(callset_id, call_id)` put on `queue`.
+    """
+
+    def __init__(self, queue=None):
+        """
+        :param queue: queue to put the completions on, which a waiter may
+                      share with other events. Default a new queue.
+        """
+        self.queue = queue if queue is not None else Queue()
+        with _lock:
+            _subscriptions.add(self)
+
+    def get(self, timeout):
+        """
+        Return the completions recorded since the previous call,
+        waiting up to `timeout` seconds for some
+        """
+        try:
+            completions = list(self.queue.get(timeout=timeout))
+        except Empty:
+            return []
+        while True:
+            try:
+                completions.extend(self.queue.get_nowait())
+            except Empty:
+                return completions
+
+    def close(self):
+        with _lock:
+            _subscriptions.discard(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def wait_for(future, timeout):
+    """
+    Block until the completion of `future` is recorded, or `timeout`
+    seconds have passed.
+
+    :return: True if the future has completed.
+    """
+    deadline = time.time() + timeout
+    with Subscription() as subscription:
+        while not done(future):
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            subscription.get(remaining)
+    return done(future)
+
+
+class LocalCompletionChannel(object):
+    """
+    In-process channel, fed by invokers that learn about completions
+    themselves (see `invokers.LocalInvoker`).
+    """
+    receive_threads = 1
+
+    def __init__(self):
+        self._queue = Queue()
+
+    def publish(self, callset_id, call_id):
+        self._queue.put((callset_id, call_id))
+
+    def receive(self, max_wait):
+        try:
+            completions = [self._queue.get(timeout=max_wait)]
+        except Empty:
+            return []
+        while True:
+            try:
+                completions.append(self._queue.get_nowait())
+            except Empty:
+                return completions
+
+    def config(self): # pylint: disable=no-self-use
+        return None
+
+
+class SQSCompletionChannel(object):
+    """
+    SQS queue that `wrenhandler.generic_handler` publishes to after
+    writing each status object. The queue must only be used by one client.
+    """
+    # each receive returns at most 10 messages, so drain in parallel
+    receive_threads = 8
+
+    def __init__(self, region_name, sqs_queue_name):
+        self.region_name = region_name
+        self.sqs_queue_name = sqs_queue_name
+        sqs = boto3.resource('sqs', region_name=region_name)
+        self.queue = sqs.get_queue_by_name(QueueName=sqs_queue_name)
+
+    def receive(self, max_wait):
+        messages = self.queue.receive_messages(WaitTimeSeconds=min(int(max_wait), 20),
+                                               MaxNumberOfMessages=10)
+        if len(messages) == 0:
+            return []
+        completions = []
+        for m in messages:
+            body = json.loads(m.body)
+            completions.append((body['callset_id'], body['call_id']))
+        self.queue.delete_messages(Entries=[{'Id' : str(i), 'ReceiptHandle' : m.receipt_handle}
+                                            for i, m in enumerate(messages)])
+        return completions
+
+    def config(self):
+        return {'type' : 'sqs',
+                'region_name' : self.region_name,
+                'queue_url' : self.queue.url}
+
+
+class CompletionTracker(object):
+    """
+    Drains a completion channel in daemon threads, recording everything
+    it receives.
+    """
+    RECEIVE_WAIT_SEC = 20
+    ERROR_SLEEP_SEC = 5
+
+    def __init__(self, channel):
+        self.channel = channel
+        self.threads = []
+        for _ in range(channel.receive_threads):
+            t = threading.Thread(target=self._receive_loop)
+            t.daemon = True
+            t.start()
+            self.threads.append(t)
+
+    def _receive_loop(self):
+        while True:
+            try:
+                completions = self.channel.receive(self.RECEIVE_WAIT_SEC)
+            except Exception as e: # pylint: disable=broad-except
+                # waiters fall back to polling storage, so just keep going
+                logger.warning("error receiving completions: {}".format(e))
+                time.sleep(self.ERROR_SLEEP_SEC)
+                continue
+            if len(completions) > 0:
+                record(completions)
+
+
+def sqs_tracker(region_name, sqs_queue_name):
+    """
+    Return the (shared) tracker of an SQS completion queue
+    """
+    with _sqs_trackers_lock:
+        key = (region_name, sqs_queue_name)
+        if key not in _sqs_trackers:
+            channel = SQSCompletionChannel(region_name, sqs_queue_name)
+            _sqs_trackers[key] = CompletionTracker(channel)
+        return _sqs_trackers[key]
@@ -17,29 +17,37 @@
 from __future__ import absolute_import
 from __future__ import print_function
 
+import hashlib
+import itertools
 import logging
 import random
+import threading
 import time
 from multiprocessing.pool import ThreadPool
 from six.moves import cPickle as pickle
 
 import boto3
 
+import pywren.completion as completion
 import pywren.runtime as runtime
 import pywren.storage as storage
 import pywren.version as version
 import pywren.wrenconfig as wrenconfig
 import pywren.wrenutil as wrenutil
 
-from pywren.future import ResponseFuture, JobState
-from pywren.serialize import serialize, create_mod_data
+from pywren.future import (BatchOutput, FutureStream, ResponseFuture, JobState, fetch_results,
+                           runtime_change_count)
+from pywren.serialize import serialize, create_mod_zip
 from pywren.storage import storage_utils
-from pywren.storage.storage_utils import create_func_key
-from pywren.wait import wait, ALL_COMPLETED
+from pywren.wait import wait, ANY_COMPLETED
 
 
 logger = logging.getLogger(__name__)
 
+STREAM_WINDOW_SIZE = 1000
+# how long a looked up runtime ETag is used for
+RUNTIME_ETAG_TTL_SEC = 60
+
 
 """
 Theoretically will allow for cross-AZ invocations
@@ -52,20 +60,61 @@ class Executor(object):
 
         self.config = config
         self.storage_config = wrenconfig.extract_storage_config(self.config)
-        self.storage = storage.Storage(self.storage_config)
+        self.storage = storage.get_storage(self.storage_config)
         self.runtime_meta_info = runtime.get_runtime_info(config['runtime'])
-
-
+        # runtime url -> (ETag, lookup time, runtime_change_count() then),
+        # looked up now and then rather than by every invocation
+        self._runtime_etags = {}
+        # runtime url -> lock held while looking it up, so it's only looked up once
+        self._runtime_etag_url_locks = {}
+        self._runtime_etags_lock = threading.Lock()
+
+
+        # optional file caching the imports of module files, across processes
+        import_cache_path = self.config.get('scheduler', {}).get('import_cache_path')
+        # pickle map data and outputs with out-of-band buffers (protocol 5)
+        self.out_of_band_buffers = self.config.get('scheduler', {}).get('out_of_band_buffers',
+                                                                        False)
         if 'preinstalls' in self.runtime_meta_info:
             logger.info("using serializer with meta-supplied preinstalls")
-            self.serializer = serialize.SerializeIndependent(self.runtime_meta_info['preinstalls'])
+            self.serializer = serialize.SerializeIndependent(self.runtime_meta_info['preinstalls'],
+                                                             import_cache_path,
+                                                             self.out_of_band_buffers)
         else:
-            self.serializer = serialize.SerializeIndependent()
+            self.serializer = serialize.SerializeIndependent(
+                import_cache_path=import_cache_path,
+                out_of_band_buffers=self.out_of_band_buffers)
+
+        # completion notifications, so waiting doesn't have to poll storage
+        self.completion_tracker = None
+        if getattr(invoker, 'completion_channel', None) is not None:
+            self.completion_tracker = completion.CompletionTracker(invoker.completion_channel)
+        elif 'completion' in self.config:
+            self.completion_tracker = completion.sqs_tracker(
+                config['account']['aws_region'], config['completion']['sqs_queue_name'])
 
         self.map_item_limit = None
+        # calls write their status and output as a single object
+        self.combined_output = False
         if 'scheduler' in self.config:
             if 'map_item_limit' in config['scheduler']:
                 self.map_item_limit = config['scheduler']['map_item_limit']
+            self.combined_output = config['scheduler'].get('combined_output', False)
+
+    def shutdown(self):
+        """
+        Release the resources of the invoker, e.g. the worker processes of
+        a local executor, once the queued calls are done. The executor can't
+        invoke calls afterwards.
+        """
+        if hasattr(self.invoker, 'shutdown'):
+            self.invoker.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
 
     def put_data(self, data_key, data_str,
                  callset_id, call_id):
@@ -74,12 +123,47 @@ class Executor(object):
         logger.info("call_async {} {} data upload complete {}".format(callset_id, call_id,
                                                                       data_key))
 
+    def get_runtime_etag(self, runtime_url):
+        """
+        Get the ETag of the runtime (shard) at `runtime_url`, which is looked
+        up again every RUNTIME_ETAG_TTL_SEC, or once a call failed because the
+        runtime changed.
+        :param runtime_url: runtime url passed to the handler, "" for the runtime of the config
+        :return: ETag of the runtime, or None for a local runtime
+        """
+        def cached_etag():
+            with self._runtime_etags_lock:
+                cached = self._runtime_etags.get(runtime_url)
+            if cached is not None and time.time() - cached[1] < RUNTIME_ETAG_TTL_SEC \
+               and cached[2] == runtime_change_count():
+                return cached
+            return None
+
+        cached = cached_etag()
+        if cached is not None:
+            return cached[0]
+        with self._runtime_etags_lock:
+            url_lock = self._runtime_etag_url_locks.setdefault(runtime_url, threading.Lock())
+        # concurrent invocations wait for one of them to look it up, without
+        # holding up those of other runtime urls
+        with url_lock:
+            cached = cached_etag()
+            if cached is not None:
+                return cached[0]
+            lookup_time = time.time()
+            change_n = runtime_change_count()
+            runtime_etag = storage.get_runtime_etag(self.config['runtime'], runtime_url)
+            with self._runtime_etags_lock:
+                self._runtime_etags[runtime_url] = (runtime_etag, lookup_time, change_n)
+            return runtime_etag
+
     def invoke_with_keys(self, func_key, data_key, output_key,
                          status_key,
                          callset_id, call_id, extra_env,
                          extra_meta, data_byte_range, use_cached_runtime,
                          host_job_meta, job_max_runtime,
-                         overwrite_invoke_args=None):
+                         overwrite_invoke_args=None,
+                         batch_call_ids=None, data_byte_ranges=None):
 
         # Pick a runtime url if we have shards.
         # If not the handler will construct it
@@ -107,6 +191,27 @@ class Executor(object):
             'pywren_version' : version.__version__,
             'runtime_url' : runtime_url}
 
+        runtime_etag = self.get_runtime_etag(runtime_url)
+        if runtime_etag is not None:
+            arg_dict['runtime_etag'] = runtime_etag
+
+        if self.combined_output:
+            arg_dict['combined_output'] = True
+        if self.out_of_band_buffers:
+            arg_dict['out_of_band_buffers'] = True
+        if 'archive_format' in self.runtime_meta_info:
+            arg_dict['runtime_archive_format'] = self.runtime_meta_info['archive_format']
+
+        if self.completion_tracker is not None:
+            channel_config = self.completion_tracker.channel.config()
+            if channel_config is not None:
+                arg_dict['completion_channel'] = channel_config
+
+        if batch_call_ids is not None:
+            # several map items packed into one invocation, see `map(chunksize=...)`
+            arg_dict['batch_call_ids'] = batch_call_ids
+            arg_dict['data_byte_ranges'] = data_byte_ranges
+
         if extra_env is not None:
             logger.debug("Extra environment vars {}".format(extra_env))
             arg_dict['extra_env'] = extra_env
@@ -144,8 +249,10 @@ class Executor(object):
 
         storage_path = storage_utils.get_storage_path(self.storage_config)
         fut = ResponseFuture(call_id, callset_id, host_job_meta, storage_path)
+        fut.combined_output = self.combined_output
 
         fut._set_state(JobState.invoked)
+        completion.add_future(fut)
 
         return fut
 
@@ -155,28 +262,38 @@ class Executor(object):
 
     @staticmethod
     def agg_data(data_strs):
+        """
+        Lay out `data_strs` back to back in one object. The object is returned
+        as the list of its parts, which `Storage.put_data` only joins if it is
+        small, so large data is never copied.
+        :return: `(parts, ranges)`, with the inclusive byte range of each item
+        """
         ranges = []
         pos = 0
         for datum in data_strs:
             l = len(datum)
             ranges.append((pos, pos + l -1))
             pos += l
-        return b"".join(data_strs), ranges
+        return list(data_strs), ranges
 
     def map(self, func, iterdata, extra_env=None, extra_meta=None,
-            invoke_pool_threads=64, data_all_as_one=True,
+            invoke_pool_threads=None, data_all_as_one=True,
             use_cached_runtime=True, overwrite_invoke_args=None,
-            exclude_modules=None):
+            exclude_modules=None, chunksize=1):
         """
         :param func: the function to map over the data
         :param iterdata: An iterable of input data
         :param extra_env: Additional environment variables for lambda environment. Default None.
         :param extra_meta: Additional metadata to pass to lambda. Default None.
-        :param invoke_pool_threads: Number of threads to use to invoke.
+        :param invoke_pool_threads: Number of threads to use to invoke. Default None,
+            which uses the shared I/O pool (see `wrenutil.get_io_pool`).
         :param data_all_as_one: upload the data as a single object. Default True
         :param use_cached_runtime: Use cached runtime whenever possible. Default true
         :param overwrite_invoke_args: Overwrite other args. Mainly used for testing.
         :param exclude_modules: Explicitly keep these modules from pickled dependencies.
+        :param chunksize: Number of consecutive items run by each invocation. Use this
+            for fine-grained functions where per-invocation overhead dominates. Each
+            item still gets its own future. Default 1
         :return: A list with size `len(iterdata)` of futures for each job
         :rtype:  list of futures.
 
@@ -188,135 +305,460 @@ class Executor(object):
         if not data:
             return []
 
-        if self.map_item_limit is not None and len(data) > self.map_item_limit:
-            raise ValueError("len(data) ={}, exceeding map item limit of {}"\
-                             "consider mapping over a smaller"\
-                             "number of items".format(len(data),
-                                                      self.map_item_limit))
+        self._check_map_item_limit(len(data))
+        self._check_chunksize(chunksize)
 
         host_job_meta = {}
 
-        pool = ThreadPool(invoke_pool_threads)
-        callset_id = wrenutil.create_callset_id()
+        pool = self._get_invoke_pool(invoke_pool_threads)
+        callset_id = self._create_callset_id()
 
         ### pickle func and all data (to capture module dependencies
         func_and_data_ser, mod_paths = self.serializer([func] + data)
 
         func_str = func_and_data_ser[0]
         data_strs = func_and_data_ser[1:]
+
+        agg_data_key = storage_utils.create_agg_data_key(self.storage.prefix, callset_id)
+        agg_data_key, agg_data_ranges = self._upload_data(agg_data_key, data_strs,
+                                                          data_all_as_one, host_job_meta)
+
+        func_key = self._upload_func(func_str, mod_paths, exclude_modules, host_job_meta)
+
+        invoke_kwargs = {'extra_env' : extra_env,
+                         'extra_meta' : extra_meta,
+                         'use_cached_runtime' : use_cached_runtime,
+                         'overwrite_invoke_args' : overwrite_invoke_args}
+
+        call_ids = ["{:05d}".format(i) for i in range(len(data))]
+        try:
+            call_result_objs = self._invoke_calls(pool, data_strs, call_ids, callset_id,
+                                                  func_key, host_job_meta, agg_data_key,
+                                                  agg_data_ranges, invoke_kwargs, chunksize)
+
+            res = [f for c in call_result_objs for f in c.get()]
+        finally:
+            completion.close_callset(callset_id)
+        if invoke_pool_threads is not None:
+            pool.close()
+            pool.join()
+        logger.info("map invoked {} {} pool join".format(callset_id, call_ids[-1]))
+
+        # FIXME take advantage of the callset to return a lot of these
+
+        # note these are just the invocation futures
+
+        return res
+
+    def map_stream(self, func, iterdata, window_size=STREAM_WINDOW_SIZE,
+                   extra_env=None, extra_meta=None,
+                   invoke_pool_threads=None, data_all_as_one=True,
+                   use_cached_runtime=True, overwrite_invoke_args=None,
+                   exclude_modules=None, chunksize=1):
+        """
+        Streaming version of `map` for large or unbounded iterables.
+
+        `iterdata` is consumed `window_size` items at a time. Each window is
+        pickled, uploaded and invoked while the next one is being pickled, so
+        only about two windows of serialized data are held in memory at once
+        and the first invocations go out as soon as the first window is ready.
+
+        The function (and its module dependencies) is uploaded once, with
+        the first window. If a later window pulls in modules that were not
+        seen before, an updated function object is uploaded for that window.
+
+        :param func: the function to map over the data
+        :param iterdata: An iterable (or generator) of input data
+        :param window_size: Number of items serialized and invoked together. Default 1000
+        :param extra_env: Additional environment variables for lambda environment. Default None.
+        :param extra_meta: Additional metadata to pass to lambda. Default None.
+        :param invoke_pool_threads: Number of threads to use to invoke. Default None,
+            which uses the shared I/O pool (see `wrenutil.get_io_pool`).
+        :param data_all_as_one: upload each window's data as a single object. Default True
+        :param use_cached_runtime: Use cached runtime whenever possible. Default true
+        :param overwrite_invoke_args: Overwrite other args. Mainly used for testing.
+        :param exclude_modules: Explicitly keep these modules from pickled dependencies.
+        :param chunksize: Number of consecutive items run by each invocation. Default 1
+        :return: A `FutureStream` that grows as windows are invoked
+        :rtype: FutureStream
+
+        Usage
+          >>> futures = pwex.map_stream(foo, data_generator())
+          >>> for f in futures:
+          ...     print(f.result())
+        """
+        if window_size < 1:
+            raise ValueError("window_size must be at least 1, got {}".format(window_size))
+        self._check_chunksize(chunksize)
+
+        invoke_kwargs = {'extra_env' : extra_env,
+                         'extra_meta' : extra_meta,
+                         'use_cached_runtime' : use_cached_runtime,
+                         'overwrite_invoke_args' : overwrite_invoke_args}
+
+        future_stream = FutureStream(self._create_callset_id())
+        producer = threading.Thread(target=self._stream_windows,
+                                    args=(func, iterdata, window_size, future_stream,
+                                          invoke_pool_threads, data_all_as_one,
+                                          exclude_modules, invoke_kwargs, chunksize))
+        producer.daemon = True
+        producer.start()
+
+        return future_stream
+
+    def map_async(self, func, iterdata, **kwargs):
+        """
+        Coroutine version of `map`, see `pywren.aio` (python 3.5+). Takes
+        the same arguments as `map`.
+
+        Usage
+          >>> futures = await pwex.map_async(foo, data_list)
+          >>> results = await pywren.aio.get_all_results(futures)
+        """
+        from pywren import aio
+        return aio.map_async(self, func, iterdata, **kwargs)
+
+    def _stream_windows(self, func, iterdata, window_size, future_stream,
+                        invoke_pool_threads, data_all_as_one,
+                        exclude_modules, invoke_kwargs, chunksize):
+        """
+        Producer for `map_stream`: serialize window i+1 while window i is
+        being uploaded and invoked by a dispatch thread.
+        """
+        callset_id = future_stream.callset_id
+        pool = self._get_invoke_pool(invoke_pool_threads)
+        dispatch_thread = None
+        dispatch_errors = []
+
+        def dispatch(window_i, data_strs, call_ids, func_key, host_job_meta):
+            try:
+                agg_data_key = storage_utils.create_agg_data_key(self.storage.prefix,
+                                                                 callset_id, window_i)
+                agg_data_key, agg_data_ranges = self._upload_data(agg_data_key, data_strs,
+                                                                  data_all_as_one,
+                                                                  host_job_meta)
+                call_result_objs = self._invoke_calls(pool, data_strs, call_ids, callset_id,
+                                                      func_key, host_job_meta, agg_data_key,
+                                                      agg_data_ranges, invoke_kwargs, chunksize)
+                future_stream._extend([f for c in call_result_objs for f in c.get()])
+                logger.info("map_stream {} window {} invoked".format(callset_id, window_i))
+            except Exception as e: # pylint: disable=broad-except
+                dispatch_errors.append(e)
+
+        try:
+            data_iter = iter(iterdata)
+            func_key = None
+            uploaded_mod_paths = set()
+            call_n = 0
+            window_i = 0
+            while True:
+                window = list(itertools.islice(data_iter, window_size))
+                if not window:
+                    break
+                self._check_map_item_limit(call_n + len(window))
+
+                host_job_meta = {}
+                if func_key is None:
+                    func_and_data_ser, mod_paths = self.serializer([func] + window)
+                    func_str = func_and_data_ser[0]
+                    data_strs = func_and_data_ser[1:]
+                else:
+                    data_strs, mod_paths = self.serializer(window)
+
+                new_mod_paths = set(mod_paths) - uploaded_mod_paths
+                if func_key is None or new_mod_paths:
+                    uploaded_mod_paths.update(mod_paths)
+                    func_key = self._upload_func(func_str, set(uploaded_mod_paths),
+                                                 exclude_modules, host_job_meta)
+
+                call_ids = ["{:05d}".format(i) for i in range(call_n, call_n + len(window))]
+                call_n += len(window)
+                del window
+
+                # keep at most one window in flight while we pickle the next
+                if dispatch_thread is not None:
+                    dispatch_thread.join()
+                if dispatch_errors:
+                    raise dispatch_errors[0]
+
+                dispatch_thread = threading.Thread(target=dispatch,
+                                                   args=(window_i, data_strs, call_ids,
+                                                         func_key, host_job_meta))
+                dispatch_thread.start()
+                del data_strs
+                window_i += 1
+
+            if dispatch_thread is not None:
+                dispatch_thread.join()
+            if dispatch_errors:
+                raise dispatch_errors[0]
+            future_stream._close()
+        except Exception as e: # pylint: disable=broad-except
+            logger.error("map_stream {} failed after {} calls: {}".format(
+                callset_id, len(future_stream), e))
+            if dispatch_thread is not None:
+                dispatch_thread.join()
+            future_stream._close(e)
+        finally:
+            completion.close_callset(callset_id)
+            if invoke_pool_threads is not None:
+                pool.close()
+                pool.join()
+
+    @staticmethod
+    def _get_invoke_pool(invoke_pool_threads):
+        if invoke_pool_threads is None:
+            return wrenutil.get_io_pool()
+        return ThreadPool(invoke_pool_threads)
+
+    def _create_callset_id(self):
+        callset_id = wrenutil.create_callset_id()
+        if self.completion_tracker is not None:
+            completion.register_callset(callset_id, self.storage.forget_callset)
+        return callset_id
+
+    @staticmethod
+    def _check_chunksize(chunksize):
+        if chunksize < 1:
+            raise ValueError("chunksize must be at least 1, got {}".format(chunksize))
+
+    def _check_map_item_limit(self, n):
+        if self.map_item_limit is not None and n > self.map_item_limit:
+            raise ValueError("len(data) ={}, exceeding map item limit of {}"\
+                             "consider mapping over a smaller"\
+                             "number of items".format(n,
+                                                      self.map_item_limit))
+
+    def _upload_data(self, agg_data_key, data_strs, data_all_as_one, host_job_meta):
+        """
+        Upload `data_strs` as a single aggregate object if they are small
+        enough. Returns `(agg_data_key, agg_data_ranges)`, or `(None, None)`
+        if every call should upload its own data object.
+        """
         data_size_bytes = sum(len(x) for x in data_strs)
-        agg_data_key = None
         host_job_meta['agg_data'] = False
         host_job_meta['data_size_bytes'] = data_size_bytes
 
         if data_size_bytes < wrenconfig.MAX_AGG_DATA_SIZE and data_all_as_one:
-            agg_data_key = storage_utils.create_agg_data_key(self.storage.prefix, callset_id)
-            agg_data_bytes, agg_data_ranges = self.agg_data(data_strs)
+            agg_data_parts, agg_data_ranges = self.agg_data(data_strs)
             agg_upload_time = time.time()
-            self.storage.put_data(agg_data_key, agg_data_bytes)
+            self.storage.put_data(agg_data_key, agg_data_parts)
             host_job_meta['agg_data'] = True
             host_job_meta['data_upload_time'] = time.time() - agg_upload_time
             host_job_meta['data_upload_timestamp'] = time.time()
-        else:
-            # FIXME add warning that you wanted data all as one but
-            # it exceeded max data size
-            pass
+            return agg_data_key, agg_data_ranges
+
+        # FIXME add warning that you wanted data all as one but
+        # it exceeded max data size
+        return None, None
 
+    def _upload_func(self, func_str, mod_paths, exclude_modules, host_job_meta):
+        """
+        Upload the function and its modules as content-addressed blobs,
+        skipping whatever is already in storage, e.g. from a previous map.
+        The modules are zipped into a blob of their own, so they are shared
+        by different functions and jobs can cache the zip by its hash.
+        :return: key of the function blob
+        """
         if exclude_modules:
             for module in exclude_modules:
                 for mod_path in list(mod_paths):
                     if module in mod_path and mod_path in mod_paths:
                         mod_paths.remove(mod_path)
 
-        module_data = create_mod_data(mod_paths)
+        module_zip = create_mod_zip(mod_paths)
+        module_zip_hash = hashlib.sha256(module_zip).hexdigest()
         ### Create func and upload
-        func_module_str = pickle.dumps({'func' : func_str,
-                                        'module_data' : module_data}, -1)
-        host_job_meta['func_module_str_len'] = len(func_module_str)
-
         func_upload_time = time.time()
-        func_key = create_func_key(self.storage.prefix, callset_id)
-        self.storage.put_func(func_key, func_module_str)
+        module_zip_key, module_zip_uploaded = self.storage.put_blob(module_zip_hash,
+                                                                    module_zip)
+        func_module_str = pickle.dumps({'func' : func_str,
+                                        'module_zip_key' : module_zip_key,
+                                        'module_zip_hash' : module_zip_hash}, -1)
+        func_key, func_uploaded = self.storage.put_blob(
+            hashlib.sha256(func_module_str).hexdigest(), func_module_str)
         host_job_meta['func_upload_time'] = time.time() - func_upload_time
         host_job_meta['func_upload_timestamp'] = time.time()
-        def invoke(data_str, callset_id, call_id, func_key,
-                   host_job_meta,
-                   agg_data_key=None, data_byte_range=None):
-            data_key, output_key, status_key \
-                = storage_utils.create_keys(self.storage.prefix, callset_id, call_id)
-
-            host_job_meta['job_invoke_timestamp'] = time.time()
-
-            if agg_data_key is None:
-                data_upload_time = time.time()
-                self.put_data(data_key, data_str,
-                              callset_id, call_id)
-                data_upload_time = time.time() - data_upload_time
-                host_job_meta['data_upload_time'] = data_upload_time
-                host_job_meta['data_upload_timestamp'] = time.time()
-
-                data_key = data_key
-            else:
-                data_key = agg_data_key
-
-            return self.invoke_with_keys(func_key, data_key,
-                                         output_key,
-                                         status_key,
-                                         callset_id, call_id, extra_env,
-                                         extra_meta, data_byte_range,
-                                         use_cached_runtime, host_job_meta.copy(),
-                                         self.job_max_runtime,
-                                         overwrite_invoke_args=overwrite_invoke_args)
-
-        N = len(data)
+
+        host_job_meta['func_module_str_len'] = len(func_module_str) + len(module_zip)
+        host_job_meta['func_uploaded'] = func_uploaded
+        host_job_meta['module_zip_uploaded'] = module_zip_uploaded
+        return func_key
+
+    def _invoke_calls(self, pool, data_strs, call_ids, callset_id, func_key,
+                      host_job_meta, agg_data_key, agg_data_ranges, invoke_kwargs,
+                      chunksize=1):
+        """
+        Invoke the calls for `data_strs` on `pool`, packing up to `chunksize`
+        consecutive items into each invocation. Returns the list of
+        `AsyncResult`s, each of which resolves to a list of futures.
+        """
         call_result_objs = []
-        for i in range(N):
-            call_id = "{:05d}".format(i)
+        for i in range(0, len(call_ids), chunksize):
+            batch = slice(i, i + chunksize)
 
-            data_byte_range = None
+            data_byte_ranges = None
             if agg_data_key is not None:
-                data_byte_range = agg_data_ranges[i]
+                data_byte_ranges = agg_data_ranges[batch]
 
-            cb = pool.apply_async(invoke, (data_strs[i], callset_id,
-                                           call_id, func_key,
-                                           host_job_meta.copy(),
-                                           agg_data_key,
-                                           data_byte_range))
+            cb = pool.apply_async(self._invoke_call, (data_strs[batch], callset_id,
+                                                      call_ids[batch], func_key,
+                                                      host_job_meta.copy(),
+                                                      agg_data_key,
+                                                      data_byte_ranges),
+                                  invoke_kwargs)
 
-            logger.info("map {} {} apply async".format(callset_id, call_id))
+            logger.info("map {} {} apply async".format(callset_id, call_ids[i]))
 
             call_result_objs.append(cb)
+        return call_result_objs
 
-        res = [c.get() for c in call_result_objs]
-        pool.close()
-        pool.join()
-        logger.info("map invoked {} {} pool join".format(callset_id, call_id))
-
-        # FIXME take advantage of the callset to return a lot of these
-
-        # note these are just the invocation futures
+    def _invoke_call(self, data_strs, callset_id, call_ids, func_key,
+                     host_job_meta, agg_data_key=None, data_byte_ranges=None,
+                     extra_env=None, extra_meta=None, use_cached_runtime=True,
+                     overwrite_invoke_args=None):
+        """
+        Upload data if necessary and invoke a single call running the items
+        `call_ids`. The status and output of a batched invocation are stored
+        under the first call id. Returns the list of futures, one per item.
+        """
+        invoke_call_id = call_ids[0]
+        data_key, output_key, status_key \
+            = storage_utils.create_keys(self.storage.prefix, callset_id, invoke_call_id)
+        if self.combined_output:
+            status_key = storage_utils.create_combined_key(self.storage.prefix, callset_id,
+                                                           invoke_call_id)
+            output_key = status_key
+
+        host_job_meta['job_invoke_timestamp'] = time.time()
+
+        if agg_data_key is None:
+            if len(call_ids) == 1:
+                data_str = data_strs[0]
+            else:
+                data_str, data_byte_ranges = self.agg_data(data_strs)
+            data_upload_time = time.time()
+            self.put_data(data_key, data_str,
+                          callset_id, invoke_call_id)
+            data_upload_time = time.time() - data_upload_time
+            host_job_meta['data_upload_time'] = data_upload_time
+            host_job_meta['data_upload_timestamp'] = time.time()
 
-        return res
+            data_key = data_key
+        else:
+            data_key = agg_data_key
+
+        if len(call_ids) == 1:
+            data_byte_range = None if data_byte_ranges is None else data_byte_ranges[0]
+            fut = self.invoke_with_keys(func_key, data_key,
+                                        output_key,
+                                        status_key,
+                                        callset_id, invoke_call_id, extra_env,
+                                        extra_meta, data_byte_range,
+                                        use_cached_runtime, host_job_meta.copy(),
+                                        self.job_max_runtime,
+                                        overwrite_invoke_args=overwrite_invoke_args)
+            return [fut]
+
+        invoke_fut = self.invoke_with_keys(func_key, data_key,
+                                           output_key,
+                                           status_key,
+                                           callset_id, invoke_call_id, extra_env,
+                                           extra_meta, None,
+                                           use_cached_runtime, host_job_meta.copy(),
+                                           self.job_max_runtime,
+                                           overwrite_invoke_args=overwrite_invoke_args,
+                                           batch_call_ids=list(call_ids),
+                                           data_byte_ranges=list(data_byte_ranges))
+
+        batch_output = BatchOutput()
+        futures = []
+        for batch_index, call_id in enumerate(call_ids):
+            fut = ResponseFuture(call_id, callset_id, invoke_fut._invoke_metadata,
+                                 invoke_fut.storage_path)
+            fut._set_batch(invoke_call_id, batch_index, batch_output)
+            fut.combined_output = invoke_fut.combined_output
+            fut._set_state(JobState.invoked)
+            completion.add_future(fut)
+            futures.append(fut)
+        return futures
 
     def reduce(self, function, list_of_futures,
-               extra_env=None, extra_meta=None):
+               extra_env=None, extra_meta=None, fan_in=None):
         """
         Apply a function across all futures.
 
+        :param function: the function applied to the list of results.
+        :param list_of_futures: the futures to reduce.
+        :param extra_env: Additional environment variables for lambda environment. Default None.
+        :param extra_meta: Additional metadata to pass to lambda. Default None.
+        :param fan_in: Reduce as a tree, each call reducing at most `fan_in` results
+            (or partial reductions). `function` must then be associative, that is
+            `function([function(xs), function(ys)]) == function(xs + ys)`, like `sum`.
+            Each call is invoked as soon as its inputs are done. Default None, a
+            single call reduces all the results.
+        :return: A future for the result of the reduction.
+
+        Usage
+          >>> futures = pwex.map(foo, data_list)
+          >>> total = pwex.reduce(sum, futures, fan_in=16).result()
+
         # FIXME change to lazy iterator
         """
-        #if self.invoker.TIME_LIMIT:
-        wait(list_of_futures, return_when=ALL_COMPLETED) # avoid race condition
+        list_of_futures = list(list_of_futures)
+        if fan_in is not None and fan_in < 2:
+            raise ValueError("fan_in must be at least 2")
 
         def reduce_func(fut_list):
-            # FIXME speed this up for big reduce
-            accum_list = []
-            for f in fut_list:
-                accum_list.append(f.result())
-            return function(accum_list)
-
-        return self.call_async(reduce_func, list_of_futures,
-                               extra_env=extra_env, extra_meta=extra_meta)
+            # fetch all the inputs at once
+            return function(fetch_results(fut_list))
+
+        if len(list_of_futures) == 0:
+            return self.call_async(reduce_func, list_of_futures,
+                                   extra_env=extra_env, extra_meta=extra_meta)
+        if fan_in is None:
+            fan_in = len(list_of_futures)
+
+        # the size of each level of the tree, the last being the root
+        level_sizes = [len(list_of_futures)]
+        while len(level_sizes) == 1 or level_sizes[-1] > 1:
+            level_sizes.append((level_sizes[-1] + fan_in - 1) // fan_in)
+        levels = [list_of_futures] + [[None] * n for n in level_sizes[1:]]
+
+        # call j of level l + 1 reduces futures [j * fan_in, (j + 1) * fan_in)
+        # of level l. it is invoked once they are all done, avoiding any
+        # race condition on their output
+        # (the same future may be passed in more than once)
+        positions = {}
+        pending = []
+        for i, f in enumerate(list_of_futures):
+            if id(f) not in positions:
+                positions[id(f)] = []
+                pending.append(f)
+            positions[id(f)].append((0, i))
+        dones_per_call = {}
+        while levels[-1][0] is None:
+            fs_dones, pending = wait(pending, return_when=ANY_COMPLETED,
+                                     fetch_results=False)
+
+            ready_calls = []
+            for level, i in [p for f in fs_dones for p in positions[id(f)]]:
+                j = i // fan_in
+                dones_per_call[(level, j)] = dones_per_call.get((level, j), 0) + 1
+                if dones_per_call[(level, j)] == len(levels[level][j * fan_in:
+                                                                   (j + 1) * fan_in]):
+                    ready_calls.append((level, j))
+
+            for level, j in ready_calls:
+                children = levels[level][j * fan_in:(j + 1) * fan_in]
+                f = self.call_async(reduce_func, children,
+                                    extra_env=extra_env, extra_meta=extra_meta)
+                levels[level + 1][j] = f
+                positions[id(f)] = [(level + 1, j)]
+                if level + 1 < len(levels) - 1:
+                    pending.append(f)
+
+        return levels[-1][0]
 
     def get_logs(self, future, verbose=True):
 
@@ -17,7 +17,9 @@
 from __future__ import absolute_import
 from __future__ import print_function
 
+import collections
 import logging
+import threading
 import time
 
 import enum
@@ -29,13 +31,54 @@ try:
 except:
     import pickle
 
-from pywren import wrenconfig
+from pywren import completion, wrenutil
+from pywren.serialize.util import loads_out_of_band
 from pywren.storage import storage, storage_utils
+from pywren.storage.exceptions import StorageOutputNotFoundError
 
 pickling_support.install()
 
 logger = logging.getLogger(__name__)
 
+try:
+    TimeoutError = TimeoutError # pylint: disable=redefined-builtin,invalid-name
+except NameError:
+    class TimeoutError(Exception): # pylint: disable=redefined-builtin
+        """
+        Raised by `ResponseFuture.result` when the call hasn't completed in
+        time (python 2 has no builtin TimeoutError).
+        """
+        pass
+
+# how many recent call runtimes to keep per callset
+RUNTIME_SAMPLES = 128
+# how many of the most recent callsets to keep runtimes for
+RUNTIME_CALLSETS = 64
+# callset_id -> recent runtimes (from submission to end of the call),
+# used to schedule status polls, see ResponseFuture._poll_delays
+_callset_runtimes = collections.OrderedDict()
+_callset_runtimes_lock = threading.Lock()
+
+# how many calls have failed because their runtime changed after its ETag
+# was looked up, so executors know to look it up again
+_runtime_change_n = 0
+_runtime_change_lock = threading.Lock()
+
+def runtime_change_count():
+    """
+    Return how many calls have failed with RUNTIME_CHANGED so far
+    """
+    return _runtime_change_n
+
+def _runtime_changed():
+    global _runtime_change_n # pylint: disable=global-statement
+    with _runtime_change_lock:
+        _runtime_change_n += 1
+
+# guards the done callbacks of all futures (futures themselves get pickled,
+# so they can't hold a lock)
+_done_callbacks_lock = threading.Lock()
+
 class JobState(enum.Enum):
     new = 1
     invoked = 2
@@ -50,6 +93,15 @@ class ResponseFuture(object):
     execution and the result when available.
     """
     GET_RESULT_SLEEP_SECS = 4
+    # status polls start this often and back off exponentially, up to
+    # GET_RESULT_SLEEP_SECS
+    RESULT_POLL_MIN_SECS = 0.05
+    RESULT_POLL_BACKOFF = 1.5
+    # once a call is past its expected runtime, start backing off from
+    # this fraction of the runtime
+    RESULT_POLL_RUNTIME_FRACTION = 0.1
+    # how often to check storage while waiting for a completion notification
+    NOTIFIED_POLL_SECS = 30
     def __init__(self, call_id, callset_id, invoke_metadata, storage_path):
 
         self.call_id = call_id
@@ -69,10 +121,32 @@ class ResponseFuture(object):
 
         self.storage_path = storage_path
 
+        # calls packed into a batched invocation share the status and
+        # output objects of the first call in the batch
+        self.invoke_call_id = call_id
+        self.batch_index = None
+        self._batch_output = None
+
+        # the call writes its status and output as one object, see
+        # wrenutil.pack_combined
+        self.combined_output = False
+
+        self._done_callbacks = []
+
+        # set by pywren.completion, if the completion of the call is tracked
+        # and once it has been recorded
+        self._completion_notified = False
+        self._completion_recorded = False
+
     def _set_state(self, new_state):
         ## FIXME add state machine
         self._state = new_state
 
+    def _set_batch(self, invoke_call_id, batch_index, batch_output):
+        self.invoke_call_id = invoke_call_id
+        self.batch_index = batch_index
+        self._batch_output = batch_output
+
     def cancel(self):
         raise NotImplementedError("Cannot cancel dispatched jobs")
 
@@ -80,14 +154,21 @@ class ResponseFuture(object):
         raise NotImplementedError("Cannot cancel dispatched jobs")
 
     def running(self):
-        raise NotImplementedError()
+        """
+        Return True if the call has been invoked and has not completed yet.
+        """
+        if self._state == JobState.new:
+            return False
+        return not self.done()
 
     def done(self):
+        """
+        Return True if the call has completed (successfully or not).
+        """
         if self._state in [JobState.success, JobState.error]:
             return True
-        if self.result(check_only=True) is None:
-            return False
-        return True
+        self.result(check_only=True, throw_except=False)
+        return self._state in [JobState.success, JobState.error]
 
     def result(self, timeout=None, check_only=False, throw_except=True, storage_handler=None):
         """
@@ -104,6 +185,9 @@ class ResponseFuture(object):
         :raises CancelledError: If the job is cancelled before completed.
         :raises TimeoutError: If job is not complete after `timeout` seconds.
 
+        Until the call completes, its status is polled starting every few tens of
+        milliseconds and backing off exponentially, or right after its completion
+        notification, if the callset gets them.
         """
         if self._state == JobState.new:
             raise ValueError("job not yet invoked")
@@ -113,66 +197,159 @@ class ResponseFuture(object):
 
         if self._state == JobState.error:
             if throw_except:
+                if self._traceback is not None:
+                    reraise(*self._traceback)
                 raise self._exception
             else:
                 return None
 
         if storage_handler is None:
-            storage_config = wrenconfig.extract_storage_config(wrenconfig.default())
-            storage_handler = storage.Storage(storage_config)
+            storage_handler = storage.get_storage_for_path(self.storage_path)
 
         storage_utils.check_storage_path(storage_handler.get_storage_config(), self.storage_path)
 
 
-        call_status = storage_handler.get_call_status(self.callset_id, self.call_id)
+        deadline = None if timeout is None else time.time() + timeout
 
-        self.status_query_count += 1
+        def get_status():
+            if self.combined_output:
+                # the status comes with the output, in a single request
+                return storage_handler.get_call_status_and_output(self.callset_id,
+                                                                  self.invoke_call_id)
+            return storage_handler.get_call_status(self.callset_id,
+                                                   self.invoke_call_id), None
+
+        call_status, call_output = get_status()
 
-        ## FIXME implement timeout
-        if timeout is not None:
-            raise NotImplementedError()
+        self.status_query_count += 1
 
         if check_only is True:
             if call_status is None:
                 return None
 
+        poll_delays = self._poll_delays()
         while call_status is None:
-            time.sleep(self.GET_RESULT_SLEEP_SECS)
-            call_status = storage_handler.get_call_status(self.callset_id, self.call_id)
+            remaining = None if deadline is None else deadline - time.time()
+            if remaining is not None and remaining <= 0:
+                raise TimeoutError("call {} {} not complete after {} sec".format(
+                    self.callset_id, self.call_id, timeout))
+
+            if completion.notified(self) and not completion.done(self):
+                # returns as soon as we are notified of the completion
+                wait_sec = self.NOTIFIED_POLL_SECS
+                if remaining is not None:
+                    wait_sec = min(wait_sec, remaining)
+                completion.wait_for(self, wait_sec)
+            else:
+                delay = next(poll_delays)
+                if remaining is not None:
+                    delay = min(delay, remaining)
+                time.sleep(delay)
+            call_status, call_output = get_status()
 
             self.status_query_count += 1
+
+        if not self._set_call_status(call_status, throw_except):
+            return None
+
+        call_output_time = time.time()
+        if self.combined_output:
+            if not call_output:
+                raise StorageOutputNotFoundError(self.callset_id, self.invoke_call_id)
+            call_invoker_result = self._load_output(call_output)
+        elif self.batch_index is None:
+            call_invoker_result = load_output(storage_handler.get_call_output(
+                self.callset_id, self.call_id))
+        else:
+            batch_outputs = self._batch_output.get(storage_handler, self.callset_id,
+                                                   self.invoke_call_id)
+            call_invoker_result = load_output(batch_outputs[self.batch_index])
+
+        return self._set_call_output(call_invoker_result, throw_except, call_output_time)
+
+    def _load_output(self, call_output):
+        """
+        Unpickle the downloaded output object of the call, which for batched
+        calls holds the outputs of the whole batch.
+        """
+        if self.batch_index is None:
+            return load_output(call_output)
+        batch_outputs = self._batch_output.set(call_output)
+        return load_output(batch_outputs[self.batch_index])
+
+    def _set_call_status(self, call_status, throw_except):
+        """
+        Record the status of the finished call.
+        :return: True if the call's output should be fetched. False (or raise,
+            if throw_except) if the handler failed.
+        """
         self._invoke_metadata['status_done_timestamp'] = time.time()
         self._invoke_metadata['status_query_count'] = self.status_query_count
 
         self.run_status = call_status # this is the remote status information
         self.invoke_status = self._invoke_metadata # local status information
 
+        if 'end_time' in call_status and 'host_submit_time' in call_status:
+            with _callset_runtimes_lock:
+                runtimes = _callset_runtimes.get(self.callset_id)
+                if runtimes is None:
+                    runtimes = collections.deque(maxlen=RUNTIME_SAMPLES)
+                    _callset_runtimes[self.callset_id] = runtimes
+                    if len(_callset_runtimes) > RUNTIME_CALLSETS:
+                        _callset_runtimes.popitem(last=False)
+                runtimes.append(call_status['end_time'] - call_status['host_submit_time'])
+
         if call_status['exception'] is not None:
             # the wrenhandler had an exception
             exception_str = call_status['exception']
 
             exception_args = call_status['exception_args']
+            if exception_args[0] == "RUNTIME_CHANGED":
+                _runtime_changed()
             if exception_args[0] == "WRONGVERSION":
-                if throw_except:
-                    raise Exception("Pywren version mismatch: remote " + \
-                        "expected version {}, local library is version {}".format(
-                            exception_args[2], exception_args[3]))
-                return None
+                self._exception = Exception("Pywren version mismatch: remote " + \
+                    "expected version {}, local library is version {}".format(
+                        exception_args[2], exception_args[3]))
             elif exception_args[0] == "OUTATIME":
-                if throw_except:
-                    raise Exception("process ran out of time")
-                return None
+                self._exception = Exception("process ran out of time")
             else:
-                if throw_except:
-                    if 'exception_traceback' in call_status:
-                        logger.error(call_status['exception_traceback'])
-                    raise Exception(exception_str, *exception_args)
-                return None
-
-        call_output_time = time.time()
-        call_invoker_result = pickle.loads(storage_handler.get_call_output(
-            self.callset_id, self.call_id))
+                if throw_except and 'exception_traceback' in call_status:
+                    logger.error(call_status['exception_traceback'])
+                self._exception = Exception(exception_str, *exception_args)
+            self._set_state(JobState.error)
+            if throw_except:
+                raise self._exception
+            return False
+        return True
 
+    def _poll_delays(self):
+        """
+        Generate the delays between the status polls of the call. If other
+        calls of the callset have completed, first wait until this one is
+        expected to be done, going by their median runtime. Then back off
+        exponentially, capped at GET_RESULT_SLEEP_SECS.
+        """
+        delay = self.RESULT_POLL_MIN_SECS
+        with _callset_runtimes_lock:
+            runtimes = sorted(_callset_runtimes.get(self.callset_id, ()))
+        if len(runtimes) > 0:
+            runtime = runtimes[len(runtimes) // 2]
+            submit_time = self._invoke_metadata.get('host_submit_time', time.time())
+            expected_left = submit_time + runtime - time.time()
+            if expected_left > delay:
+                yield min(expected_left, self.GET_RESULT_SLEEP_SECS)
+            delay = max(delay, runtime * self.RESULT_POLL_RUNTIME_FRACTION)
+        while True:
+            delay = min(delay, self.GET_RESULT_SLEEP_SECS)
+            yield delay
+            delay *= self.RESULT_POLL_BACKOFF
+
+    def _set_call_output(self, call_invoker_result, throw_except, call_output_time):
+        """
+        Record the (unpickled) output of the call, downloaded since call_output_time.
+        :return: the call's return value. If the call raised, reraise its
+            exception if throw_except, else return None.
+        """
         call_output_time_done = time.time()
         self._invoke_metadata['download_output_time'] = call_output_time_done - call_output_time
 
@@ -194,14 +371,22 @@ class ResponseFuture(object):
             self._set_state(JobState.success)
             return self._return_val
 
-        elif throw_except:
+        else:
 
-            self._exception = call_invoker_result['result']
-            self._traceback = (call_invoker_result['exc_type'],
-                               call_invoker_result['exc_value'],
-                               call_invoker_result['exc_traceback'])
+            if call_invoker_result.get('pickle_fail', False):
+                # we only have the string of the original exception
+                self._exception = Exception(call_invoker_result['exc_value'])
+                self._traceback = (Exception, self._exception,
+                                   call_invoker_result['exc_traceback'])
+            else:
+                self._exception = call_invoker_result['result']
+                self._traceback = (call_invoker_result['exc_type'],
+                                   call_invoker_result['exc_value'],
+                                   call_invoker_result['exc_traceback'])
 
             self._state = JobState.error
+            if not throw_except:
+                return None  # nothing, don't raise, no value
             if call_invoker_result.get('pickle_fail', False):
                 logging.warning(
                     "there was an error pickling. The original exception: " + \
@@ -209,16 +394,269 @@ class ResponseFuture(object):
                             call_invoker_result['exc_value'],
                             str(call_invoker_result['pickle_exception'])))
 
-                reraise(Exception, call_invoker_result['exc_value'],
-                        call_invoker_result['exc_traceback'])
-            else:
-                # reraise the exception
-                reraise(*self._traceback)
-        else:
-            return None  # nothing, don't raise, no value
+            # reraise the exception
+            reraise(*self._traceback)
+
+    def __await__(self):
+        """
+        `await future` returns the result of the call, see `pywren.aio`
+        (python 3.5+).
+        """
+        from pywren import aio
+        return aio.result(self).__await__()
 
     def exception(self, timeout=None):
-        raise NotImplementedError()
+        """
+        Return the exception raised by the call, blocking until it completes.
+
+        :param timeout: Wait up to timeout seconds, see `result`. Default None.
+        :return: The exception raised by the call (or by the handler running
+            it), None if the call succeeded.
+        :raises TimeoutError: If job is not complete after `timeout` seconds.
+        """
+        self.result(timeout=timeout, throw_except=False)
+        if self._state == JobState.error:
+            return self._exception
+        return None
 
     def add_done_callback(self, fn):
-        raise NotImplementedError()
+        """
+        Call `fn(future)` once the call has completed and its output has been
+        fetched. Callbacks run on the thread pool of a background completion
+        monitor (see pywren/monitor.py), which follows all futures with
+        callbacks at once; they run right away, in this thread, if the call
+        has already completed. Exceptions raised by `fn` are logged and ignored.
+
+        :param fn: callable taking the future as its only argument.
+
+        Usage
+          >>> futures = pwex.map(foo, data)
+          >>> for f in futures:
+          ...     f.add_done_callback(lambda f: print(f.result()))
+        """
+        if self._state == JobState.new:
+            raise ValueError("job not yet invoked")
+
+        with _done_callbacks_lock:
+            done = self._state in [JobState.success, JobState.error]
+            if not done:
+                # the monitor follows the future until it runs all its callbacks
+                follow = len(self._done_callbacks) == 0
+                self._done_callbacks.append(fn)
+        if done:
+            _run_callback(fn, self)
+        elif follow:
+            from pywren import monitor
+            monitor.get_monitor().add(self)
+
+    def _run_done_callbacks(self):
+        with _done_callbacks_lock:
+            callbacks = self._done_callbacks
+            self._done_callbacks = []
+        for fn in callbacks:
+            _run_callback(fn, self)
+
+    def __getstate__(self):
+        # callbacks are local to this client
+        state = self.__dict__.copy()
+        state['_done_callbacks'] = []
+        return state
+
+
+def load_output(call_output):
+    """
+    Unpickle the output of a single call. The numpy arrays of outputs pickled
+    with out-of-band buffers are loaded without copying them out of `call_output`.
+    """
+    if wrenutil.is_out_of_band(call_output):
+        return loads_out_of_band(call_output)
+    return pickle.loads(call_output)
+
+
+def _run_callback(fn, future):
+    try:
+        fn(future)
+    except Exception: # pylint: disable=broad-except
+        logger.exception("done callback of {} {} raised".format(future.callset_id,
+                                                                future.call_id))
+
+
+def fetch_results(fs, parallelism=None, return_exceptions=False):
+    """
+    Block until the futures `fs` are complete and return their results, in order.
+    The statuses and outputs of all the calls are downloaded together (see
+    `Storage.get_call_results`), rather than one future after another.
+
+    :param fs: a list of futures.
+    :param parallelism: number of concurrent storage requests. Default None,
+        which uses the shared I/O pool.
+    :param return_exceptions: Return the exception raised by a call (or while
+        fetching its result) in its place, instead of raising it. Default False
+    :return: A list of the results of each future.
+    :rtype: list
+
+    Usage
+      >>> futures = pwex.map(foo, data)
+      >>> results = fetch_results(futures, parallelism=128)
+    """
+    from pywren.wait import wait, ALL_COMPLETED
+    wait(fs, return_when=ALL_COMPLETED, fetch_results=False)
+
+    # batched calls share one status and output
+    to_fetch = {}
+    for f in fs:
+        if f._state not in [JobState.success, JobState.error]:
+            to_fetch.setdefault((tuple(f.storage_path), f.combined_output), {}).setdefault(
+                (f.callset_id, f.invoke_call_id), []).append(f)
+
+    for (storage_path, combined), call_fs in to_fetch.items():
+        storage_handler = storage.get_storage_for_path(list(storage_path))
+        calls = list(call_fs.keys())
+        call_output_time = time.time()
+        call_results = storage_handler.get_call_results(calls, parallelism, combined)
+        for call, (call_status, call_output) in zip(calls, call_results):
+            for f in call_fs[call]:
+                # anything missing is fetched again by f.result() below,
+                # which raises if it still fails
+                if f._state in [JobState.success, JobState.error] or \
+                   call_status is None or isinstance(call_status, Exception):
+                    continue
+                f.status_query_count += 1
+                if not f._set_call_status(call_status, throw_except=False) or \
+                   isinstance(call_output, Exception):
+                    continue
+                try:
+                    call_invoker_result = f._load_output(call_output)
+                except Exception: # pylint: disable=broad-except
+                    continue
+                f._set_call_output(call_invoker_result, False, call_output_time)
+
+    results = []
+    for f in fs:
+        try:
+            results.append(f.result())
+        except Exception as e: # pylint: disable=broad-except
+            if not return_exceptions:
+                raise
+            results.append(e)
+    return results
+
+
+class BatchOutput(object):
+    """
+    Combined output of a batched invocation, shared by the futures of
+    all the calls in the batch so that it is only downloaded once. The
+    output is a pickled list holding the pickled output of each call.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._outputs = None
+
+    def get(self, storage_handler, callset_id, invoke_call_id):
+        with self._lock:
+            if self._outputs is None:
+                self._outputs = pickle.loads(storage_handler.get_call_output(
+                    callset_id, invoke_call_id))
+            return self._outputs
+
+    def cached(self):
+        """
+        Return the outputs if they have already been downloaded, else None
+        """
+        return self._outputs
+
+    def set(self, call_output):
+        """
+        Store the downloaded (pickled) batch output, unless some other
+        future of the batch got there first, and return the outputs.
+        """
+        with self._lock:
+            if self._outputs is None:
+                self._outputs = pickle.loads(call_output)
+            return self._outputs
+
+    def __getstate__(self):
+        # don't ship the lock, or the (possibly large) downloaded outputs
+        return {}
+
+    def __setstate__(self, state):
+        self.__init__()
+
+
+class FutureStream(object):
+    """
+    A lazily growing, ordered collection of ResponseFutures returned by
+    `Executor.map_stream`. Futures are appended as each window of the map
+    is invoked.
+
+    Iterating blocks until the next future has been invoked and stops once
+    the whole input has been submitted. If submission fails part way
+    through, iteration re-raises the error after the futures that were
+    invoked before it.
+    """
+
+    def __init__(self, callset_id):
+        self.callset_id = callset_id
+        self._futures = []
+        self._cond = threading.Condition()
+        self._closed = False
+        self._exception = None
+
+    def _extend(self, futures):
+        with self._cond:
+            self._futures.extend(futures)
+            self._cond.notify_all()
+
+    def _close(self, exception=None):
+        with self._cond:
+            self._closed = True
+            self._exception = exception
+            self._cond.notify_all()
+
+    def submitted(self):
+        """
+        Return True once every item of the input has been invoked
+        (or submission has failed).
+        """
+        return self._closed
+
+    def wait_submitted(self, timeout=None):
+        """
+        Block until every item has been invoked and return the list
+        of all futures.
+
+        :param timeout: Maximum time in seconds to block. Default None (forever).
+        :return: list of futures invoked so far.
+        :raises: the submission error, if submission failed.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self._cond:
+            while not self._closed:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            if self._exception is not None:
+                raise self._exception
+            return list(self._futures)
+
+    def __len__(self):
+        return len(self._futures)
+
+    def __getitem__(self, i):
+        return self._futures[i]
+
+    def __iter__(self):
+        i = 0
+        while True:
+            with self._cond:
+                while i >= len(self._futures) and not self._closed:
+                    self._cond.wait()
+                if i >= len(self._futures):
+                    if self._exception is not None:
+                        raise self._exception
+                    return
+                f = self._futures[i]
+            yield f
+            i += 1
@@ -17,11 +17,13 @@
 from __future__ import absolute_import
 
 import json
+import multiprocessing
 import os
 
 import botocore
 import botocore.session
 from pywren import local
+from pywren.completion import LocalCompletionChannel
 
 SOURCE_DIR = os.path.dirname(os.path.abspath(__file__))
 
@@ -92,3 +94,49 @@ class DummyInvoker(object):
                             {'invoker' : 'DummyInvoker'})
 
         self.payloads = self.payloads[jobn:]
+
+
+class LocalInvoker(object):
+    """
+    An invoker that runs jobs on this machine, in a persistent pool
+    of worker processes (one per core by default). Each worker runs
+    its jobs in its own run dir under `run_dir`. Finished jobs are
+    published to `completion_channel`.
+    """
+
+    def __init__(self, num_workers=None, run_dir="/tmp/pywren_local"):
+        if num_workers is None:
+            num_workers = multiprocessing.cpu_count()
+        self.num_workers = num_workers
+        self.run_dir = run_dir
+        self.TIME_LIMIT = False
+        self.completion_channel = LocalCompletionChannel()
+        self.pool = multiprocessing.Pool(num_workers,
+                                         initializer=local.local_worker_init,
+                                         initargs=(run_dir,))
+
+    def invoke(self, payload):
+        """
+        Queue the payload on the worker pool and return immediately
+        """
+        self.pool.apply_async(local.local_worker_handler,
+                              (payload, {'invoker' : 'LocalInvoker'}),
+                              callback=self._job_done)
+        return {}
+
+    def _job_done(self, call_key):
+        self.completion_channel.publish(*call_key)
+
+    def config(self):
+        """
+        Return config dict
+        """
+        return {'num_workers' : self.num_workers,
+                'run_dir' : self.run_dir}
+
+    def shutdown(self):
+        """
+        Wait for the queued jobs to finish and stop the workers
+        """
+        self.pool.close()
+        self.pool.join()
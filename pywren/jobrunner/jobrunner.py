@@ -17,14 +17,26 @@
 from __future__ import print_function
 import os
 import base64
+import bisect
+import importlib
+import io
 import shutil
 import json
+import socket
+import struct
 import sys
+import threading
 import time
+import zlib
+from collections import OrderedDict
 import boto3
+import botocore
 
 
+from six import PY2, string_types
 from six.moves import cPickle as pickle
+from six.moves.urllib.error import URLError
+from six.moves.urllib.request import Request, urlopen
 from tblib import pickling_support
 
 pickling_support.install()
@@ -35,19 +47,205 @@ def b64str_to_bytes(str_data):
     byte_data = base64.b64decode(str_ascii)
     return byte_data
 
+def pickle_failure(e):
+    """
+    Pickle the output dict for a call that raised `e`
+    """
+    exc_type, exc_value, exc_traceback = sys.exc_info()
+    #traceback.print_tb(exc_traceback)
+
+    # Shockingly often, modules like subprocess don't properly
+    # call the base Exception.__init__, which results in them
+    # being unpickleable. As a result, we actually wrap this in a try/catch block
+    # and more-carefully handle the exceptions if any part of this save / test-reload
+    # fails
+
+    try:
+        pickled_exception = pickle.dumps({'result' : e,
+                                          'exc_type' : exc_type,
+                                          'exc_value' : exc_value,
+                                          'exc_traceback' : exc_traceback,
+                                          'sys.path' : sys.path,
+                                          'success' : False})
+
+        # this is just to make sure they can be unpickled
+        pickle.loads(pickled_exception)
+
+    except Exception as pickle_exception:
+        pickled_exception = pickle.dumps({'result' : str(e),
+                                          'exc_type' : str(exc_type),
+                                          'exc_value' : str(exc_value),
+                                          'exc_traceback' : exc_traceback,
+                                          'exc_traceback_str' : str(exc_traceback),
+                                          'sys.path' : sys.path,
+                                          'pickle_fail' : True,
+                                          'pickle_exception' : pickle_exception,
+                                          'success' : False})
+    return pickled_exception
+
+jobrunner_config_filename = sys.argv[1]
+
+jobrunner_config = json.load(open(jobrunner_config_filename, 'r'))
+
+# set if this invocation runs a batch of calls, in which case
+# the output is a pickled list of each call's pickled output
+data_byte_ranges = jobrunner_config.get('data_byte_ranges')
+
+# pickle outputs with their large numpy arrays out of band
+out_of_band_buffers = jobrunner_config.get('out_of_band_buffers', False)
+
+# the jobrunner runs on its own, so this mirrors the out-of-band pickling of
+# pywren.serialize.util and the framing of wrenutil.pack_out_of_band
+OUT_OF_BAND_MAGIC = b"PWB1"
+OUT_OF_BAND_HEADER_FORMAT = ">4sI"
+OUT_OF_BAND_HEADER_SIZE = struct.calcsize(OUT_OF_BAND_HEADER_FORMAT)
+OUT_OF_BAND_ALIGN = 64
+OUT_OF_BAND_MIN_BYTES = 1024
+
+def dumps_output(output):
+    if not out_of_band_buffers:
+        return pickle.dumps(output)
+    np = sys.modules.get('numpy')
+    buffers = []
+
+    def persistent_id(obj):
+        if np is None or type(obj) is not np.ndarray: # pylint: disable=unidiomatic-typecheck
+            return None
+        if (obj.dtype.hasobject or obj.dtype.fields is not None
+                or obj.nbytes < OUT_OF_BAND_MIN_BYTES):
+            return None
+        if obj.flags.c_contiguous:
+            order = 'C'
+        elif obj.flags.f_contiguous:
+            order = 'F'
+        else:
+            return None
+        buffers.append(memoryview(obj.reshape(-1, order=order).view(np.uint8)))
+        return ("ndarray", len(buffers) - 1, obj.dtype.str, obj.shape, order)
+
+    pickled = io.BytesIO()
+    pickler = pickle.Pickler(pickled, 2)
+    pickler.persistent_id = persistent_id
+    pickler.dump(output)
+    pickled = pickled.getvalue()
+
+    frame = bytearray(struct.pack(OUT_OF_BAND_HEADER_FORMAT, OUT_OF_BAND_MAGIC, len(buffers)))
+    frame += struct.pack(">{}Q".format(len(buffers) + 1),
+                         len(pickled), *[len(b) for b in buffers])
+    frame += pickled
+    for buf in buffers:
+        frame += b"\0" * (-len(frame) % OUT_OF_BAND_ALIGN)
+        frame += buf
+    return frame
+
+def loads(data):
+    """
+    Unpickle `data`, which may have been pickled with its large numpy arrays
+    out of band. The arrays use `data` in place, so they aren't copied (and
+    are read-only).
+    """
+    if PY2 and isinstance(data, memoryview):
+        # numpy can only read old-style buffer objects on python 2
+        data = data.tobytes()
+    view = memoryview(data)
+    if view[:len(OUT_OF_BAND_MAGIC)].tobytes() != OUT_OF_BAND_MAGIC:
+        return pickle.loads(data)
+    _, buffer_n = struct.unpack_from(OUT_OF_BAND_HEADER_FORMAT, view)
+    lens = struct.unpack_from(">{}Q".format(buffer_n + 1), view, OUT_OF_BAND_HEADER_SIZE)
+    offset = OUT_OF_BAND_HEADER_SIZE + struct.calcsize(">Q") * (buffer_n + 1)
+    pickled = view[offset:offset + lens[0]]
+    offset += lens[0]
+    buffers = []
+    for buffer_len in lens[1:]:
+        offset += -offset % OUT_OF_BAND_ALIGN
+        if PY2:
+            buffers.append(buffer(data, offset, buffer_len)) # pylint: disable=undefined-variable
+        else:
+            buffers.append(view[offset:offset + buffer_len])
+        offset += buffer_len
+
+    def persistent_load(pid):
+        import numpy as np
+        _, buffer_i, dtype, shape, order = pid
+        arr = np.frombuffer(buffers[buffer_i], dtype=np.dtype(dtype)).reshape(shape,
+                                                                              order=order)
+        # the data may be a writable bytearray, which we don't want to change
+        arr.flags.writeable = False
+        return arr
+
+    unpickler = pickle.Unpickler(io.BytesIO(pickled.tobytes()))
+    unpickler.persistent_load = persistent_load
+    return unpickler.load()
+
 # initial output file in case job fails
 output_dict = {'result' : None,
                'success' : False}
 
 pickled_output = pickle.dumps(output_dict)
-jobrunner_config_filename = sys.argv[1]
+if data_byte_ranges is not None:
+    pickled_output = pickle.dumps([pickled_output] * len(data_byte_ranges))
 
-jobrunner_config = json.load(open(jobrunner_config_filename, 'r'))
 
+storage_backend = jobrunner_config.get('storage_backend', 's3')
+local_storage_path = jobrunner_config.get('local_storage_path')
 
 # FIXME someday switch to storage handler
 # download the func data into memory
-s3_client = boto3.client("s3")
+s3_client = None
+if storage_backend == 's3':
+    s3_client = boto3.client("s3")
+
+def get_object(bucket, key, byte_range=None):
+    """
+    Read an object (or the inclusive `byte_range` of it) from storage
+    """
+    if storage_backend == 'local':
+        with open(os.path.join(local_storage_path, key), 'rb') as fid:
+            if byte_range is None:
+                return fid.read()
+            fid.seek(byte_range[0])
+            return fid.read(byte_range[1] - byte_range[0] + 1)
+
+    extra_get_args = {}
+    if byte_range is not None:
+        range_str = 'bytes={}-{}'.format(*byte_range)
+        extra_get_args['Range'] = range_str
+    obj_stream = s3_client.get_object(Bucket=bucket, Key=key, **extra_get_args)
+    return obj_stream['Body'].read()
+
+# the client uploads the data before invoking, so it's only fetched again
+# if S3 doesn't show it yet, backing off from DATA_RETRY_SLEEP_SEC
+DATA_RETRY_N = 5
+DATA_RETRY_SLEEP_SEC = 0.1
+
+def get_data_object(bucket, key, byte_range=None):
+    """
+    Read the data of the call, retrying a few times if the key is missing
+    """
+    for retry_i in range(DATA_RETRY_N):
+        try:
+            return get_object(bucket, key, byte_range)
+        except botocore.exceptions.ClientError as e:
+            if e.response['Error']['Code'] != "NoSuchKey" or retry_i == DATA_RETRY_N - 1:
+                raise e
+        time.sleep(DATA_RETRY_SLEEP_SEC * 2 ** retry_i)
+
+def put_object(bucket, key, body):
+    if storage_backend == 'local':
+        filename = os.path.join(local_storage_path, key)
+        try:
+            os.makedirs(os.path.dirname(filename))
+        except OSError as e:
+            if e.errno != 17:
+                raise e
+        # write and rename so readers never see a partial object
+        tmp_filename = os.path.join(os.path.dirname(filename),
+                                    ".pywren_tmp_{}".format(os.getpid()))
+        with open(tmp_filename, 'wb') as fid:
+            fid.write(body)
+        os.rename(tmp_filename, filename)
+    else:
+        s3_client.put_object(Body=body, Bucket=bucket, Key=key)
 
 func_bucket = jobrunner_config['func_bucket']
 func_key = jobrunner_config['func_key']
@@ -58,6 +256,89 @@ data_byte_range = jobrunner_config['data_byte_range']
 
 output_bucket = jobrunner_config['output_bucket']
 output_key = jobrunner_config['output_key']
+# set if the handler uploads the output, along with the status
+output_filename = jobrunner_config.get('output_filename')
+
+# module zips kept across jobs, by their hash
+MODULE_CACHE_SIZE = 16
+# zips used more recently than this are never evicted, as a job running
+# in parallel may still import from them
+MODULE_CACHE_GRACE_SEC = 600
+
+def write_module_files(module_path, module_data):
+    for m_filename, m_data in module_data.items():
+        m_path = os.path.dirname(m_filename)
+
+        if len(m_path) > 0 and m_path[0] == "/":
+            m_path = m_path[1:]
+        to_make = os.path.join(module_path, m_path)
+        try:
+            os.makedirs(to_make)
+        except OSError as e:
+            if e.errno == 17:
+                pass
+            else:
+                raise e
+        full_filename = os.path.join(to_make, os.path.basename(m_filename))
+        #print "creating", full_filename
+        with open(full_filename, 'wb') as fid:
+            fid.write(b64str_to_bytes(m_data))
+
+def evict_module_cache(module_cache_dir, keep_path):
+    """
+    Remove the least recently used module zips beyond MODULE_CACHE_SIZE,
+    unless they were used in the last MODULE_CACHE_GRACE_SEC
+    """
+    entries = []
+    for name in os.listdir(module_cache_dir):
+        path = os.path.join(module_cache_dir, name)
+        if path == keep_path or name.startswith("."):
+            continue
+        try:
+            entries.append((os.path.getmtime(path), path))
+        except OSError:
+            pass
+    entries.sort(reverse=True)
+    evict_before = time.time() - MODULE_CACHE_GRACE_SEC
+    for mtime, path in entries[MODULE_CACHE_SIZE - 1:]:
+        if mtime >= evict_before:
+            continue
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+def get_module_zip(module_cache_dir, module_zip_hash, module_zip_key):
+    """
+    Return the path of the module zip with hash `module_zip_hash`, downloading
+    it only if no earlier job on this host did. The zip goes on sys.path as is,
+    so its modules are loaded by zipimport without unpacking anything.
+    """
+    module_path = os.path.join(module_cache_dir, module_zip_hash + ".zip")
+    try:
+        # mark it as used, so it isn't evicted
+        os.utime(module_path, None)
+        write_stat('module_cache_hit', 1)
+        return module_path
+    except OSError:
+        # not downloaded yet, or just evicted by another job
+        pass
+    write_stat('module_cache_hit', 0)
+
+    module_zip = get_object(func_bucket, module_zip_key)
+    try:
+        os.makedirs(module_cache_dir)
+    except OSError as e:
+        if e.errno != 17:
+            raise e
+    # write and rename, so concurrent jobs never import a partial zip
+    tmp_path = os.path.join(module_cache_dir,
+                            ".{}_{}".format(module_zip_hash, os.getpid()))
+    with open(tmp_path, 'wb') as fid:
+        fid.write(module_zip)
+    os.rename(tmp_path, module_path)
+    evict_module_cache(module_cache_dir, module_path)
+    return module_path
 
 ## Jobrunner stats are fieldname float
 jobrunner_stats_filename = jobrunner_config['stats_filename']
@@ -68,10 +349,167 @@ def write_stat(stat, val):
     stats_fid.write("{} {:f}\n".format(stat, val))
     stats_fid.flush()
 
+# decompressed chunks of a lazy runtime kept around, as the files of a
+# package are next to each other
+LAZY_RUNTIME_CHUNK_CACHE_SIZE = 4
+LAZY_RUNTIME_FETCH_TIMEOUT_SEC = 30
+LAZY_RUNTIME_FETCH_RETRY_N = 3
+
+def decompress_chunk(codec, data):
+    """
+    Decompress a chunk of a chunked archive, like wrenutil.archive_codec
+    """
+    if codec == "zlib":
+        return zlib.decompress(data)
+    if codec == "zstd":
+        import zstandard
+        return zstandard.ZstdDecompressor().decompress(data)
+    if codec == "lz4":
+        import lz4.frame
+        return lz4.frame.decompress(data)
+    raise ValueError("unknown archive codec {}".format(codec))
+
+def lazy_module_key(path):
+    """
+    Return the `(directory, module name)` whose import needs the module
+    file `path` of a lazy runtime
+    """
+    dirname, filename = os.path.split(path)
+    if os.path.basename(dirname) == "__pycache__":
+        dirname = os.path.dirname(dirname)
+    name = filename.split(".")[0]
+    if name == "__init__":
+        dirname, name = os.path.split(dirname)
+    return dirname, name
+
+class LazyRuntimeFinder(object):
+    """
+    Import hook extracting the module files of a lazy runtime (see
+    wrenutil.write_lazy_chunked_archive) when they are first imported.
+    It only puts the files in place, and leaves the import itself
+    to the regular finders.
+    """
+
+    def __init__(self, runtime_dir, index, url, etag):
+        self.runtime_dir = os.path.realpath(runtime_dir)
+        self.url = url
+        self.etag = etag
+        self.codec = index['codec']
+        self.chunks = index['chunks']
+        self.chunk_starts = []
+        chunk_start = 0
+        for _, _, raw_length in self.chunks:
+            self.chunk_starts.append(chunk_start)
+            chunk_start += raw_length
+        self.files = index['files']
+        # (directory, module name) -> files not extracted yet
+        self.modules = {}
+        for path in self.files:
+            self.modules.setdefault(lazy_module_key(path), []).append(path)
+        self.extracted_n = 0
+        self.extract_time = 0.0
+        self._chunk_cache = OrderedDict()
+        self._dirs = {}
+        # fetching may import more modules, so this is reentrant
+        self._lock = threading.RLock()
+
+    def _rel_dir(self, path_entry):
+        if path_entry not in self._dirs:
+            self._dirs[path_entry] = os.path.relpath(
+                os.path.realpath(path_entry or "."), self.runtime_dir)
+        return self._dirs[path_entry]
+
+    def find_module(self, fullname, path=None):
+        name = fullname.rpartition(".")[2]
+        with self._lock:
+            for path_entry in (path if path is not None else sys.path):
+                if not isinstance(path_entry, string_types):
+                    continue
+                paths = self.modules.pop((self._rel_dir(path_entry), name), None)
+                if paths is not None:
+                    self._extract(paths)
+        return None
+
+    def find_spec(self, fullname, path, target=None): # pylint: disable=unused-argument
+        return self.find_module(fullname, path)
+
+    def _get_chunk(self, chunk_i):
+        if chunk_i in self._chunk_cache:
+            return self._chunk_cache[chunk_i]
+        offset, length, _ = self.chunks[chunk_i]
+        request = Request(self.url, headers={
+            'Range' : "bytes={}-{}".format(offset, offset + length - 1),
+            # the chunks must all come from the runtime we extracted
+            'If-Match' : self.etag})
+        chunk = decompress_chunk(self.codec, self._fetch(request))
+        self._chunk_cache[chunk_i] = chunk
+        if len(self._chunk_cache) > LAZY_RUNTIME_CHUNK_CACHE_SIZE:
+            self._chunk_cache.popitem(last=False)
+        return chunk
+
+    def _fetch(self, request):
+        for retry_i in range(LAZY_RUNTIME_FETCH_RETRY_N):
+            try:
+                return urlopen(request, timeout=LAZY_RUNTIME_FETCH_TIMEOUT_SEC).read()
+            except (URLError, socket.error) as e:
+                # client errors, like the runtime having changed, won't go away
+                if getattr(e, 'code', 500) < 500 or retry_i == LAZY_RUNTIME_FETCH_RETRY_N - 1:
+                    raise e
+            time.sleep(DATA_RETRY_SLEEP_SEC * 2 ** retry_i)
+
+    def _read(self, offset, size):
+        data = io.BytesIO()
+        chunk_i = bisect.bisect_right(self.chunk_starts, offset) - 1
+        while size > 0:
+            chunk = self._get_chunk(chunk_i)
+            chunk_offset = offset - self.chunk_starts[chunk_i]
+            part = chunk[chunk_offset:chunk_offset + size]
+            data.write(part)
+            offset += len(part)
+            size -= len(part)
+            chunk_i += 1
+        return data.getvalue()
+
+    def _extract(self, paths):
+        t1 = time.time()
+        for path in paths:
+            filename = os.path.join(self.runtime_dir, path)
+            # an earlier job on this host may have extracted it
+            if os.path.exists(filename):
+                continue
+            offset, size, mode, mtime = self.files[path]
+            # its directory may not have been extracted, if it only holds lazy files
+            try:
+                os.makedirs(os.path.dirname(filename))
+            except OSError as e:
+                if e.errno != 17:
+                    raise e
+            # write and rename, so concurrent jobs never import a partial file
+            tmp_filename = "{}.pywren_tmp_{}".format(filename, os.getpid())
+            with open(tmp_filename, 'wb') as fid:
+                fid.write(self._read(offset, size))
+            os.chmod(tmp_filename, mode)
+            # keep the mtime, against which the cached bytecode is checked
+            os.utime(tmp_filename, (mtime, mtime))
+            os.rename(tmp_filename, filename)
+            self.extracted_n += 1
+        if hasattr(importlib, 'invalidate_caches'):
+            importlib.invalidate_caches()
+        self.extract_time += time.time() - t1
+
+# set if the handler only extracted part of the runtime
+runtime_lazy = jobrunner_config.get('runtime_lazy')
+lazy_runtime_finder = None
+if runtime_lazy is not None:
+    with open(runtime_lazy['index_filename'], 'r') as fid:
+        lazy_runtime_index = json.load(fid)
+    lazy_runtime_finder = LazyRuntimeFinder(runtime_lazy['runtime_dir'], lazy_runtime_index,
+                                            runtime_lazy['url'], runtime_lazy['etag'])
+    sys.meta_path.insert(0, lazy_runtime_finder)
+
 try:
     func_download_time_t1 = time.time()
-    func_obj_stream = s3_client.get_object(Bucket=func_bucket, Key=func_key)
-    loaded_func_all = pickle.loads(func_obj_stream['Body'].read())
+    loaded_func_all = pickle.loads(get_object(func_bucket, func_key))
     func_download_time_t2 = time.time()
     write_stat('func_download_time',
                func_download_time_t2-func_download_time_t1)
@@ -79,27 +517,21 @@ try:
     # save modules, before we unpickle actual function
     PYTHON_MODULE_PATH = jobrunner_config['python_module_path']
 
-    shutil.rmtree(PYTHON_MODULE_PATH, True) # delete old modules
-    os.mkdir(PYTHON_MODULE_PATH)
-    sys.path.append(PYTHON_MODULE_PATH)
-
-    for m_filename, m_data in loaded_func_all['module_data'].items():
-        m_path = os.path.dirname(m_filename)
-
-        if len(m_path) > 0 and m_path[0] == "/":
-            m_path = m_path[1:]
-        to_make = os.path.join(PYTHON_MODULE_PATH, m_path)
-        try:
-            os.makedirs(to_make)
-        except OSError as e:
-            if e.errno == 17:
-                pass
-            else:
-                raise e
-        full_filename = os.path.join(to_make, os.path.basename(m_filename))
-        #print "creating", full_filename
-        with open(full_filename, 'wb') as fid:
-            fid.write(b64str_to_bytes(m_data))
+    module_download_time_t1 = time.time()
+    if 'module_zip_key' in loaded_func_all:
+        # without a shared cache, keep the zip with this job's modules
+        module_cache_dir = jobrunner_config.get('python_module_cache_dir',
+                                                PYTHON_MODULE_PATH)
+        module_path = get_module_zip(module_cache_dir,
+                                     loaded_func_all['module_zip_hash'],
+                                     loaded_func_all['module_zip_key'])
+    else:
+        module_path = PYTHON_MODULE_PATH
+        shutil.rmtree(module_path, True) # delete old modules
+        os.mkdir(module_path)
+        write_module_files(module_path, loaded_func_all['module_data'])
+    sys.path.append(module_path)
+    write_stat('module_setup_time', time.time() - module_download_time_t1)
 
     # logger.info("Finished wrting {} module files".format(len(d['module_data'])))
     # logger.debug(subprocess.check_output("find {}".format(PYTHON_MODULE_PATH), shell=True))
@@ -107,66 +539,65 @@ try:
 
 
     # now unpickle function; it will expect modules to be there
-    loaded_func = pickle.loads(loaded_func_all['func'])
-
-    extra_get_args = {}
-    if data_byte_range is not None:
-        range_str = 'bytes={}-{}'.format(*data_byte_range)
-        extra_get_args['Range'] = range_str
-
-    data_download_time_t1 = time.time()
-    data_obj_stream = s3_client.get_object(Bucket=data_bucket,
-                                           Key=data_key, **extra_get_args)
-    # FIXME make this streaming
-    loaded_data = pickle.loads(data_obj_stream['Body'].read())
-    data_download_time_t2 = time.time()
-    write_stat('data_download_time',
-               data_download_time_t2-data_download_time_t1)
-
-    #print("loaded")
-    y = loaded_func(loaded_data)
-    #print("success")
-    output_dict = {'result' : y,
-                   'success' : True,
-                   'sys.path' : sys.path}
-    pickled_output = pickle.dumps(output_dict)
+    loaded_func = loads(loaded_func_all['func'])
+
+    if data_byte_ranges is None:
+        data_download_time_t1 = time.time()
+        # FIXME make this streaming
+        loaded_data = loads(get_data_object(data_bucket, data_key, data_byte_range))
+        data_download_time_t2 = time.time()
+        write_stat('data_download_time',
+                   data_download_time_t2-data_download_time_t1)
+
+        #print("loaded")
+        y = loaded_func(loaded_data)
+        #print("success")
+        output_dict = {'result' : y,
+                       'success' : True,
+                       'sys.path' : sys.path}
+        pickled_output = dumps_output(output_dict)
+    else:
+        # the items of a batch are contiguous, so fetch them all at once
+        batch_start = data_byte_ranges[0][0]
+        batch_end = data_byte_ranges[-1][1]
+
+        data_download_time_t1 = time.time()
+        batch_data = get_data_object(data_bucket, data_key, (batch_start, batch_end))
+        data_download_time_t2 = time.time()
+        write_stat('data_download_time',
+                   data_download_time_t2-data_download_time_t1)
+
+        if out_of_band_buffers:
+            # slice without copying
+            batch_data = memoryview(batch_data)
+        pickled_outputs = []
+        for item_start, item_end in data_byte_ranges:
+            try:
+                loaded_data = loads(batch_data[item_start - batch_start:
+                                               item_end - batch_start + 1])
+                y = loaded_func(loaded_data)
+                output_dict = {'result' : y,
+                               'success' : True,
+                               'sys.path' : sys.path}
+                pickled_outputs.append(dumps_output(output_dict))
+            except Exception as e:
+                pickled_outputs.append(pickle_failure(e))
+        pickled_output = pickle.dumps(pickled_outputs)
 
 except Exception as e:
-    exc_type, exc_value, exc_traceback = sys.exc_info()
-    #traceback.print_tb(exc_traceback)
-
-    # Shockingly often, modules like subprocess don't properly
-    # call the base Exception.__init__, which results in them
-    # being unpickleable. As a result, we actually wrap this in a try/catch block
-    # and more-carefully handle the exceptions if any part of this save / test-reload
-    # fails
-
-    try:
-        pickled_output = pickle.dumps({'result' : e,
-                                       'exc_type' : exc_type,
-                                       'exc_value' : exc_value,
-                                       'exc_traceback' : exc_traceback,
-                                       'sys.path' : sys.path,
-                                       'success' : False})
-
-        # this is just to make sure they can be unpickled
-        pickle.loads(pickled_output)
-
-    except Exception as pickle_exception:
-        pickled_output = pickle.dumps({'result' : str(e),
-                                       'exc_type' : str(exc_type),
-                                       'exc_value' : str(exc_value),
-                                       'exc_traceback' : exc_traceback,
-                                       'exc_traceback_str' : str(exc_traceback),
-                                       'sys.path' : sys.path,
-                                       'pickle_fail' : True,
-                                       'pickle_exception' : pickle_exception,
-                                       'success' : False})
+    pickled_output = pickle_failure(e)
+    if data_byte_ranges is not None:
+        pickled_output = pickle.dumps([pickled_output] * len(data_byte_ranges))
 finally:
     output_upload_timestamp_t1 = time.time()
-    s3_client.put_object(Body=pickled_output,
-                         Bucket=output_bucket,
-                         Key=output_key)
+    if output_filename is not None:
+        with open(output_filename, 'wb') as fid:
+            fid.write(pickled_output)
+    else:
+        put_object(output_bucket, output_key, pickled_output)
     output_upload_timestamp_t2 = time.time()
     write_stat("output_upload_time",
                output_upload_timestamp_t2 - output_upload_timestamp_t1)
+    if lazy_runtime_finder is not None:
+        write_stat("runtime_lazy_extract_n", lazy_runtime_finder.extracted_n)
+        write_stat("runtime_lazy_extract_time", lazy_runtime_finder.extract_time)
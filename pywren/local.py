@@ -24,6 +24,12 @@ import pywren
 from . import wrenhandler
 
 
+def copy_runtime(tgt_dir):
+    files = glob.glob(os.path.join(pywren.SOURCE_DIR, "jobrunner/*.py"))
+    for f in files:
+        shutil.copy(f, os.path.join(tgt_dir, os.path.basename(f)))
+
+
 def local_handler(jobs, run_dir, extra_context=None):
     """
     Run a list of (deserialized) jobs locally inside of
@@ -32,14 +38,6 @@ def local_handler(jobs, run_dir, extra_context=None):
     Just for debugging
     """
 
-    def copy_runtime(tgt_dir):
-        files = glob.glob(os.path.join(pywren.SOURCE_DIR, "./*.py"))
-        files = glob.glob(os.path.join(pywren.SOURCE_DIR, "jobrunner/*.py"))
-        for f in files:
-            shutil.copy(f, os.path.join(tgt_dir, os.path.basename(f)))
-
-    original_dir = os.getcwd()
-
     for job_i, job in enumerate(jobs):
         local_task_run_dir = os.path.join(run_dir, str(job_i))
         shutil.rmtree(local_task_run_dir, True) # delete old modules
@@ -51,8 +49,35 @@ def local_handler(jobs, run_dir, extra_context=None):
         if extra_context is not None:
             context.update(extra_context)
 
-        os.chdir(local_task_run_dir)
         # FIXME debug
-        wrenhandler.generic_handler(job, context)
+        wrenhandler.generic_handler(job, context, run_dir=local_task_run_dir)
 
-        os.chdir(original_dir)
+
+# run dir of this worker process, set by local_worker_init
+_worker_run_dir = None
+
+def local_worker_init(run_dir):
+    """
+    Initializer for the processes of a LocalInvoker pool. Every
+    worker gets its own run dir so that workers never share files.
+    """
+    global _worker_run_dir # pylint: disable=global-statement
+    _worker_run_dir = os.path.join(run_dir, str(os.getpid()))
+    shutil.rmtree(_worker_run_dir, True) # delete old modules
+    os.makedirs(_worker_run_dir)
+    copy_runtime(_worker_run_dir)
+
+
+def local_worker_handler(job, extra_context=None):
+    """
+    Run a single (deserialized) job inside of a LocalInvoker pool worker
+
+    :return: `(callset_id, call_id)` of the finished job
+    """
+    context = {'worker_pid' : os.getpid()}
+    if extra_context is not None:
+        context.update(extra_context)
+    # MKL/OpenMP would otherwise start one thread per core in every worker
+    wrenhandler.generic_handler(job, context, {'OMP_NUM_THREADS' : '1'},
+                                run_dir=_worker_run_dir)
+    return job['callset_id'], job['call_id']
@@ -0,0 +1,186 @@
+#
+# Copyright 2018 PyWren Team
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Background completion monitor behind `ResponseFuture.add_done_callback`.
+
+A single daemon thread per process follows every future that has done
+callbacks. Futures whose callsets get completion notifications are looked
+up as their completions come in, and the storage is only checked for the
+others (or, now and then, in case a notification got lost). When a call
+completes, its output is fetched and its callbacks are run on the
+monitor's callback pool, so callbacks may block.
+"""
+
+from __future__ import absolute_import
+
+import logging
+import os
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+from six.moves.queue import Queue, Empty
+
+from pywren import completion
+from pywren.future import JobState
+from pywren.storage import storage
+from pywren.wait import _find_done_call_ids, NOTIFIED_POLL_SEC
+
+logger = logging.getLogger(__name__)
+
+# threads running done callbacks (and fetching the outputs they need)
+CALLBACK_POOL_SIZE = 16
+
+_monitor = None
+_monitor_pid = None
+_monitor_lock = threading.Lock()
+
+
+class CompletionMonitor(object):
+    """
+    Follows futures until they complete, then runs their done callbacks.
+    """
+    # time between storage checks of callsets without completion notifications
+    POLL_INTERVAL_SEC = 2
+    MAX_DIRECT_QUERY_N = 16
+    RETURN_EARLY_N = 16
+
+    def __init__(self):
+        # new futures, and lists of completions from the subscription
+        self._events = Queue()
+        self._subscription = completion.Subscription(self._events)
+        # (callset_id, invoke_call_id) -> futures whose completion we are told about
+        self._notified = {}
+        # futures of callsets without completion notifications
+        self._polled = []
+        self.callback_pool = ThreadPool(CALLBACK_POOL_SIZE)
+        self.thread = threading.Thread(target=self._monitor_loop)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def add(self, future):
+        """
+        Start following `future`, whose callbacks are run once it completes
+        """
+        self._events.put(future)
+
+    def _get_events(self, timeout):
+        try:
+            # Queue.get(timeout=None) can't be interrupted on python 2
+            events = [self._events.get(timeout=timeout if timeout is not None else 1e9)]
+        except Empty:
+            return []
+        while True:
+            try:
+                events.append(self._events.get_nowait())
+            except Empty:
+                return events
+
+    def _monitor_loop(self):
+        done_states = [JobState.success, JobState.error]
+        last_poll = 0
+        last_notified_poll = time.time()
+        while True:
+            timeouts = []
+            if len(self._polled) > 0:
+                timeouts.append(last_poll + self.POLL_INTERVAL_SEC - time.time())
+            if len(self._notified) > 0:
+                timeouts.append(last_notified_poll + NOTIFIED_POLL_SEC - time.time())
+            timeout = max(0, min(timeouts)) if len(timeouts) > 0 else None
+
+            dones = []
+            for event in self._get_events(timeout):
+                if isinstance(event, list):
+                    # only look up the futures that completed
+                    for key in event:
+                        dones.extend(self._notified.pop(key, []))
+                elif event._state in done_states or completion.done(event):
+                    dones.append(event)
+                elif completion.notified(event):
+                    key = (event.callset_id, event.invoke_call_id)
+                    self._notified.setdefault(key, []).append(event)
+                else:
+                    self._polled.append(event)
+
+            now = time.time()
+            to_poll = []
+            if len(self._polled) > 0 and now - last_poll >= self.POLL_INTERVAL_SEC:
+                last_poll = now
+                to_poll.extend(self._polled)
+            if len(self._notified) > 0 and now - last_notified_poll >= NOTIFIED_POLL_SEC:
+                # in case a notification got lost
+                last_notified_poll = now
+                to_poll.extend(f for key_fs in self._notified.values() for f in key_fs)
+            if len(to_poll) > 0:
+                try:
+                    dones.extend(self._poll(to_poll))
+                except Exception as e: # pylint: disable=broad-except
+                    logger.warning("error checking call status: {}".format(e))
+
+            for f in dones:
+                self.callback_pool.apply_async(_complete, (f,))
+
+    def _poll(self, fs):
+        """
+        Check the storage for which of `fs` are done, and stop following them
+
+        :return: the done futures
+        """
+        by_storage_path = {}
+        for f in fs:
+            # storage paths are lists, so key by their tuple
+            by_storage_path.setdefault(tuple(f.storage_path), []).append(f)
+
+        done_call_ids = set()
+        for storage_path, path_fs in by_storage_path.items():
+            storage_handler = storage.get_storage_for_path(list(storage_path))
+            done_call_ids.update(_find_done_call_ids(path_fs, self.RETURN_EARLY_N,
+                                                     self.MAX_DIRECT_QUERY_N, False,
+                                                     CALLBACK_POOL_SIZE, storage_handler))
+
+        dones = [f for f in self._polled
+                 if (f.callset_id, f.invoke_call_id) in done_call_ids]
+        self._polled = [f for f in self._polled
+                        if (f.callset_id, f.invoke_call_id) not in done_call_ids]
+        for key in done_call_ids:
+            dones.extend(self._notified.pop(key, []))
+        return dones
+
+
+def _complete(future):
+    """
+    Fetch the output of a completed call and run its done callbacks
+    """
+    try:
+        future.result(throw_except=False)
+    except Exception as e: # pylint: disable=broad-except
+        logger.warning("error fetching result of {} {}: {}".format(
+            future.callset_id, future.call_id, e))
+    future._run_done_callbacks() # pylint: disable=protected-access
+
+
+def get_monitor():
+    """
+    Return the process-wide completion monitor, started on first use
+    (and again in a forked child, which doesn't inherit its thread).
+    """
+    global _monitor, _monitor_pid # pylint: disable=global-statement
+    with _monitor_lock:
+        if _monitor is None or _monitor_pid != os.getpid():
+            _monitor = CompletionMonitor()
+            _monitor_pid = os.getpid()
+        return _monitor
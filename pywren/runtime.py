@@ -46,3 +46,37 @@ def runtime_valid(runtime_meta):
     this_version_str = version_str(sys.version_info)
 
     return this_version_str == runtime_meta['python_ver']
+
+
+# site-packages the jobrunner imports before it can extract anything lazily,
+# and the codecs it extracts with
+LAZY_RUNTIME_EAGER_PACKAGES = ['boto3', 'botocore', 's3transfer', 'jmespath', 'dateutil',
+                               'urllib3', 'certifi', 'six', 'tblib', 'zstandard', 'lz4']
+
+
+def lazy_runtime_member(member, hot_set=()):
+    """
+    Return True if a member of a runtime tar can be extracted lazily,
+    when it is first imported. Only the modules of site-packages are,
+    save for those the jobrunner needs first.
+    :param member: `tarfile.TarInfo` of the member
+    :param hot_set: package names and path prefixes to extract up front
+    :return: True if the member can be extracted lazily
+    """
+    parts = member.name.split("/")
+    if "site-packages" not in parts:
+        return False
+    package_parts = parts[parts.index("site-packages") + 1:]
+    if len(package_parts) == 0:
+        return False
+    package = package_parts[0].split(".")[0]
+    if package in LAZY_RUNTIME_EAGER_PACKAGES or package in hot_set:
+        return False
+    if any(member.name.startswith(p) for p in hot_set):
+        return False
+
+    filename = parts[-1]
+    if filename.endswith(".py") or filename.endswith(".pyc"):
+        return True
+    # other shared libraries may be loaded without an import
+    return filename.endswith(".so") and (".cpython-" in filename or ".abi3." in filename)
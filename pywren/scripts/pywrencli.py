@@ -17,10 +17,13 @@
 #!/usr/bin/env python
 from __future__ import print_function
 
+import gzip
 import io
 import json
 import os
 import sys
+import tarfile
+import tempfile
 import time
 import zipfile
 
@@ -30,7 +33,9 @@ import botocore.exceptions
 import click
 import pywren
 import pywren.runtime
+import pywren.storage
 from pywren import ec2standalone
+from pywren import wrenutil
 
 
 @click.group()
@@ -583,6 +588,86 @@ def cleanup_all(ctx, force):
                 raise
 
 
+@click.command()
+@click.option('--codec', default='zlib', type=click.Choice(['zlib', 'zstd', 'lz4']),
+              help=('chunk compression, zstd and lz4 need their package where the handler '
+                    'runs (and in the runtime too, for --lazy)'))
+@click.option('--target_bucket', default=None,
+              help='bucket to write the converted runtime to (default the pywren bucket)')
+@click.option('--target_key', default=None,
+              help='key of the converted runtime')
+@click.option('--lazy', is_flag=True, default=False,
+              help='extract the modules of site-packages only when they are imported')
+@click.option('--hot_set', default=None, type=click.Path(exists=True),
+              help='file listing packages and paths a lazy runtime extracts up front')
+@click.pass_context
+def convert_runtime(ctx, codec, target_bucket, target_key, lazy, hot_set):
+    """
+    Convert the configured .tar.gz runtime to a chunked archive,
+    which lambdas download and decompress in parallel.
+    """
+    config_filename = ctx.obj['config_filename']
+    config = pywren.wrenconfig.load(config_filename)
+
+    runtime_meta = pywren.storage.get_runtime_info(config['runtime'])
+    if runtime_meta.get('archive_format') == wrenutil.CHUNKED_ARCHIVE_FORMAT:
+        raise click.ClickException("the runtime is already a chunked archive")
+    if 'urls' in runtime_meta:
+        # all the shards are the same runtime
+        source_bucket, source_key = wrenutil.split_s3_url(runtime_meta['urls'][0])
+    else:
+        source_bucket = config['runtime']['s3_bucket']
+        source_key = config['runtime']['s3_key']
+
+    if target_bucket is None:
+        target_bucket = config['s3']['bucket']
+    if target_key is None:
+        runtime_name = os.path.basename(source_key)
+        if runtime_name.endswith(".tar.gz"):
+            runtime_name = runtime_name[:-len(".tar.gz")]
+        if lazy:
+            runtime_name += "_lazy"
+        target_key = "pywren.runtimes/{}_{}{}".format(runtime_name, codec,
+                                                      wrenutil.CHUNKED_ARCHIVE_EXT)
+
+    hot_set_entries = []
+    if hot_set is not None:
+        with open(hot_set, 'r') as fid:
+            hot_set_entries = [l.strip() for l in fid
+                               if l.strip() != "" and not l.startswith("#")]
+
+    s3 = boto3.client("s3")
+    with tempfile.TemporaryFile() as source, tempfile.TemporaryFile() as target:
+        click.echo("downloading s3://{}/{}".format(source_bucket, source_key))
+        s3.download_fileobj(source_bucket, source_key, source)
+        source.seek(0)
+        if lazy:
+            source_tar = tarfile.open(fileobj=source, mode="r:gz")
+            index = wrenutil.write_lazy_chunked_archive(
+                source_tar, target,
+                lambda m: pywren.runtime.lazy_runtime_member(m, hot_set_entries), codec)
+            click.echo("{} of {} files are extracted lazily".format(
+                len(index['files']), len(source_tar.getmembers())))
+        else:
+            tar_stream = gzip.GzipFile(fileobj=source, mode='rb')
+            index = wrenutil.write_chunked_archive(tar_stream, target, codec)
+        target.seek(0)
+        click.echo("uploading {} chunks to s3://{}/{}".format(len(index['chunks']),
+                                                              target_bucket, target_key))
+        s3.upload_fileobj(target, target_bucket, target_key)
+
+    # shards of the source runtime aren't chunked, so the new runtime has none
+    runtime_meta.pop('urls', None)
+    runtime_meta['archive_format'] = wrenutil.CHUNKED_ARCHIVE_FORMAT
+    runtime_meta['archive_codec'] = codec
+    if lazy:
+        runtime_meta['archive_hot_set'] = hot_set_entries
+    s3.put_object(Bucket=target_bucket, Key=pywren.storage.get_runtime_meta_key(target_key),
+                  Body=json.dumps(runtime_meta).encode('ascii'))
+
+    click.echo("set runtime s3_bucket to {} and s3_key to {} in {} to use it".format(
+        target_bucket, target_key, config_filename))
+
 
 cli.add_command(create_config)
 cli.add_command(test_config)
@@ -602,6 +687,7 @@ cli.add_command(cleanup_all)
 cli.add_command(print_latest_logs)
 cli.add_command(log_url)
 cli.add_command(standalone)
+cli.add_command(convert_runtime)
 
 
 def main():
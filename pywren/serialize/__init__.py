@@ -31,4 +31,4 @@
 # POSSIBILITY OF SUCH DAMAGE.
 #
 from pywren.serialize.serialize import SerializeIndependent
-from pywren.serialize.util import create_mod_data
+from pywren.serialize.util import create_mod_data, create_mod_zip
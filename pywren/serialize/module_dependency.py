@@ -25,8 +25,87 @@
 
 import ast
 import imp
+import json
 import logging
+import os
 import pkgutil
+import threading
+
+# path of the on-disk cache (or None) -> shared ImportCache
+_import_caches = {}
+_import_caches_lock = threading.Lock()
+
+
+class ImportCache(object):
+    """
+    Root modules imported by each source file, so files that haven't
+    changed since (same mtime and size) are never parsed again. Optionally
+    kept in a JSON file at `path`, to survive across processes.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self._lock = threading.Lock()
+        # source path -> [mtime, size, list of imported root modules]
+        self._entries = {}
+        self._dirty = False
+        if path is not None and os.path.exists(path):
+            try:
+                with open(path, 'r') as fid:
+                    self._entries = json.load(fid)
+            except (IOError, ValueError) as e:
+                logging.getLogger(__name__).warning(
+                    "ignoring unreadable import cache {}: {}".format(path, e))
+
+    @staticmethod
+    def stamp(filename):
+        st = os.stat(filename)
+        return [st.st_mtime, st.st_size]
+
+    def get(self, filename):
+        """
+        :return: the set of root modules imported by `filename`,
+                 or None if it isn't cached or has changed.
+        """
+        with self._lock:
+            entry = self._entries.get(filename)
+        if entry is None or entry[:2] != self.stamp(filename):
+            return None
+        return set(entry[2])
+
+    def put(self, filename, stamp, imports):
+        """
+        Record the imports parsed from `filename`, as it was at `stamp`
+        """
+        with self._lock:
+            self._entries[filename] = stamp + [sorted(imports)]
+            self._dirty = True
+
+    def save(self):
+        """
+        Write the cache to its file, if it has one and anything changed
+        """
+        if self.path is None or not self._dirty:
+            return
+        with self._lock:
+            data = json.dumps(self._entries)
+            self._dirty = False
+        # write and rename, so concurrent readers never see a partial file
+        tmp_path = "{}.tmp_{}".format(self.path, os.getpid())
+        with open(tmp_path, 'w') as fid:
+            fid.write(data)
+        os.rename(tmp_path, self.path)
+
+
+def get_import_cache(path=None):
+    """
+    Return the process-wide import cache backed by `path` (None for
+    an in-memory one), so every serializer reuses the same parses.
+    """
+    with _import_caches_lock:
+        if path not in _import_caches:
+            _import_caches[path] = ImportCache(path)
+        return _import_caches[path]
 
 
 class ModuleDependencyAnalyzer(object):
@@ -38,9 +117,16 @@ class ModuleDependencyAnalyzer(object):
         imp.C_BUILTIN: 'built-in',
     }
 
-    def __init__(self):
-        """Creates new ModuleDependencyAnalyzer"""
+    def __init__(self, import_cache=None):
+        """
+        Creates new ModuleDependencyAnalyzer
+        :param import_cache: ImportCache of the imports of the source files
+                             inspected, which defaults to the in-memory one
+        """
         self._logger = logging.getLogger('multyvac.dependency-analyzer')
+        if import_cache is None:
+            import_cache = get_import_cache()
+        self._import_cache = import_cache
         # Root modules that have been or are being inspected
         self._inspected_modules = set()
         # Root modules that have yet to be inspected
@@ -114,17 +200,7 @@ class ModuleDependencyAnalyzer(object):
             self._logger.debug('Module %r is source/compiled. Added path %r',
                                root_module_name, pathname)
             # TODO: Does this work with compiled sources?
-            try:
-                source_imps = self._find_imports(ast.parse(fp.read(),
-                                                           root_module_name))
-            except SyntaxError:
-                self._logger.debug('Module %r has a syntax error. '
-                                   'Skipping source analysis',
-                                   root_module_name)
-                # For malformed source code
-                source_imps = []
-            # Close the file handle that's been opened for us by find_module
-            fp.close()
+            source_imps = self._source_imports(fp, pathname, root_module_name)
             self._logger.debug('Module %r had these imports %r',
                                root_module_name, source_imps)
             for source_imp in source_imps:
@@ -178,17 +254,7 @@ class ModuleDependencyAnalyzer(object):
                                    package_name,
                                    submodule_name)
                 # TODO: Does this work with compiled sources?
-                try:
-                    source_imps = self._find_imports(ast.parse(fp.read(),
-                                                               submodule_name))
-                except SyntaxError:
-                    self._logger.debug('%r -> %r has a syntax error. '
-                                       'Skipping source analysis',
-                                       package_name,
-                                       submodule_name)
-                    source_imps = []
-                # Close the file handle that's been opened for us by find_module
-                fp.close()
+                source_imps = self._source_imports(fp, pathname, submodule_name)
                 self._logger.debug('%r -> %r had these imports %r',
                                    package_name, submodule_name, source_imps)
                 for source_imp in source_imps:
@@ -245,6 +311,35 @@ class ModuleDependencyAnalyzer(object):
 
         return ret
 
+    def _source_imports(self, fp, pathname, module_name):
+        """
+        Returns the root modules imported by the source file :param fp:
+        (opened by find_module, and closed here), unless the import cache
+        already has them for the file's current version.
+        """
+        try:
+            source_imps = self._import_cache.get(pathname)
+            if source_imps is not None:
+                self._logger.debug('Module %r imports found in cache',
+                                   module_name)
+                return source_imps
+            # stat before reading, so a concurrent change is picked up next time
+            stamp = self._import_cache.stamp(pathname)
+            try:
+                source_imps = self._find_imports(ast.parse(fp.read(),
+                                                           module_name))
+            except SyntaxError:
+                self._logger.debug('Module %r has a syntax error. '
+                                   'Skipping source analysis',
+                                   module_name)
+                # For malformed source code
+                source_imps = set()
+            self._import_cache.put(pathname, stamp, source_imps)
+            return source_imps
+        finally:
+            # Close the file handle that's been opened for us by find_module
+            fp.close()
+
     @staticmethod
     def _is_relative_import(module_name, path):
         """Checks if import is relative. Returns True if relative, False if
@@ -33,6 +33,7 @@
 from __future__ import absolute_import
 from __future__ import print_function
 
+import logging
 import sys
 import types
 
@@ -48,14 +49,29 @@ else:
     PY3 = True
 
 # pylint: disable=wrong-import-position
+import pywren.wrenutil as wrenutil
 from pywren.serialize.cloudpickle import CloudPickler
-from pywren.serialize.module_dependency import ModuleDependencyAnalyzer
+from pywren.serialize.module_dependency import ModuleDependencyAnalyzer, get_import_cache
 from pywren.serialize import default_preinstalls
+from pywren.serialize.util import out_of_band_persistent_id
+
+logger = logging.getLogger(__name__)
 
 class SerializeIndependent(object):
-    def __init__(self, preinstalled_modules=default_preinstalls.modules):
+    def __init__(self, preinstalled_modules=default_preinstalls.modules,
+                 import_cache_path=None, out_of_band_buffers=False):
+        """
+        :param preinstalled_modules: modules in the runtime, which are never shipped
+        :param import_cache_path: JSON file caching the imports of module files
+                                  across processes. Default None, in memory only.
+        :param out_of_band_buffers: keep the data of large numpy arrays out of the
+                                    pickle stream, see `wrenutil.pack_out_of_band`.
+                                    Default False.
+        """
         # pylint: disable=dangerous-default-value
         self.preinstalled_modules = preinstalled_modules
+        self.out_of_band_buffers = out_of_band_buffers
+        self._import_cache = get_import_cache(import_cache_path)
         self._modulemgr = None
 
     def __call__(self, list_of_objs, **kwargs):
@@ -63,7 +79,7 @@ class SerializeIndependent(object):
         Serialize f, args, kwargs independently
         """
 
-        self._modulemgr = ModuleDependencyAnalyzer()
+        self._modulemgr = ModuleDependencyAnalyzer(self._import_cache)
         preinstalled_modules = [name for name, _ in self.preinstalled_modules]
         self._modulemgr.ignore(preinstalled_modules)
 
@@ -78,9 +94,15 @@ class SerializeIndependent(object):
         for obj in list_of_objs:
             s = StringIO()
             cp = CloudPickler(s, 2)
-            cp.dump(obj)
+            if self.out_of_band_buffers:
+                buffers = []
+                cp.persistent_id = out_of_band_persistent_id(buffers)
+                cp.dump(obj)
+                strs.append(wrenutil.pack_out_of_band(s.getvalue(), buffers))
+            else:
+                cp.dump(obj)
+                strs.append(s.getvalue())
             cps.append(cp)
-            strs.append(s)
 
         if '_ignore_module_dependencies' in kwargs:
             ignore_modulemgr = kwargs['_ignore_module_dependencies']
@@ -100,8 +122,12 @@ class SerializeIndependent(object):
 
             mod_paths = self._modulemgr.get_and_clear_paths()
             #print "mod_paths=", mod_paths
+            try:
+                self._import_cache.save()
+            except (IOError, OSError) as e:
+                logger.warning("could not save import cache: {}".format(e))
 
-        return ([s.getvalue() for s in strs], mod_paths)
+        return (strs, mod_paths)
 
 if __name__ == "__main__":
     serialize = SerializeIndependent()
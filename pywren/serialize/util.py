@@ -35,9 +35,30 @@ Generic utility functions for serialization
 """
 
 import base64
+import collections
+import io
 import os
+import sys
+import threading
+import zipfile
 
 import glob2
+from six.moves import cPickle as pickle
+
+import pywren.wrenutil as wrenutil
+
+# absolute path -> ((mtime, size), contents), so repeated maps
+# don't re-read unchanged module files. Least recently used first, and
+# only up to MOD_FILE_CACHE_BYTES of contents are kept.
+MOD_FILE_CACHE_BYTES = 64 * 1024 * 1024
+_mod_file_cache = collections.OrderedDict()
+_mod_file_cache_bytes = 0
+_mod_file_cache_lock = threading.Lock()
+# fixed timestamp of the files in module zips, so the same modules
+# always zip (and hash) the same
+MOD_ZIP_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+# numpy arrays at least this large are pickled out of band
+OUT_OF_BAND_MIN_BYTES = 1024
 
 
 def bytes_to_b64str(byte_data):
@@ -45,22 +66,126 @@ def bytes_to_b64str(byte_data):
     byte_data_64_ascii = byte_data_64.decode('ascii')
     return byte_data_64_ascii
 
-def create_mod_data(mod_paths):
+def _read_mod_file(filename):
+    global _mod_file_cache_bytes # pylint: disable=global-statement
+    st = os.stat(filename)
+    stamp = (st.st_mtime, st.st_size)
+    with _mod_file_cache_lock:
+        cached = _mod_file_cache.pop(filename, None)
+        if cached is not None:
+            if cached[0] == stamp:
+                _mod_file_cache[filename] = cached
+                return cached[1]
+            _mod_file_cache_bytes -= len(cached[1])
+    with open(filename, 'rb') as fid:
+        mod_str = fid.read()
+    with _mod_file_cache_lock:
+        if filename not in _mod_file_cache:
+            _mod_file_cache[filename] = (stamp, mod_str)
+            _mod_file_cache_bytes += len(mod_str)
+        while _mod_file_cache_bytes > MOD_FILE_CACHE_BYTES:
+            _, (_, evicted) = _mod_file_cache.popitem(last=False)
+            _mod_file_cache_bytes -= len(evicted)
+    return mod_str
 
-    module_data = {}
-    # load mod paths
-    for m in mod_paths:
+def _mod_files(mod_paths):
+    """
+    Yield `(dest_filename, filename)` of the module files under `mod_paths`,
+    in sorted order
+    """
+    for m in sorted(mod_paths):
         if os.path.isdir(m):
             files = glob2.glob(os.path.join(m, "**/*.py"))
             pkg_root = os.path.abspath(os.path.dirname(m))
         else:
             pkg_root = os.path.abspath(os.path.dirname(m))
             files = [m]
-        for f in files:
+        for f in sorted(files):
             f = os.path.abspath(f)
-            mod_str = open(f, 'rb').read()
+            yield f[len(pkg_root)+1:], f
 
-            dest_filename = f[len(pkg_root)+1:]
-            module_data[dest_filename] = bytes_to_b64str(mod_str)
+def create_mod_data(mod_paths):
+    """
+    Read the module files under `mod_paths` into a dict of base64 strings
+    """
+    module_data = {}
+    for dest_filename, f in _mod_files(mod_paths):
+        module_data[dest_filename] = bytes_to_b64str(_read_mod_file(f))
 
     return module_data
+
+def create_mod_zip(mod_paths):
+    """
+    Pack the module files under `mod_paths` into a compressed zip, which can
+    be put on sys.path as is. The same modules always give the same zip.
+    """
+    zip_buf = io.BytesIO()
+    with zipfile.ZipFile(zip_buf, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+        for dest_filename, f in _mod_files(mod_paths):
+            info = zipfile.ZipInfo(dest_filename.replace(os.sep, "/"), MOD_ZIP_DATE_TIME)
+            info.compress_type = zipfile.ZIP_DEFLATED
+            info.external_attr = 0o644 << 16
+            zip_file.writestr(info, _read_mod_file(f))
+    return zip_buf.getvalue()
+
+def out_of_band_persistent_id(buffers):
+    """
+    Return a pickler `persistent_id` hook which keeps the data of large numpy
+    arrays out of the pickle stream, appending it to `buffers` instead. The
+    arrays are rebuilt from the buffers by `out_of_band_persistent_load`.
+    """
+    np = sys.modules.get('numpy')
+
+    def persistent_id(obj):
+        # only plain arrays, which are just a dtype, a shape and their data
+        if np is None or type(obj) is not np.ndarray: # pylint: disable=unidiomatic-typecheck
+            return None
+        if (obj.dtype.hasobject or obj.dtype.fields is not None
+                or obj.nbytes < OUT_OF_BAND_MIN_BYTES):
+            return None
+        if obj.flags.c_contiguous:
+            order = 'C'
+        elif obj.flags.f_contiguous:
+            order = 'F'
+        else:
+            return None
+        buffers.append(memoryview(obj.reshape(-1, order=order).view(np.uint8)))
+        return ("ndarray", len(buffers) - 1, obj.dtype.str, obj.shape, order)
+
+    return persistent_id
+
+def out_of_band_persistent_load(buffers):
+    """
+    Return the unpickler `persistent_load` hook matching `out_of_band_persistent_id`.
+    Arrays use the buffers in place, so they aren't copied (and are read-only).
+    """
+    def persistent_load(pid):
+        import numpy as np
+        _, buffer_i, dtype, shape, order = pid
+        arr = np.frombuffer(buffers[buffer_i], dtype=np.dtype(dtype)).reshape(shape,
+                                                                              order=order)
+        # the data may be a writable bytearray, which we don't want to change
+        arr.flags.writeable = False
+        return arr
+
+    return persistent_load
+
+def dumps_out_of_band(obj):
+    """
+    Pickle `obj` with its large numpy arrays out of band, see `wrenutil.pack_out_of_band`
+    """
+    pickled = io.BytesIO()
+    buffers = []
+    pickler = pickle.Pickler(pickled, 2)
+    pickler.persistent_id = out_of_band_persistent_id(buffers)
+    pickler.dump(obj)
+    return wrenutil.pack_out_of_band(pickled.getvalue(), buffers)
+
+def loads_out_of_band(data):
+    """
+    Unpickle an object pickled by `dumps_out_of_band`
+    """
+    pickled, buffers = wrenutil.unpack_out_of_band(data)
+    unpickler = pickle.Unpickler(io.BytesIO(pickled.tobytes()))
+    unpickler.persistent_load = out_of_band_persistent_load(buffers)
+    return unpickler.load()
@@ -17,6 +17,8 @@
 import sys
 
 if sys.version_info > (3, 0):
-    from pywren.storage.storage import Storage, get_runtime_info
+    from pywren.storage.storage import Storage, get_runtime_info, get_runtime_etag, \
+        get_runtime_meta_key, get_storage, get_storage_for_path
 else:
-    from pywren.storage.storage import Storage, get_runtime_info
+    from pywren.storage.storage import Storage, get_runtime_info, get_runtime_etag, \
+        get_runtime_meta_key, get_storage, get_storage_for_path
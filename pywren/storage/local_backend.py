@@ -0,0 +1,113 @@
+#
+# Copyright 2018 PyWren Team
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+
+from pywren import wrenutil
+from .exceptions import StorageNoSuchKeyError
+
+
+class LocalBackend(object):
+    """
+    A storage backend that keeps each object as a file under a local
+    directory tree, with the key as the relative path. Useful for running
+    everything on a single machine, or in CI, without the network hop.
+    """
+
+    def __init__(self, local_config):
+        self.storage_path = local_config['storage_path']
+
+    def _key_path(self, key):
+        return os.path.join(self.storage_path, key)
+
+    def put_object(self, key, data):
+        """
+        Put an object in local storage. Override the object if the key already exists.
+        The object is written to a temporary file and renamed into place, so readers
+        never see a partially written object.
+        :param key: key of the object.
+        :param data: data of the object
+        :type data: str/bytes
+        :return: None
+        """
+        wrenutil.atomic_write(self._key_path(key), data)
+
+    def put_object_parts(self, key, parts):
+        """
+        Put an object made up of a list of buffers in local storage, writing
+        them one by one.
+        :param key: key of the object.
+        :param parts: list of bytes-like objects
+        :return: None
+        """
+        wrenutil.atomic_write(self._key_path(key), parts)
+
+    def get_object(self, key, byte_range=None):
+        """
+        Get object from local storage with a key. Throws StorageNoSuchKeyError if the given
+        key does not exist.
+        :param key: key of the object
+        :param byte_range: Only read this inclusive `(first, last)` byte range. Default None.
+        :return: Data of the object
+        :rtype: str/bytes
+        """
+        try:
+            with open(self._key_path(key), 'rb') as fid:
+                if byte_range is not None:
+                    fid.seek(byte_range[0])
+                    return fid.read(byte_range[1] - byte_range[0] + 1)
+                return fid.read()
+        except (IOError, OSError) as e:
+            if e.errno == 2: # ENOENT
+                raise StorageNoSuchKeyError(key)
+            raise e
+
+    def key_exists(self, key):
+        """
+        Check if a key exists in local storage.
+        :param key: key of the object
+        :return: True if key exists, False if not exists
+        :rtype: boolean
+        """
+        return os.path.isfile(self._key_path(key))
+
+    def list_keys_with_prefix(self, prefix, start_after=None):
+        """
+        Return a list of keys for the given prefix, in lexicographic order.
+        :param prefix: Prefix to filter object names.
+        :param start_after: Only return keys that sort after this one. Default None.
+        :return: List of keys in storage that match the given prefix.
+        :rtype: list of str
+        """
+        # like S3, the prefix need not end on a directory boundary, so we
+        # search from its parent and prune directories that can't match
+        search_dir = os.path.dirname(self._key_path(prefix))
+
+        key_list = []
+        for dirpath, dirnames, filenames in os.walk(search_dir):
+            dir_key = os.path.relpath(dirpath, self.storage_path)
+            dir_key = "" if dir_key == "." else dir_key + "/"
+            dirnames[:] = [d for d in dirnames
+                           if (dir_key + d + "/").startswith(prefix) or
+                           prefix.startswith(dir_key + d + "/")]
+            for filename in filenames:
+                if filename.startswith(wrenutil.ATOMIC_WRITE_TMP_PREFIX):
+                    continue
+                key = dir_key + filename
+                if key.startswith(prefix) and (start_after is None or key > start_after):
+                    key_list.append(key)
+
+        return sorted(key_list)
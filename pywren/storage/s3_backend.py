@@ -16,13 +16,40 @@
 
 import botocore
 
+from pywren import wrenutil
 from .exceptions import StorageNoSuchKeyError
 
 
+def _split_parts(parts, part_size):
+    """
+    Regroup a list of buffers into lists of memoryview slices of them,
+    each adding up to `part_size` bytes (but the last), without copying
+    """
+    group = []
+    group_size = 0
+    for part in parts:
+        part = memoryview(part)
+        offset = 0
+        while offset < len(part):
+            piece = part[offset:offset + part_size - group_size]
+            group.append(piece)
+            group_size += len(piece)
+            offset += len(piece)
+            if group_size == part_size:
+                yield group
+                group = []
+                group_size = 0
+    if len(group) > 0:
+        yield group
+
+
 class S3Backend(object):
     """
     A wrap-up around S3 boto3 APIs.
     """
+    # objects made up of parts larger than this are put as multipart uploads,
+    # in parts of this size (S3 needs at least 5MB for all but the last part)
+    MULTIPART_PART_SIZE = 8 * 1024 * 1024
 
     def __init__(self, s3config):
         self.s3_bucket = s3config['bucket']
@@ -40,15 +67,50 @@ class S3Backend(object):
         """
         self.s3client.put_object(Bucket=self.s3_bucket, Key=key, Body=data)
 
-    def get_object(self, key):
+    def put_object_parts(self, key, parts):
+        """
+        Put an object made up of a list of buffers in S3, streaming them
+        without joining them. Objects larger than MULTIPART_PART_SIZE are put
+        as a multipart upload.
+        :param key: key of the object.
+        :param parts: list of bytes-like objects
+        :return: None
+        """
+        body = wrenutil.BufferListIO(parts)
+        if len(body) <= self.MULTIPART_PART_SIZE:
+            self.s3client.put_object(Bucket=self.s3_bucket, Key=key, Body=body)
+            return
+
+        upload_id = self.s3client.create_multipart_upload(Bucket=self.s3_bucket,
+                                                          Key=key)['UploadId']
+        try:
+            uploaded_parts = []
+            for part_i, group in enumerate(_split_parts(parts, self.MULTIPART_PART_SIZE)):
+                r = self.s3client.upload_part(Bucket=self.s3_bucket, Key=key,
+                                              UploadId=upload_id, PartNumber=part_i + 1,
+                                              Body=wrenutil.BufferListIO(group))
+                uploaded_parts.append({'ETag' : r['ETag'], 'PartNumber' : part_i + 1})
+            self.s3client.complete_multipart_upload(Bucket=self.s3_bucket, Key=key,
+                                                    UploadId=upload_id,
+                                                    MultipartUpload={'Parts' : uploaded_parts})
+        except Exception as e:
+            self.s3client.abort_multipart_upload(Bucket=self.s3_bucket, Key=key,
+                                                 UploadId=upload_id)
+            raise e
+
+    def get_object(self, key, byte_range=None):
         """
         Get object from S3 with a key. Throws StorageNoSuchKeyError if the given key does not exist.
         :param key: key of the object
+        :param byte_range: Only read this inclusive `(first, last)` byte range. Default None.
         :return: Data of the object
         :rtype: str/bytes
         """
+        extra_get_args = {}
+        if byte_range is not None:
+            extra_get_args['Range'] = 'bytes={}-{}'.format(*byte_range)
         try:
-            r = self.s3client.get_object(Bucket=self.s3_bucket, Key=key)
+            r = self.s3client.get_object(Bucket=self.s3_bucket, Key=key, **extra_get_args)
             data = r['Body'].read()
             return data
         except botocore.exceptions.ClientError as e:
@@ -57,6 +119,23 @@ class S3Backend(object):
             else:
                 raise e
 
+    def get_etag(self, key):
+        """
+        Get the ETag of an object in S3, which changes whenever it's overwritten.
+        Throws StorageNoSuchKeyError if the given key does not exist.
+        :param key: key of the object
+        :return: ETag of the object
+        :rtype: str
+        """
+        try:
+            r = self.s3client.head_object(Bucket=self.s3_bucket, Key=key)
+            return r['ETag']
+        except botocore.exceptions.ClientError as e:
+            if e.response['Error']['Code'] in ["404", "NoSuchKey"]:
+                raise StorageNoSuchKeyError(key)
+            else:
+                raise e
+
     def key_exists(self, key):
         """
         Check if a key exists in S3.
@@ -68,21 +147,25 @@ class S3Backend(object):
             self.s3client.head_object(Bucket=self.s3_bucket, Key=key)
             return True
         except botocore.exceptions.ClientError as e:
-            if e.response['Error']['Code'] == "NoSuchKey":
+            # HEAD responses have no body, so the error code is the HTTP status
+            if e.response['Error']['Code'] in ["404", "NoSuchKey"]:
                 return False
             else:
                 raise e
 
-    def list_keys_with_prefix(self, prefix):
+    def list_keys_with_prefix(self, prefix, start_after=None):
         """
         Return a list of keys for the given prefix.
         :param prefix: Prefix to filter object names.
+        :param start_after: Only return keys that sort after this one. Default None.
         :return: List of keys in bucket that match the given prefix.
         :rtype: list of str
         """
         paginator = self.s3client.get_paginator('list_objects_v2')
         operation_parameters = {'Bucket': self.s3_bucket,
                                 'Prefix': prefix}
+        if start_after is not None:
+            operation_parameters['StartAfter'] = start_after
         page_iterator = paginator.paginate(**operation_parameters)
 
         key_list = []
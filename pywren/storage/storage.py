@@ -16,21 +16,46 @@
 
 from __future__ import absolute_import
 
+import collections
 import json
 import os
+import sys
+import threading
+from multiprocessing.pool import ThreadPool
+
+from pywren import wrenutil
 
 from  .exceptions import StorageNoSuchKeyError, StorageOutputNotFoundError
+from .local_backend import LocalBackend
 from .s3_backend import S3Backend
-from .storage_utils import create_status_key, create_output_key, status_key_suffix
+from .storage_utils import create_status_key, create_status_prefix, create_output_key, \
+    create_combined_key, create_blob_key, status_key_ext, combined_key_ext, get_storage_path, \
+    get_storage_config_from_path
+
+# storage path -> shared Storage handler, see get_storage()
+_storage_handlers = {}
+_storage_handlers_pid = None
+_storage_handlers_lock = threading.Lock()
+
+# bucket -> S3Backend looking up runtime ETags, see get_runtime_etag()
+_runtime_backends = {}
+_runtime_backends_pid = None
+_runtime_backends_lock = threading.Lock()
 
 
 class Storage(object):
     """
     A Storage object is used by executors and other components to access underlying storage backend
     without exposing the the implementation details.
-    Currently we only support S3 as the underlying backend.
-    We plan to support other storage backends in the future.
+    Currently we support S3 and a local filesystem directory as the underlying backend.
     """
+    # how many of the most recently scanned callsets to remember the seen
+    # status of, and how many blob keys to remember as uploaded
+    STATUS_CALLSETS = 256
+    BLOB_KEYS = 4096
+
+    # how much of a combined status and output object to read for its status
+    COMBINED_STATUS_READ_SIZE = 16384
 
     def __init__(self, config):
         self.storage_config = config
@@ -38,9 +63,18 @@ class Storage(object):
         self.backend_type = config['storage_backend']
         if config['storage_backend'] == 's3':
             self.backend_handler = S3Backend(config['backend_config'])
+        elif config['storage_backend'] == 'local':
+            self.backend_handler = LocalBackend(config['backend_config'])
         else:
             raise NotImplementedError(("Using {} as storage backend is" +
                                        "not supported yet").format(config['storage_backend']))
+        # callset_id -> set of call IDs whose status we have already seen,
+        # least recently scanned first
+        self._callset_status = collections.OrderedDict()
+        # keys of the blobs known to be in storage (as an ordered set, least
+        # recently used first), see put_blob()
+        self._blob_keys = collections.OrderedDict()
+        self._lock = threading.Lock()
 
     def get_storage_config(self):
         """
@@ -53,9 +87,12 @@ class Storage(object):
         """
         Put input data into storage.
         :param key: data key
-        :param data: data content
+        :param data: data content, or a list of buffers making it up, which
+                     are uploaded without joining them
         :return: None
         """
+        if isinstance(data, list):
+            return self.backend_handler.put_object_parts(key, data)
         return self.backend_handler.put_object(key, data)
 
     def put_func(self, key, func):
@@ -67,28 +104,129 @@ class Storage(object):
         """
         return self.backend_handler.put_object(key, func)
 
-    def get_callset_status(self, callset_id):
+    def put_blob(self, digest, data):
+        """
+        Put content-addressed data into storage, unless it is already there.
+        Blobs uploaded (or found) by this process are remembered, so they are
+        only checked for in storage the first time.
+        :param digest: sha256 hex digest of the data
+        :param data: blob content
+        :return: `(key, uploaded)`, the key of the blob and whether it was uploaded
+        """
+        key = create_blob_key(self.prefix, digest)
+        with self._lock:
+            known = self._blob_keys.pop(key, False) is None
+            if known:
+                self._blob_keys[key] = None
+        if known:
+            return key, False
+        uploaded = False
+        if not self.backend_handler.key_exists(key):
+            self.backend_handler.put_object(key, data)
+            uploaded = True
+        with self._lock:
+            self._blob_keys[key] = None
+            if len(self._blob_keys) > self.BLOB_KEYS:
+                self._blob_keys.popitem(last=False)
+        return key, uploaded
+
+    def get_callset_status(self, callset_id, pending_call_ids=None):
         """
         Get the status of a callset.
+        Call IDs seen by earlier calls are remembered. If `pending_call_ids` is given, only
+        the status keys from the lowest pending call ID onward are listed, and nothing at
+        all once every pending call has been seen.
         :param callset_id: callset's ID
+        :param pending_call_ids: IDs of the calls the caller is waiting for. Default None.
         :return: A list of call IDs that have updated status.
         """
         # TODO: a better API for this is to return status for all calls in the callset. We'll fix
         #  this in scheduler refactoring.
-        callset_prefix = os.path.join(self.prefix, callset_id)
-        keys = self.backend_handler.list_keys_with_prefix(callset_prefix)
-        suffix = status_key_suffix
-        status_keys = [k for k in keys if suffix in k]
-        call_ids = [k[len(callset_prefix)+1:].split("/")[0] for k in status_keys]
-        return call_ids
+        status_prefix, start_after = self._callset_scan_start(callset_id, pending_call_ids)
+        if status_prefix is None:
+            return sorted(self._callset_done_ids(callset_id))
+
+        keys = self.backend_handler.list_keys_with_prefix(status_prefix, start_after)
+        return self._callset_scan_done(callset_id, keys)
+
+    def _callset_done_ids(self, callset_id):
+        """
+        Return the set of call IDs of a callset whose status we have seen.
+        Only the STATUS_CALLSETS most recently scanned callsets are remembered,
+        the others are scanned from the start again.
+        """
+        with self._lock:
+            done_call_ids = self._callset_status.pop(callset_id, None)
+            if done_call_ids is None:
+                done_call_ids = set()
+            self._callset_status[callset_id] = done_call_ids
+            if len(self._callset_status) > self.STATUS_CALLSETS:
+                self._callset_status.popitem(last=False)
+            return done_call_ids
+
+    def forget_callset(self, callset_id):
+        """
+        Forget the status seen of a callset, once none of its calls are waited for.
+        :param callset_id: callset's ID
+        :return: None
+        """
+        with self._lock:
+            self._callset_status.pop(callset_id, None)
+
+    def _callset_scan_start(self, callset_id, pending_call_ids):
+        """
+        Work out where to list the status keys of a callset from.
+        :return: (status prefix, start after key), or (None, None) if there is
+            no need to list at all.
+        """
+        done_call_ids = self._callset_done_ids(callset_id)
+        status_prefix = create_status_prefix(self.prefix, callset_id)
+
+        start_after = None
+        if pending_call_ids is not None:
+            pending_call_ids = [c for c in pending_call_ids if c not in done_call_ids]
+            if len(pending_call_ids) == 0:
+                return None, None
+            # a strict prefix of the lexicographically lowest pending status key,
+            # so the listing starts right before it
+            start_after = status_prefix + min(pending_call_ids)
+        return status_prefix, start_after
+
+    def _callset_scan_done(self, callset_id, keys):
+        """
+        Record the status keys listed for a callset.
+        :return: A list of all call IDs of the callset that have updated status.
+        """
+        done_call_ids = self._callset_done_ids(callset_id)
+        status_prefix = create_status_prefix(self.prefix, callset_id)
+        for k in keys:
+            for ext in [status_key_ext, combined_key_ext]:
+                if k.endswith(ext):
+                    done_call_ids.add(k[len(status_prefix):-len(ext)])
+        return sorted(done_call_ids)
 
-    def get_call_status(self, callset_id, call_id):
+    def get_call_status(self, callset_id, call_id, combined=False):
         """
         Get status of a call.
         :param callset_id: callset ID of the call
         :param call_id: call ID of the call
+        :param combined: The call writes a combined status and output object, of
+            which only the start is read. Default False.
         :return: A dictionary containing call's status, or None if no updated status
         """
+        if combined:
+            combined_key = create_combined_key(self.prefix, callset_id, call_id)
+            try:
+                data = self.backend_handler.get_object(
+                    combined_key, (0, self.COMBINED_STATUS_READ_SIZE - 1))
+                status_end = wrenutil.combined_status_end(data)
+                if status_end > len(data):
+                    data += self.backend_handler.get_object(combined_key,
+                                                            (len(data), status_end - 1))
+            except StorageNoSuchKeyError:
+                return None
+            return json.loads(data[wrenutil.COMBINED_HEADER_SIZE:status_end].decode('ascii'))
+
         status_key = create_status_key(self.prefix, callset_id, call_id)
         try:
             data = self.backend_handler.get_object(status_key)
@@ -96,19 +234,123 @@ class Storage(object):
         except StorageNoSuchKeyError:
             return None
 
-    def get_call_output(self, callset_id, call_id):
+    def get_call_output(self, callset_id, call_id, combined=False):
         """
         Get the output of a call.
         :param callset_id: callset ID of the call
         :param call_id: call ID of the call
+        :param combined: The call writes a combined status and output object. Default False.
         :return: Output of the call.
         """
+        if combined:
+            _, output = self.get_call_status_and_output(callset_id, call_id)
+            if not output:
+                raise StorageOutputNotFoundError(callset_id, call_id)
+            return output
+
         output_key = create_output_key(self.prefix, callset_id, call_id)
         try:
             return self.backend_handler.get_object(output_key)
         except StorageNoSuchKeyError:
             raise StorageOutputNotFoundError(callset_id, call_id)
 
+    def get_call_status_and_output(self, callset_id, call_id):
+        """
+        Get the status and output of a call that writes a combined object,
+        with a single request.
+        :param callset_id: callset ID of the call
+        :param call_id: call ID of the call
+        :return: `(status, output)`, `(None, None)` if the call hasn't completed.
+            The output is empty if the call failed before producing any.
+        """
+        combined_key = create_combined_key(self.prefix, callset_id, call_id)
+        try:
+            data = self.backend_handler.get_object(combined_key)
+        except StorageNoSuchKeyError:
+            return None, None
+        status, output = wrenutil.unpack_combined(data)
+        return json.loads(status.decode('ascii')), output
+
+    def get_call_results(self, calls, parallelism=None, combined=False):
+        """
+        Get the status and output of many calls at once. The requests for all
+        of them are issued together, `parallelism` at a time, so their
+        latencies overlap.
+        :param calls: list of `(callset_id, call_id)`
+        :param parallelism: number of concurrent requests. Default None, which
+            uses the shared I/O pool (see `wrenutil.get_io_pool`).
+        :param combined: The calls write combined status and output objects, so
+            there is one request per call. Default False.
+        :return: A list of `(status, output)` in the order of `calls`, as returned by
+            `get_call_status` and `get_call_output`. Errors are returned in place of
+            the status or output they occurred fetching, e.g. StorageOutputNotFoundError.
+        """
+        def fetch(request):
+            get, call = request
+            try:
+                return get(*call)
+            except Exception as e: # pylint: disable=broad-except
+                return e
+
+        if combined:
+            requests = [(self.get_call_status_and_output, c) for c in calls]
+        else:
+            requests = [(self.get_call_status, c) for c in calls] + \
+                       [(self.get_call_output, c) for c in calls]
+        if parallelism is None:
+            responses = wrenutil.get_io_pool().map(fetch, requests)
+        else:
+            pool = ThreadPool(parallelism)
+            try:
+                responses = pool.map(fetch, requests)
+            finally:
+                pool.close()
+
+        if combined:
+            results = []
+            for call, response in zip(calls, responses):
+                if isinstance(response, Exception):
+                    results.append((response, response))
+                elif response[0] is not None and not response[1]:
+                    results.append((response[0], StorageOutputNotFoundError(*call)))
+                else:
+                    results.append(response)
+            return results
+        return list(zip(responses[:len(calls)], responses[len(calls):]))
+
+
+def _get_storage(storage_path, storage_config):
+    global _storage_handlers_pid # pylint: disable=global-statement
+    key = tuple(storage_path)
+    with _storage_handlers_lock:
+        if _storage_handlers_pid != os.getpid():
+            # don't share backend clients with a forked parent
+            _storage_handlers.clear()
+            _storage_handlers_pid = os.getpid()
+        if key not in _storage_handlers:
+            _storage_handlers[key] = Storage(storage_config)
+        return _storage_handlers[key]
+
+
+def get_storage(storage_config):
+    """
+    Get the process-wide Storage handler for a storage configuration, so that
+    backend clients and per-callset state are reused.
+    :param storage_config: storage configuration
+    :return: Storage handler
+    """
+    return _get_storage(get_storage_path(storage_config), storage_config)
+
+
+def get_storage_for_path(storage_path):
+    """
+    Get the process-wide Storage handler for a storage path (e.g. a
+    future's `storage_path`), without needing the pywren config.
+    :param storage_path: storage path, see storage_utils.get_storage_path
+    :return: Storage handler
+    """
+    return _get_storage(storage_path, get_storage_config_from_path(storage_path))
+
 
 def get_runtime_info(runtime_config):
     """
@@ -116,15 +358,56 @@ def get_runtime_info(runtime_config):
     :param runtime_config: configuration of runtime (dictionary)
     :return: runtime metadata
     """
+    if runtime_config['runtime_storage'] == 'local':
+        # jobs run with the same interpreter (and packages) as the client
+        return {'python_ver' : "{}.{}".format(sys.version_info[0], sys.version_info[1])}
     if runtime_config['runtime_storage'] != 's3':
         raise NotImplementedError(("Storing runtime in non-S3 storage is not " +
                                    "supported yet").format(runtime_config['runtime_storage']))
     config = dict()
     config['bucket'] = runtime_config['s3_bucket']
     handler = S3Backend(config)
-    key = runtime_config['s3_key']
-    if '.tar.gz' in key:
-        key = key.replace(".tar.gz", ".meta.json")
+    key = get_runtime_meta_key(runtime_config['s3_key'])
     json_str = handler.get_object(key)
     runtime_meta = json.loads(json_str.decode("ascii"))
     return runtime_meta
+
+
+def get_runtime_etag(runtime_config, runtime_url=""):
+    """
+    Get the ETag of a runtime, which identifies the version the handler uses.
+    :param runtime_config: configuration of runtime (dictionary)
+    :param runtime_url: s3 url of the runtime shard to use, if any
+    :return: ETag of the runtime, or None for a local runtime
+    """
+    if runtime_config['runtime_storage'] == 'local':
+        return None
+    if runtime_url:
+        bucket, key = wrenutil.split_s3_url(runtime_url)
+    else:
+        bucket, key = runtime_config['s3_bucket'], runtime_config['s3_key']
+    return _get_runtime_backend(bucket).get_etag(key)
+
+
+def _get_runtime_backend(bucket):
+    global _runtime_backends_pid # pylint: disable=global-statement
+    with _runtime_backends_lock:
+        if _runtime_backends_pid != os.getpid():
+            # don't share backend clients with a forked parent
+            _runtime_backends.clear()
+            _runtime_backends_pid = os.getpid()
+        if bucket not in _runtime_backends:
+            _runtime_backends[bucket] = S3Backend({'bucket' : bucket})
+        return _runtime_backends[bucket]
+
+
+def get_runtime_meta_key(runtime_key):
+    """
+    Get the key of the metadata of a runtime archive.
+    :param runtime_key: key of the runtime archive (.tar.gz or chunked)
+    :return: key of the runtime metadata
+    """
+    for ext in [".tar.gz", wrenutil.CHUNKED_ARCHIVE_EXT]:
+        if runtime_key.endswith(ext):
+            return runtime_key[:-len(ext)] + ".meta.json"
+    return runtime_key
@@ -22,30 +22,56 @@ func_key_suffix = "func.pickle"
 agg_data_key_suffix = "aggdata.pickle"
 data_key_suffix = "data.pickle"
 output_key_suffix = "output.pickle"
-status_key_suffix = "status.json"
-
-def create_func_key(prefix, callset_id):
+status_dir = "status"
+status_key_ext = ".json"
+# status and output in a single object, see wrenutil.pack_combined
+combined_key_ext = ".combined"
+window_dir = "windows"
+# content-addressed objects shared across callsets, see create_blob_key
+blob_dir = "blobs"
+blob_key_ext = ".pickle"
+
+def create_func_key(prefix, callset_id, window_id=None):
     """
     Create function key
     :param prefix: prefix
     :param callset_id: callset's ID
+    :param window_id: window of a streaming map, or None. Default None.
     :return: function key
     """
+    if window_id is not None:
+        return os.path.join(prefix, callset_id, window_dir,
+                            "{:05d}".format(window_id), func_key_suffix)
     func_key = os.path.join(prefix, callset_id, func_key_suffix)
     return func_key
 
 
-def create_agg_data_key(prefix, callset_id):
+def create_agg_data_key(prefix, callset_id, window_id=None):
     """
     Create aggregate data key
     :param prefix: prefix
     :param callset_id: callset's ID
+    :param window_id: window of a streaming map, or None. Default None.
     :return: a key for aggregate data
     """
+    if window_id is not None:
+        return os.path.join(prefix, callset_id, window_dir,
+                            "{:05d}".format(window_id), agg_data_key_suffix)
     agg_data_key = os.path.join(prefix, callset_id, agg_data_key_suffix)
     return agg_data_key
 
 
+def create_blob_key(prefix, digest):
+    """
+    Create the key of a content-addressed object, such as a function or its
+    module data, which is uploaded once and shared by every callset using it.
+    :param prefix: prefix
+    :param digest: sha256 hex digest of the object
+    :return: blob key
+    """
+    return os.path.join(prefix, blob_dir, digest + blob_key_ext)
+
+
 def create_data_key(prefix, callset_id, call_id):
     """
     Create data key
@@ -68,6 +94,17 @@ def create_output_key(prefix, callset_id, call_id):
     return os.path.join(prefix, callset_id, call_id, output_key_suffix)
 
 
+def create_status_prefix(prefix, callset_id):
+    """
+    Create the prefix under which all status keys of a callset live.
+    Call IDs are zero padded, so listing it returns statuses in call order.
+    :param prefix: prefix
+    :param callset_id: callset's ID
+    :return: status prefix, ending with a "/"
+    """
+    return os.path.join(prefix, callset_id, status_dir, "")
+
+
 def create_status_key(prefix, callset_id, call_id):
     """
     Create status key
@@ -76,7 +113,19 @@ def create_status_key(prefix, callset_id, call_id):
     :param call_id: call's ID
     :return: status key
     """
-    return os.path.join(prefix, callset_id, call_id, status_key_suffix)
+    return create_status_prefix(prefix, callset_id) + call_id + status_key_ext
+
+
+def create_combined_key(prefix, callset_id, call_id):
+    """
+    Create the key of a call's combined status and output object. It lives
+    next to the status keys, so listing the callset status finds it.
+    :param prefix: prefix
+    :param callset_id: callset's ID
+    :param call_id: call's ID
+    :return: combined key
+    """
+    return create_status_prefix(prefix, callset_id) + call_id + combined_key_ext
 
 
 def create_keys(prefix, callset_id, call_id):
@@ -94,11 +143,34 @@ def create_keys(prefix, callset_id, call_id):
 
 
 def get_storage_path(config):
-    if config['storage_backend'] != 's3':
+    if config['storage_backend'] == 's3':
+        return [config['storage_backend'], config['backend_config']['bucket'],
+                config['storage_prefix']]
+    elif config['storage_backend'] == 'local':
+        return [config['storage_backend'], config['backend_config']['storage_path'],
+                config['storage_prefix']]
+    raise NotImplementedError(
+        ("Using {} as storage backend is not supported yet").format(
+            config['storage_backend']))
+
+
+def get_storage_config_from_path(storage_path):
+    """
+    Build the storage config for a path returned by get_storage_path
+    :param storage_path: storage path
+    :return: storage configuration
+    """
+    storage_backend, location, prefix = storage_path
+    if storage_backend == 's3':
+        backend_config = {'bucket' : location}
+    elif storage_backend == 'local':
+        backend_config = {'storage_path' : location}
+    else:
         raise NotImplementedError(
-            ("Using {} as storage backend is not supported yet").format(
-                config['storage_backend']))
-    return [config['storage_backend'], config['backend_config']['bucket'], config['storage_prefix']]
+            ("Using {} as storage backend is not supported yet").format(storage_backend))
+    return {'storage_backend' : storage_backend,
+            'storage_prefix' : prefix,
+            'backend_config' : backend_config}
 
 
 def check_storage_path(config, prev_path):
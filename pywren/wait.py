@@ -16,20 +16,28 @@
 
 from __future__ import absolute_import
 
+import logging
 import random
 import time
-from multiprocessing.pool import ThreadPool
+
+from six.moves.queue import Queue, Empty
 
 from pywren.future import JobState
+import pywren.completion as completion
 import pywren.storage as storage
-import pywren.wrenconfig as wrenconfig
+import pywren.wrenutil as wrenutil
 
 ALL_COMPLETED = 1
 ANY_COMPLETED = 2
 ALWAYS = 3
 
+# how often to check storage while waiting for completion notifications
+NOTIFIED_POLL_SEC = 30
+
+logger = logging.getLogger(__name__)
+
 def wait(fs, return_when=ALL_COMPLETED, THREADPOOL_SIZE=64,
-         WAIT_DUR_SEC=5):
+         WAIT_DUR_SEC=5, fetch_results=True):
     """
     Wait for the Future instances `fs` to complete. Returns a 2-tuple of
     lists. The first list contains the futures that completed
@@ -38,8 +46,10 @@ def wait(fs, return_when=ALL_COMPLETED, THREADPOOL_SIZE=64,
 
     :param fs: A list of futures.
     :param return_when: One of `ALL_COMPLETED`, `ANY_COMPLETED`, `ALWAYS`
-    :param THREADPOOL_SIZE: Number of threads to use. Default 64
+    :param THREADPOOL_SIZE: Number of status queries to run at once. Default 64
     :param WAIT_DUR_SEC: Time interval between each check.
+    :param fetch_results: Download the outputs of the completed futures. If False,
+        `result()` of a completed future still has to fetch its output. Default True
     :return: `(fs_dones, fs_notdones)`
         where `fs_dones` is a list of futures that have completed
         and `fs_notdones` is a list of futures that have not completed.
@@ -65,13 +75,27 @@ def wait(fs, return_when=ALL_COMPLETED, THREADPOOL_SIZE=64,
     MAX_DIRECT_QUERY_N = 16
     RETURN_EARLY_N = 16
 
+    # if we are told when calls complete there's no need to poll
+    if all(completion.notified(f) for f in fs
+           if f._state not in [JobState.success, JobState.error]):
+        return _wait_notified(fs, return_when, MAX_DIRECT_QUERY_N,
+                              THREADPOOL_SIZE, fetch_results)
+
+    # share one storage handler across rounds, so each round's callset
+    # scan picks up where the previous one stopped
+    storage_handler = None
+    if any(f._state not in [JobState.success, JobState.error] for f in fs):
+        storage_handler = _storage_handler(fs)
+
     if return_when == ALL_COMPLETED:
         result_count = 0
         while result_count < N:
 
             fs_dones, fs_notdones = _wait(fs, RETURN_EARLY_N,
                                           MAX_DIRECT_QUERY_N,
-                                          THREADPOOL_SIZE)
+                                          THREADPOOL_SIZE,
+                                          storage_handler=storage_handler,
+                                          fetch_results=fetch_results)
             result_count = len(fs_dones)
 
             if result_count == N:
@@ -83,7 +107,9 @@ def wait(fs, return_when=ALL_COMPLETED, THREADPOOL_SIZE=64,
         while True:
             fs_dones, fs_notdones = _wait(fs, RETURN_EARLY_N,
                                           MAX_DIRECT_QUERY_N,
-                                          THREADPOOL_SIZE)
+                                          THREADPOOL_SIZE,
+                                          storage_handler=storage_handler,
+                                          fetch_results=fetch_results)
 
             if len(fs_dones) != 0:
                 return fs_dones, fs_notdones
@@ -93,97 +119,229 @@ def wait(fs, return_when=ALL_COMPLETED, THREADPOOL_SIZE=64,
     elif return_when == ALWAYS:
         return _wait(fs, RETURN_EARLY_N,
                      MAX_DIRECT_QUERY_N,
-                     THREADPOOL_SIZE)
+                     THREADPOOL_SIZE,
+                     storage_handler=storage_handler,
+                     fetch_results=fetch_results)
     else:
         raise ValueError()
 
-def _wait(fs, return_early_n, max_direct_query_n,
-          random_query=False, THREADPOOL_SIZE=16):
+def as_completed(fs, THREADPOOL_SIZE=64, WAIT_DUR_SEC=5):
     """
-    internal function that performs the majority of the WAIT task
-    work.
+    Iterate over the Future instances `fs`, yielding each one once as soon
+    as it has completed and its output has been fetched, so `f.result()`
+    returns right away. Outputs are fetched in the background while we keep
+    checking on the others, and each check only scans the status objects
+    that are new since the previous one.
 
-    For the list of futures fn, we will check at a minimum `max_direct_query_n`
-    futures at least once. Internally we :
-    1. use list() to quickly get a list of which ones are done (but
-    list can be behind due to eventual consistency issues)
-    2. then individually call get_status on at most `max_direct_query_n` returning
-       early if we have found at least `return_early_n`
+    :param fs: A list of futures.
+    :param THREADPOOL_SIZE: Number of status queries to run at once. Default 64
+    :param WAIT_DUR_SEC: Time interval between each check, for callsets that
+        don't get completion notifications. Default 5
+    :return: generator of futures, in completion order.
 
-    This can mitigate the stragglers.
+    Usage
+      >>> futures = pwex.map(foo, data)
+      >>> for f in as_completed(futures):
+      ...     print(f.result())
 
-    random_query decides whether we get the fs in the order they are presented
-    or in a random order.
     """
+    MAX_DIRECT_QUERY_N = 16
+    RETURN_EARLY_N = 16
 
+    pending = []
+    for f in fs:
+        if f._state in [JobState.success, JobState.error]:
+            yield f
+        else:
+            pending.append(f)
+    if len(pending) == 0:
+        return
 
-    # get all the futures that are not yet done
-    not_done_futures = [f for f in fs if f._state not in [JobState.success,
-                                                          JobState.error]]
-    if len(not_done_futures) == 0:
-        return fs, []
-
+    storage_handler = _storage_handler(pending)
+    pool = wrenutil.get_io_pool()
+    # completions, and futures whose output was fetched, come in on `events`
+    events = Queue()
 
-    storage_config = wrenconfig.extract_storage_config(wrenconfig.default())
-    storage_handler = storage.Storage(storage_config)
+    def get_result(f):
+        try:
+            f.result(throw_except=False, storage_handler=storage_handler)
+        except Exception as e: # pylint: disable=broad-except
+            # don't lose the future, f.result() will raise again
+            logger.warning("error fetching result of {} {}: {}".format(
+                f.callset_id, f.call_id, e))
+        finally:
+            events.put(f)
+
+    # subscribe first, so no completion is missed in between
+    subscription = completion.Subscription(events)
+    try:
+        # futures whose completions we are told about, by invocation
+        notified_pending = {}
+        polled_pending = []
+        dones = []
+        for f in pending:
+            if completion.done(f):
+                dones.append(f)
+            elif completion.notified(f):
+                notified_pending.setdefault((f.callset_id, f.invoke_call_id), []).append(f)
+            else:
+                polled_pending.append(f)
 
-    ### Callset optimization via object store convenience functions:
-    # check if the not-done ones have the same callset_id
-    present_callsets = set([f.callset_id for f in not_done_futures])
-    if len(present_callsets) > 1:
-        raise NotImplementedError()
+        in_flight = 0
+        last_poll = None
+        while True:
+            for f in dones:
+                pool.apply_async(get_result, (f,))
+            in_flight += len(dones)
+            dones = []
+            if len(notified_pending) == 0 and len(polled_pending) == 0 and in_flight == 0:
+                return
+
+            timeout = None
+            if len(notified_pending) > 0 or len(polled_pending) > 0:
+                # storage is only polled for callsets without notifications,
+                # or in case a notification got lost
+                poll_interval = WAIT_DUR_SEC if len(polled_pending) > 0 else NOTIFIED_POLL_SEC
+                if last_poll is None or time.time() - last_poll >= poll_interval:
+                    last_poll = time.time()
+                    pending = polled_pending + [f for key_fs in notified_pending.values()
+                                                for f in key_fs]
+                    done_call_ids = _find_done_call_ids(pending, RETURN_EARLY_N,
+                                                        MAX_DIRECT_QUERY_N, False,
+                                                        THREADPOOL_SIZE, storage_handler)
+                    dones = [f for f in polled_pending
+                             if (f.callset_id, f.invoke_call_id) in done_call_ids]
+                    polled_pending = [f for f in polled_pending
+                                      if (f.callset_id, f.invoke_call_id) not in done_call_ids]
+                    for key in done_call_ids:
+                        dones.extend(notified_pending.pop(key, []))
+                    completion.record(done_call_ids)
+                    continue
+                timeout = last_poll + poll_interval - time.time()
+
+            try:
+                # Queue.get(timeout=None) can't be interrupted on python 2
+                event = events.get(timeout=timeout if timeout is not None else 1e9)
+            except Empty:
+                continue
+            if isinstance(event, list):
+                # only look up the futures that completed
+                for key in event:
+                    dones.extend(notified_pending.pop(key, []))
+            else:
+                in_flight -= 1
+                yield event
+    finally:
+        subscription.close()
 
-    # get the list of all objects in this callset
-    callset_id = present_callsets.pop() # FIXME assume only one
+def _storage_handler(fs):
+    # all the futures are expected to share the same storage
+    return storage.get_storage_for_path(fs[0].storage_path)
 
-    # note this returns everything done, so we have to figure out
-    # the intersection of those that are done
-    callids_done_in_callset = set(storage_handler.get_callset_status(callset_id))
+def _wait_notified(fs, return_when, max_direct_query_n, THREADPOOL_SIZE,
+                   fetch_results=True):
+    """
+    `wait` for futures whose callsets get completion notifications
+    (see pywren/completion.py). Blocks on the notifications instead of
+    listing the callsets, only checking storage directly if nothing
+    has been heard for `NOTIFIED_POLL_SEC`.
+    """
+    if return_when not in [ALL_COMPLETED, ANY_COMPLETED, ALWAYS]:
+        raise ValueError()
 
-    not_done_call_ids = set([f.call_id for f in not_done_futures])
+    storage_handler = None
+    # subscribe first, so no completion is missed in between
+    with completion.Subscription() as subscription:
+        # the futures not known to be done, by invocation
+        pending = {}
+        done_n = 0
+        for f in fs:
+            if f._state in [JobState.success, JobState.error] or completion.done(f):
+                done_n += 1
+            else:
+                pending.setdefault((f.callset_id, f.invoke_call_id), []).append(f)
+
+        while len(pending) > 0 and return_when != ALWAYS:
+            if return_when == ANY_COMPLETED and done_n > 0:
+                break
+
+            completions = subscription.get(NOTIFIED_POLL_SEC)
+            if len(completions) == 0:
+                # in case a notification got lost
+                if storage_handler is None:
+                    storage_handler = _storage_handler(fs)
+                pending_fs = [f for key_fs in pending.values() for f in key_fs]
+                polled_dones, _ = _wait(pending_fs, len(pending_fs), max_direct_query_n,
+                                        THREADPOOL_SIZE=THREADPOOL_SIZE,
+                                        storage_handler=storage_handler,
+                                        fetch_results=False)
+                completions = set((f.callset_id, f.invoke_call_id) for f in polled_dones)
+                completion.record(completions)
+            # only look up the futures that completed
+            for key in completions:
+                done_n += len(pending.pop(key, []))
+
+    pending_ids = set(id(f) for key_fs in pending.values() for f in key_fs)
+    fs_dones = []
+    fs_notdones = []
+    for f in fs:
+        if id(f) in pending_ids:
+            fs_notdones.append(f)
+        else:
+            fs_dones.append(f)
 
-    done_call_ids = not_done_call_ids.intersection(callids_done_in_callset)
-    not_done_call_ids = not_done_call_ids - done_call_ids
+    f_to_wait_on = [f for f in fs_dones if f._state not in [JobState.success,
+                                                             JobState.error]]
+    if fetch_results and len(f_to_wait_on) > 0:
+        if storage_handler is None:
+            storage_handler = _storage_handler(fs)
 
-    still_not_done_futures = [f for f in not_done_futures if (f.call_id in not_done_call_ids)]
+        def get_result(f):
+            f.result(throw_except=False, storage_handler=storage_handler)
 
-    def fetch_future_status(f):
-        return storage_handler.get_call_status(f.callset_id, f.call_id)
+        wrenutil.get_io_pool().map(get_result, f_to_wait_on)
 
+    return fs_dones, fs_notdones
 
-    pool = ThreadPool(THREADPOOL_SIZE)
+def _wait(fs, return_early_n, max_direct_query_n,
+          random_query=False, THREADPOOL_SIZE=16, storage_handler=None,
+          fetch_results=True):
+    """
+    internal function that performs the majority of the WAIT task
+    work.
 
-    # now try up to max_direct_query_n direct status queries, quitting once
-    # we have return_n done.
-    query_count = 0
-    max_queries = min(max_direct_query_n, len(still_not_done_futures))
+    For the list of futures fn, we will check at a minimum `max_direct_query_n`
+    futures of each callset at least once. Internally we :
+    1. use list() to quickly get a list of which ones are done (but
+    list can be behind due to eventual consistency issues), listing all
+    the callsets concurrently
+    2. then individually call get_status on at most `max_direct_query_n` per
+       callset returning early if we have found at least `return_early_n`
 
-    if random_query:
-        random.shuffle(still_not_done_futures)
+    This can mitigate the stragglers.
 
-    while query_count < max_queries:
+    random_query decides whether we get the fs in the order they are presented
+    or in a random order.
 
-        if len(done_call_ids) >= return_early_n:
-            break
-        num_to_query_at_once = THREADPOOL_SIZE
-        fs_to_query = still_not_done_futures[query_count:query_count + num_to_query_at_once]
+    storage_handler is reused across calls by `wait`, so that it only has
+    to scan the status objects that are new since the previous call.
+    """
 
-        fs_statuses = pool.map(fetch_future_status, fs_to_query)
 
-        callids_found = [fs_to_query[i].call_id for i in range(len(fs_to_query))
-                         if (fs_statuses[i] is not None)]
-        done_call_ids = done_call_ids.union(set(callids_found))
+    # get all the futures that are not yet done
+    not_done_futures = [f for f in fs if f._state not in [JobState.success,
+                                                          JobState.error]]
+    if len(not_done_futures) == 0:
+        return fs, []
 
-        # # update done call_ids
-        # callids_done.update(callids_found)
 
-        # # break if not all N tasks completed
-        # if (len(callids_found) < len(fs_samples)):
-        #     break
-        # # calculate new still_not_done_futures
-        # still_not_done_futures = [f for f in not_done_futures if (f.call_id not in callids_done)]
-        query_count += len(fs_to_query)
+    if storage_handler is None:
+        storage_handler = _storage_handler(fs)
 
+    done_call_ids = _find_done_call_ids(not_done_futures, return_early_n,
+                                        max_direct_query_n, random_query,
+                                        THREADPOOL_SIZE, storage_handler)
+    pool = wrenutil.get_io_pool()
 
     # now we walk through all the original queries and get
     # the ones that are actually done.
@@ -196,7 +354,7 @@ def _wait(fs, return_early_n, max_direct_query_n,
             # done, don't need to do anything
             fs_dones.append(f)
         else:
-            if f.call_id in done_call_ids:
+            if (f.callset_id, f.invoke_call_id) in done_call_ids:
                 f_to_wait_on.append(f)
                 fs_dones.append(f)
             else:
@@ -204,9 +362,83 @@ def _wait(fs, return_early_n, max_direct_query_n,
     def get_result(f):
         f.result(throw_except=False, storage_handler=storage_handler)
 
-    pool.map(get_result, f_to_wait_on)
-
-    pool.close()
-    pool.join()
+    if fetch_results:
+        pool.map(get_result, f_to_wait_on)
 
     return fs_dones, fs_notdones
+
+def _find_done_call_ids(not_done_futures, return_early_n, max_direct_query_n,
+                        random_query, THREADPOOL_SIZE, storage_handler):
+    """
+    Steps 1. and 2. of `_wait`: find which of the invocations of
+    `not_done_futures` are done.
+
+    :return: set of `(callset_id, invoke_call_id)` of the done invocations
+    """
+    ### Callset optimization via object store convenience functions:
+    # group the not-done futures by callset, batched calls report their
+    # status under the first call of the batch
+    not_done_call_ids = {}
+    for f in not_done_futures:
+        not_done_call_ids.setdefault(f.callset_id, set()).add(f.invoke_call_id)
+
+    pool = wrenutil.get_io_pool()
+
+    # list all the callsets at once. note this returns everything done,
+    # so we have to figure out the intersection of those that are done
+    def fetch_callset_status(callset_id):
+        return storage_handler.get_callset_status(callset_id,
+                                                  not_done_call_ids[callset_id])
+
+    callset_ids = list(not_done_call_ids.keys())
+    callset_statuses = pool.map(fetch_callset_status, callset_ids)
+
+    # (callset_id, call_id) of every invocation known to be done
+    done_call_ids = set()
+    for callset_id, callids_done_in_callset in zip(callset_ids, callset_statuses):
+        for call_id in not_done_call_ids[callset_id].intersection(callids_done_in_callset):
+            done_call_ids.add((callset_id, call_id))
+
+    # one direct query per invocation, even if it ran a batch of calls,
+    # and at most max_direct_query_n per callset
+    still_not_done_futures = {}
+    queried_call_ids = set()
+    for f in not_done_futures:
+        call_key = (f.callset_id, f.invoke_call_id)
+        if call_key in done_call_ids or call_key in queried_call_ids:
+            continue
+        callset_fs = still_not_done_futures.setdefault(f.callset_id, [])
+        if len(callset_fs) < max_direct_query_n:
+            callset_fs.append(f)
+            queried_call_ids.add(call_key)
+
+    def fetch_future_status(f):
+        return storage_handler.get_call_status(f.callset_id, f.invoke_call_id,
+                                               f.combined_output)
+
+    # now try the direct status queries of all callsets together, quitting once
+    # we have return_n done.
+    fs_to_query_all = [f for callset_fs in still_not_done_futures.values()
+                       for f in callset_fs]
+
+    if random_query:
+        random.shuffle(fs_to_query_all)
+
+    query_count = 0
+    while query_count < len(fs_to_query_all):
+
+        if len(done_call_ids) >= return_early_n:
+            break
+        num_to_query_at_once = THREADPOOL_SIZE
+        fs_to_query = fs_to_query_all[query_count:query_count + num_to_query_at_once]
+
+        fs_statuses = pool.map(fetch_future_status, fs_to_query)
+
+        callids_found = [(fs_to_query[i].callset_id, fs_to_query[i].invoke_call_id)
+                         for i in range(len(fs_to_query))
+                         if (fs_statuses[i] is not None)]
+        done_call_ids = done_call_ids.union(set(callids_found))
+
+        query_count += len(fs_to_query)
+
+    return done_call_ids
@@ -23,7 +23,9 @@ import pywren.invokers as invokers
 import pywren.queues as queues
 import pywren.wrenconfig as wrenconfig
 from pywren.executor import Executor
-from pywren.wait import wait, ALL_COMPLETED, ANY_COMPLETED # pylint: disable=unused-import
+from pywren.future import fetch_results
+from pywren.wait import (wait, as_completed, # pylint: disable=unused-import
+                         ALL_COMPLETED, ANY_COMPLETED)
 
 logger = logging.getLogger(__name__)
 
@@ -50,6 +52,8 @@ def default_executor(**kwargs):
         return remote_executor(**kwargs)
     elif executor_str == 'dummy':
         return dummy_executor(**kwargs)
+    elif executor_str == 'local':
+        return local_executor(**kwargs)
     return lambda_executor(**kwargs)
 
 
@@ -72,6 +76,33 @@ def dummy_executor(config=None, job_max_runtime=300):
     return Executor(invoker, config, job_max_runtime)
 
 
+def local_executor(config=None, job_max_runtime=3600, num_workers=None,
+                   run_dir="/tmp/pywren_local"):
+    """
+    Initialize and return an executor that runs jobs in a pool of
+    worker processes on this machine.
+
+    :param config: Settings passed in here will override those in `pywren_config`. Default None.
+    :param job_max_runtime: Max time per job. Default 3600
+    :param num_workers: Number of worker processes. Default one per core.
+    :param run_dir: Directory holding the per-worker run dirs. Default /tmp/pywren_local
+    :return `executor` object.
+
+    Usage
+      >>> import pywren
+      >>> with pywren.local_executor() as pwex:
+      ...     futures = pwex.map(foo, data)
+      ...     results = pywren.get_all_results(futures)
+
+    The worker processes are stopped by `pwex.shutdown()`, or on leaving the `with` block.
+    """
+    if config is None:
+        config = wrenconfig.default()
+
+    invoker = invokers.LocalInvoker(num_workers, run_dir)
+    return Executor(invoker, config, job_max_runtime)
+
+
 def remote_executor(config=None, job_max_runtime=3600):
     if config is None:
         config = wrenconfig.default()
@@ -88,8 +119,8 @@ standalone_executor = remote_executor
 def get_all_results(fs):
     """
     Take in a list of futures and block until they are completed.
-    call result on each one individually, and return those
-    results.
+    Fetch all their results at once (see `fetch_results`), and return
+    those results.
 
     :param fs: a list of futures.
     :return: A list of the results of each futures
@@ -100,5 +131,4 @@ def get_all_results(fs):
       >>> futures = pwex.map(foo, data)
       >>> results = get_all_results(futures)
     """
-    wait(fs, return_when=ALL_COMPLETED)
-    return [f.result() for f in fs]
+    return fetch_results(fs)
@@ -48,7 +48,7 @@ def load(config_filename):
     import yaml
     res = yaml.safe_load(open(config_filename, 'r'))
     # sanity check
-    if res['s3']['bucket'] == 'BUCKET_NAME':
+    if 's3' in res and res['s3']['bucket'] == 'BUCKET_NAME':
         raise Exception(
             "{} has bucket name as {} -- make sure you change the default bucket".format(
                 config_filename, res['s3']['bucket']))
@@ -91,18 +91,27 @@ def patch_storage_config(config_data):
     return patched_config
 
 
+# (config filename, mtime) -> parsed config, see default()
+_default_config_cache = {}
+
 def default():
     """
     First checks .pywren_config
     then checks PYWREN_CONFIG_FILE environment variable
     then ~/.pywren_config
+
+    The file is only parsed again if it has changed. Every call returns
+    a fresh copy, so callers are free to modify it.
     """
     config_filename = get_default_config_filename()
     if config_filename is None:
         raise ValueError("could not find configuration file")
 
-    config_data = load(config_filename)
-    return config_data
+    cache_key = (config_filename, os.path.getmtime(config_filename))
+    if cache_key not in _default_config_cache:
+        _default_config_cache.clear()
+        _default_config_cache[cache_key] = load(config_filename)
+    return copy.deepcopy(_default_config_cache[cache_key])
 
 
 def extract_storage_config(config):
@@ -113,6 +122,9 @@ def extract_storage_config(config):
         storage_config['backend_config'] = {}
         storage_config['backend_config']['bucket'] = config['s3']['bucket']
         storage_config['backend_config']['region'] = config['account']['aws_region']
+    elif storage_config['storage_backend'] == 'local':
+        storage_path = os.path.abspath(os.path.expanduser(config['local']['storage_path']))
+        storage_config['backend_config'] = {'storage_path' : storage_path}
     return storage_config
 
 basic_role_policy = {
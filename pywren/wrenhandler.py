@@ -27,7 +27,6 @@ import tarfile
 import time
 import traceback
 from threading import Thread
-import io
 
 import boto3
 import botocore
@@ -44,27 +43,58 @@ else:
 
 # these templates will get filled in by runtime ETAG
 PYTHON_MODULE_PATH = "/tmp/pymodules_{0}"
+# unpacked module data, shared by the jobs on this host
+PYTHON_MODULE_CACHE_DIR = "/tmp/pymodules_cache"
 CONDA_RUNTIME_DIR = "/tmp/condaruntime_{0}"
 RUNTIME_LOC = "/tmp/runtimes"
 
 # these templates will get fillled by PID
 JOBRUNNER_CONFIG_FILENAME = "/tmp/jobrunner_{0}.config.json"
 JOBRUNNER_STATS_FILENAME = "/tmp/jobrunner_{0}.stats.txt"
+JOBRUNNER_OUTPUT_FILENAME = "/tmp/jobrunner_{0}.output.pickle"
 RUNTIME_DOWNLOAD_LOCK = "/tmp/runtime_download_lock"
 
+# the runtime is streamed into tar with parallel ranged GETs of this size
+RUNTIME_DOWNLOAD_CHUNK_SIZE = 4 * 1024 * 1024
+RUNTIME_DOWNLOAD_PARALLELISM = 8
+
+# the files of a lazy runtime that weren't extracted, kept in its runtime
+# dir for the jobrunner, which extracts them when they are imported
+LAZY_RUNTIME_INDEX_FILENAME = "lazy_index.json"
+LAZY_RUNTIME_URL_EXPIRES_SEC = 3600
+
+# (bucket, key) -> (ETag, lookup time) of runtimes, for invocations by
+# clients that don't pass the ETag
+RUNTIME_ETAG_CACHE_TTL_SEC = 60
+_runtime_etag_cache = {}
+
 logger = logging.getLogger(__name__)
 
 PROCESS_STDOUT_SLEEP_SECS = 2
 
-def get_key_size(s3client, bucket, key):
-    try:
-        a = s3client.head_object(Bucket=bucket, Key=key)
-        return a['ContentLength']
-    except botocore.exceptions.ClientError as e:
-        if e.response['Error']['Code'] == "404":
-            return None
-        else:
-            raise e
+def put_object(storage_config, key, body):
+    """
+    Put an object into the storage backend described by `storage_config`
+    """
+    if storage_config['storage_backend'] == 'local':
+        storage_path = storage_config['backend_config']['storage_path']
+        wrenutil.atomic_write(os.path.join(storage_path, key), body)
+    else:
+        # creating new client in case the client has not been created
+        boto3.client("s3").put_object(Bucket=storage_config['backend_config']['bucket'],
+                                      Key=key, Body=body)
+
+def publish_completion(channel_config, callset_id, call_id):
+    """
+    Tell the client that this call's status object has been written,
+    see pywren/completion.py
+    """
+    if channel_config['type'] != 'sqs':
+        raise NotImplementedError("Unknown completion channel {}".format(channel_config['type']))
+    sqs_client = boto3.client("sqs", region_name=channel_config['region_name'])
+    sqs_client.send_message(QueueUrl=channel_config['queue_url'],
+                            MessageBody=json.dumps({'callset_id' : callset_id,
+                                                    'call_id' : call_id}))
 
 def free_disk_space(dirname):
     """
@@ -73,27 +103,27 @@ def free_disk_space(dirname):
     s = os.statvfs(dirname)
     return s.f_bsize * s.f_bavail
 
-def download_runtime_if_necessary(s3_client, runtime_s3_bucket, runtime_s3_key,
-                                  delete_old_runtimes=False):
+def get_runtime_etag(s3_client, runtime_s3_bucket, runtime_s3_key):
     """
-    Download the runtime if necessary
-
-    return True if cached, False if not (download occured)
-
+    Return the ETag of the runtime, looking it up at most once
+    every RUNTIME_ETAG_CACHE_TTL_SEC
     """
-
-    lock = open(RUNTIME_DOWNLOAD_LOCK, "a")
-    fcntl.lockf(lock, fcntl.LOCK_EX)
-    # get runtime etag
+    now = time.time()
+    cached = _runtime_etag_cache.get((runtime_s3_bucket, runtime_s3_key))
+    if cached is not None and now - cached[1] < RUNTIME_ETAG_CACHE_TTL_SEC:
+        return cached[0]
     runtime_meta = s3_client.head_object(Bucket=runtime_s3_bucket,
                                          Key=runtime_s3_key)
-    # etags have strings (double quotes) on each end, so we strip those
-    ETag = str(runtime_meta['ETag'])[1:-1]
+    _runtime_etag_cache[(runtime_s3_bucket, runtime_s3_key)] = (runtime_meta['ETag'], now)
+    return runtime_meta['ETag']
+
+def runtime_linked(ETag):
+    """
+    Return True if the runtime with (unquoted) ETag is extracted and linked
+    into place, which is the last step of its download
+    """
     conda_runtime_dir = CONDA_RUNTIME_DIR.format(ETag)
-    logger.debug("The etag is ={}".format(ETag))
-    runtime_etag_dir = os.path.join(RUNTIME_LOC, ETag)
-    logger.debug("Runtime etag dir={}".format(runtime_etag_dir))
-    expected_target = os.path.join(runtime_etag_dir, 'condaruntime')
+    expected_target = os.path.join(RUNTIME_LOC, ETag, 'condaruntime')
     logger.debug("Expected target={}".format(expected_target))
     # check if dir is linked to correct runtime
     if os.path.exists(RUNTIME_LOC):
@@ -103,9 +133,65 @@ def download_runtime_if_necessary(s3_client, runtime_s3_bucket, runtime_s3_key,
                     conda_runtime_dir))
 
             existing_link = os.readlink(conda_runtime_dir)
-            if existing_link == expected_target:
-                logger.debug("found existing {}, not re-downloading".format(ETag))
-                return True
+            return existing_link == expected_target
+    return False
+
+def download_runtime_if_necessary(s3_client, runtime_s3_bucket, runtime_s3_key, runtime_etag,
+                                  delete_old_runtimes=False, archive_format=None):
+    """
+    Download the runtime if necessary
+
+    runtime_etag is the ETag of the runtime, as passed by the client
+    or from get_runtime_etag
+
+    archive_format is None for a .tar.gz runtime, or
+    wrenutil.CHUNKED_ARCHIVE_FORMAT for a chunked one
+
+    return True if cached, False if not (download occured)
+
+    """
+    # etags have strings (double quotes) on each end, so we strip those
+    ETag = str(runtime_etag)[1:-1]
+    logger.debug("The etag is ={}".format(ETag))
+    # warm containers don't need the lock
+    if runtime_linked(ETag):
+        logger.debug("found existing {}, not re-downloading".format(ETag))
+        return True
+
+    lock = open(RUNTIME_DOWNLOAD_LOCK, "a")
+    fcntl.lockf(lock, fcntl.LOCK_EX)
+    try:
+        # another process may have downloaded it while we waited for the lock
+        if runtime_linked(ETag):
+            logger.debug("found existing {}, not re-downloading".format(ETag))
+            return True
+        download_runtime(s3_client, runtime_s3_bucket, runtime_s3_key, runtime_etag,
+                         delete_old_runtimes, archive_format)
+    finally:
+        fcntl.lockf(lock, fcntl.LOCK_UN)
+        lock.close()
+    return False
+
+def download_runtime(s3_client, runtime_s3_bucket, runtime_s3_key, runtime_etag,
+                     delete_old_runtimes, archive_format):
+    """
+    Download and extract the runtime, and link it into place
+    """
+    try:
+        runtime_meta = s3_client.head_object(Bucket=runtime_s3_bucket,
+                                             Key=runtime_s3_key,
+                                             IfMatch=runtime_etag)
+    except botocore.exceptions.ClientError as e:
+        if e.response['Error']['Code'] in ["412", "PreconditionFailed"]:
+            _runtime_etag_cache.pop((runtime_s3_bucket, runtime_s3_key), None)
+            raise Exception("RUNTIME_CHANGED",
+                            "Runtime {} changed since it was looked up".format(runtime_s3_key))
+        raise e
+    ETag = str(runtime_etag)[1:-1]
+    conda_runtime_dir = CONDA_RUNTIME_DIR.format(ETag)
+    runtime_etag_dir = os.path.join(RUNTIME_LOC, ETag)
+    logger.debug("Runtime etag dir={}".format(runtime_etag_dir))
+    expected_target = os.path.join(runtime_etag_dir, 'condaruntime')
 
     logger.debug("{} not cached, downloading".format(ETag))
     # didn't cache, so we start over
@@ -117,15 +203,39 @@ def download_runtime_if_necessary(s3_client, runtime_s3_bucket, runtime_s3_key,
 
     os.makedirs(runtime_etag_dir)
 
-    res = s3_client.get_object(Bucket=runtime_s3_bucket,
-                               Key=runtime_s3_key)
-    res_buffer = res['Body'].read()
+    def get_range(first, last):
+        # the ranges must all come from the runtime version we just looked at
+        res = s3_client.get_object(Bucket=runtime_s3_bucket, Key=runtime_s3_key,
+                                   Range="bytes={}-{}".format(first, last),
+                                   IfMatch=runtime_meta['ETag'])
+        return res['Body'].read()
+
+    # extract while downloading, holding only the chunks fetched ahead in memory
+    runtime_reader = None
+    lazy_index = None
     try:
-        res_buffer_io = io.BytesIO(res_buffer)
-        condatar = tarfile.open(mode="r:gz", fileobj=res_buffer_io)
+        if archive_format == wrenutil.CHUNKED_ARCHIVE_FORMAT:
+            # chunks are decompressed in parallel, and tar reads the plain stream
+            index = wrenutil.read_chunked_archive_index(get_range,
+                                                        runtime_meta['ContentLength'])
+            if 'files' in index:
+                # only the tar of a lazy runtime is extracted up front
+                lazy_index = index
+                index = dict(index, chunks=index['chunks'][:index['eager_chunks']])
+            runtime_reader = wrenutil.chunked_archive_reader(get_range, index,
+                                                             RUNTIME_DOWNLOAD_PARALLELISM)
+            tar_mode = "r|"
+        else:
+            runtime_reader = wrenutil.ParallelRangeReader(get_range,
+                                                          runtime_meta['ContentLength'],
+                                                          RUNTIME_DOWNLOAD_CHUNK_SIZE,
+                                                          RUNTIME_DOWNLOAD_PARALLELISM)
+            tar_mode = "r|gz"
+        condatar = tarfile.open(mode=tar_mode, fileobj=runtime_reader)
         condatar.extractall(runtime_etag_dir)
-        del res_buffer_io # attempt to clear this proactively
-        del res_buffer
+        if lazy_index is not None:
+            with open(os.path.join(runtime_etag_dir, LAZY_RUNTIME_INDEX_FILENAME), 'w') as fid:
+                json.dump(lazy_index, fid)
     except (OSError, IOError) as e:
         # no difference, see https://stackoverflow.com/q/29347790/1073963
         # do the cleanup
@@ -143,12 +253,12 @@ def download_runtime_if_necessary(s3_client, runtime_s3_bucket, runtime_s3_key,
     except:
         shutil.rmtree(runtime_etag_dir, True)
         raise
+    finally:
+        if runtime_reader is not None:
+            runtime_reader.close()
 
     # final operation
     os.symlink(expected_target, conda_runtime_dir)
-    fcntl.lockf(lock, fcntl.LOCK_UN)
-    lock.close()
-    return False
 
 
 def b64str_to_bytes(str_data):
@@ -182,7 +292,7 @@ def get_server_info():
 
     return server_info
 
-def generic_handler(event, context_dict, custom_handler_env=None):
+def generic_handler(event, context_dict, custom_handler_env=None, run_dir=None):
     """
     event is from the invoker, and contains job information
 
@@ -191,16 +301,26 @@ def generic_handler(event, context_dict, custom_handler_env=None):
 
     custom_handler_env are environment variables we should set
     based on the platform we are on.
+
+    run_dir is the directory holding jobrunner.py, in which the
+    job is run. Defaults to the current working directory. Jobs given
+    a run_dir (e.g. by a local worker) keep their module zips in it,
+    so they never evict the zips of jobs running in other workers.
     """
     pid = os.getpid()
 
     response_status = {'exception': None}
     try:
-        if event['storage_config']['storage_backend'] != 's3':
+        storage_backend = event['storage_config']['storage_backend']
+        if storage_backend not in ['s3', 'local']:
             raise NotImplementedError(("Using {} as storage backend is not supported " +
-                                       "yet.").format(event['storage_config']['storage_backend']))
-        s3_client = boto3.client("s3")
-        s3_bucket = event['storage_config']['backend_config']['bucket']
+                                       "yet.").format(storage_backend))
+        s3_bucket = None
+        local_storage_path = None
+        if storage_backend == 's3':
+            s3_bucket = event['storage_config']['backend_config']['bucket']
+        else:
+            local_storage_path = event['storage_config']['backend_config']['storage_path']
 
         logger.info("invocation started")
 
@@ -209,6 +329,8 @@ def generic_handler(event, context_dict, custom_handler_env=None):
         func_key = event['func_key']
         data_key = event['data_key']
         data_byte_range = event['data_byte_range']
+        # set when several map items are packed into this invocation
+        data_byte_ranges = event.get('data_byte_ranges')
         output_key = event['output_key']
 
         if version.__version__ != event['pywren_version']:
@@ -218,15 +340,22 @@ def generic_handler(event, context_dict, custom_handler_env=None):
         start_time = time.time()
         response_status['start_time'] = start_time
 
-        runtime_s3_bucket = event['runtime']['s3_bucket']
-        runtime_s3_key = event['runtime']['s3_key']
-        if event.get('runtime_url'):
-            # NOTE(shivaram): Right now we only support S3 urls.
-            runtime_s3_bucket_used, runtime_s3_key_used = wrenutil.split_s3_url(
-                event['runtime_url'])
-        else:
-            runtime_s3_bucket_used = runtime_s3_bucket
-            runtime_s3_key_used = runtime_s3_key
+        # a local runtime is the python interpreter running this handler
+        local_runtime = event['runtime'].get('runtime_storage') == 'local'
+        if not local_runtime:
+            runtime_s3_bucket = event['runtime']['s3_bucket']
+            runtime_s3_key = event['runtime']['s3_key']
+            if event.get('runtime_url'):
+                # NOTE(shivaram): Right now we only support S3 urls.
+                runtime_s3_bucket_used, runtime_s3_key_used = wrenutil.split_s3_url(
+                    event['runtime_url'])
+            else:
+                runtime_s3_bucket_used = runtime_s3_bucket
+                runtime_s3_key_used = runtime_s3_key
+
+        s3_client = None
+        if storage_backend == 's3' or not local_runtime:
+            s3_client = boto3.client("s3")
 
         job_max_runtime = event.get("job_max_runtime", 290) # default for lambda
 
@@ -235,69 +364,112 @@ def generic_handler(event, context_dict, custom_handler_env=None):
         response_status['output_key'] = output_key
         response_status['status_key'] = status_key
 
-        data_key_size = get_key_size(s3_client, s3_bucket, data_key)
-        #logger.info("bucket=", s3_bucket, "key=", data_key,  "status: ", data_key_size, "bytes" )
-        while data_key_size is None:
-            logger.warning("WARNING COULD NOT GET FIRST KEY")
-
-            data_key_size = get_key_size(s3_client, s3_bucket, data_key)
-        if not event['use_cached_runtime']:
+        if not event['use_cached_runtime'] and not local_runtime:
             subprocess.check_output("rm -Rf {}/*".format(RUNTIME_LOC), shell=True)
 
 
         free_disk_bytes = free_disk_space("/tmp")
         response_status['free_disk_bytes'] = free_disk_bytes
 
-        response_status['runtime_s3_key_used'] = runtime_s3_key_used
-        response_status['runtime_s3_bucket_used'] = runtime_s3_bucket_used
-        if (custom_handler_env != None):
-            delete_old_runtimes = custom_handler_env.get('delete_old_runtimes', False)
+        if local_runtime:
+            runtime_cached = True
         else:
-            delete_old_runtimes = False
-
-
-        runtime_cached = download_runtime_if_necessary(s3_client, runtime_s3_bucket_used,
-                                                       runtime_s3_key_used, delete_old_runtimes)
+            response_status['runtime_s3_key_used'] = runtime_s3_key_used
+            response_status['runtime_s3_bucket_used'] = runtime_s3_bucket_used
+            if (custom_handler_env != None):
+                delete_old_runtimes = custom_handler_env.get('delete_old_runtimes', False)
+            else:
+                delete_old_runtimes = False
+
+            runtime_archive_format = event.get('runtime_archive_format')
+            response_status['runtime_archive_format'] = runtime_archive_format
+            runtime_setup_start = time.time()
+            # the client looks the runtime up once, rather than every invocation
+            runtime_etag = event.get('runtime_etag')
+            if runtime_etag is None:
+                runtime_etag = get_runtime_etag(s3_client, runtime_s3_bucket_used,
+                                                runtime_s3_key_used)
+            runtime_cached = download_runtime_if_necessary(s3_client, runtime_s3_bucket_used,
+                                                           runtime_s3_key_used,
+                                                           runtime_etag,
+                                                           delete_old_runtimes,
+                                                           runtime_archive_format)
+            response_status['runtime_setup_time'] = time.time() - runtime_setup_start
         logger.info("Runtime ready, cached={}".format(runtime_cached))
         response_status['runtime_cached'] = runtime_cached
 
-        cwd = os.getcwd()
-        jobrunner_path = os.path.join(cwd, "jobrunner.py")
+        if run_dir is None:
+            run_dir = os.getcwd()
+            python_module_cache_dir = PYTHON_MODULE_CACHE_DIR
+        else:
+            python_module_cache_dir = os.path.join(run_dir, "pymodules_cache")
+        jobrunner_path = os.path.join(run_dir, "jobrunner.py")
 
         extra_env = event.get('extra_env', {})
-        extra_env['PYTHONPATH'] = "{}".format(os.getcwd())
+        extra_env['PYTHONPATH'] = "{}".format(run_dir)
 
         call_id = event['call_id']
         callset_id = event['callset_id']
         response_status['call_id'] = call_id
         response_status['callset_id'] = callset_id
-        runtime_meta = s3_client.head_object(Bucket=runtime_s3_bucket_used,
-                                             Key=runtime_s3_key_used)
-        ETag = str(runtime_meta['ETag'])[1:-1]
-        conda_runtime_dir = CONDA_RUNTIME_DIR.format(ETag)
-        conda_python_path = conda_runtime_dir + "/bin"
-        conda_python_runtime = os.path.join(conda_python_path, "python")
+        if 'batch_call_ids' in event:
+            response_status['batch_call_ids'] = event['batch_call_ids']
+        runtime_lazy = None
+        if local_runtime:
+            conda_python_runtime = sys.executable
+            conda_python_path = os.path.dirname(sys.executable)
+        else:
+            ETag = str(runtime_etag)[1:-1]
+            conda_runtime_dir = CONDA_RUNTIME_DIR.format(ETag)
+            conda_python_path = conda_runtime_dir + "/bin"
+            conda_python_runtime = os.path.join(conda_python_path, "python")
+
+            runtime_etag_dir = os.path.join(RUNTIME_LOC, ETag)
+            lazy_index_filename = os.path.join(runtime_etag_dir, LAZY_RUNTIME_INDEX_FILENAME)
+            if os.path.exists(lazy_index_filename):
+                # the jobrunner fetches the rest of the runtime without boto
+                lazy_runtime_url = s3_client.generate_presigned_url(
+                    'get_object', Params={'Bucket' : runtime_s3_bucket_used,
+                                          'Key' : runtime_s3_key_used},
+                    ExpiresIn=LAZY_RUNTIME_URL_EXPIRES_SEC)
+                runtime_lazy = {'runtime_dir' : runtime_etag_dir,
+                                'index_filename' : lazy_index_filename,
+                                'url' : lazy_runtime_url,
+                                'etag' : runtime_etag}
+        response_status['runtime_lazy'] = runtime_lazy is not None
 
         # pass a full json blob
         jobrunner_config_filename = JOBRUNNER_CONFIG_FILENAME.format(pid)
         jobrunner_stats_filename = JOBRUNNER_STATS_FILENAME.format(pid)
         python_module_path = PYTHON_MODULE_PATH.format(pid)
-
-        jobrunner_config = {'func_bucket' : s3_bucket,
+        # with a combined output, the jobrunner leaves its output to us
+        jobrunner_output_filename = None
+        if event.get('combined_output'):
+            jobrunner_output_filename = JOBRUNNER_OUTPUT_FILENAME.format(pid)
+
+        jobrunner_config = {'storage_backend' : storage_backend,
+                            'local_storage_path' : local_storage_path,
+                            'func_bucket' : s3_bucket,
                             'func_key' : func_key,
                             'data_bucket' : s3_bucket,
                             'data_key' : data_key,
                             'data_byte_range' : data_byte_range,
+                            'data_byte_ranges' : data_byte_ranges,
                             'python_module_path' : python_module_path,
+                            'python_module_cache_dir' : python_module_cache_dir,
                             'output_bucket' : s3_bucket,
                             'output_key' : output_key,
+                            'output_filename' : jobrunner_output_filename,
+                            'out_of_band_buffers' : event.get('out_of_band_buffers', False),
+                            'runtime_lazy' : runtime_lazy,
                             'stats_filename' : jobrunner_stats_filename}
 
         with open(jobrunner_config_filename, 'w') as jobrunner_fid:
             json.dump(jobrunner_config, jobrunner_fid)
 
-        if os.path.exists(jobrunner_stats_filename):
-            os.remove(jobrunner_stats_filename)
+        for filename in [jobrunner_stats_filename, jobrunner_output_filename]:
+            if filename is not None and os.path.exists(filename):
+                os.remove(filename)
 
         cmdstr = "{} {} {}".format(conda_python_runtime,
                                    jobrunner_path,
@@ -318,13 +490,15 @@ def generic_handler(event, context_dict, custom_handler_env=None):
         # This is copied from http://stackoverflow.com/a/17698359/4577954
         # reasons for setting process group: http://stackoverflow.com/a/4791612
         process = subprocess.Popen(cmdstr, shell=True, env=local_env, bufsize=1,
-                                   stdout=subprocess.PIPE, preexec_fn=os.setsid)
+                                   stdout=subprocess.PIPE, preexec_fn=os.setsid,
+                                   cwd=run_dir)
 
         logger.info("launched process")
         def consume_stdout(stdout, queue):
             with stdout:
                 for line in iter(stdout.readline, b''):
                     queue.put(line)
+            queue.put(None) # the process closed its stdout
 
         q = Queue()
 
@@ -333,13 +507,15 @@ def generic_handler(event, context_dict, custom_handler_env=None):
         t.start()
 
         stdout = b""
-        while t.isAlive():
+        while True:
             try:
-                line = q.get_nowait()
+                line = q.get(timeout=PROCESS_STDOUT_SLEEP_SECS)
+                if line is None:
+                    break
                 stdout += line
                 logger.info(line)
             except Empty:
-                time.sleep(PROCESS_STDOUT_SLEEP_SECS)
+                pass
             total_runtime = time.time() - start_time
             if total_runtime > job_max_runtime:
                 logger.warning("Process exceeded maximum runtime of {} sec".format(job_max_runtime))
@@ -351,8 +527,8 @@ def generic_handler(event, context_dict, custom_handler_env=None):
 
         logger.info("command execution finished")
 
-        if os.path.exists(JOBRUNNER_STATS_FILENAME):
-            with open(JOBRUNNER_STATS_FILENAME, 'r') as fid:
+        if os.path.exists(jobrunner_stats_filename):
+            with open(jobrunner_stats_filename, 'r') as fid:
                 for l in fid.readlines():
                     key, value = l.strip().split(" ")
                     float_value = float(value)
@@ -376,6 +552,21 @@ def generic_handler(event, context_dict, custom_handler_env=None):
         response_status['exception_args'] = e.args
         response_status['exception_traceback'] = traceback.format_exc()
     finally:
-        # creating new client in case the client has not been created
-        boto3.client("s3").put_object(Bucket=s3_bucket, Key=status_key,
-                                      Body=json.dumps(response_status))
+        status_body = json.dumps(response_status).encode("ascii")
+        if event.get('combined_output'):
+            # the output is missing if we failed before the jobrunner wrote it
+            output_filename = JOBRUNNER_OUTPUT_FILENAME.format(pid)
+            output_body = b""
+            if os.path.exists(output_filename):
+                with open(output_filename, 'rb') as fid:
+                    output_body = fid.read()
+                os.remove(output_filename)
+            status_body = wrenutil.pack_combined(status_body, output_body)
+        put_object(event['storage_config'], event['status_key'], status_body)
+        if event.get('completion_channel') is not None:
+            try:
+                publish_completion(event['completion_channel'],
+                                   event['callset_id'], event['call_id'])
+            except Exception as e: # pylint: disable=broad-except
+                # the client falls back to polling for the status object
+                logger.warning("could not publish completion: {}".format(e))
@@ -15,11 +15,61 @@
 #
 
 import base64
+import bisect
+import io
+import json
 import os
+import shutil
+import sys
+import tarfile
+import tempfile
+import threading
 import uuid
+import zlib
+from multiprocessing.pool import ThreadPool
 
 import struct
 
+ATOMIC_WRITE_TMP_PREFIX = ".pywren_tmp_"
+
+IO_POOL_SIZE = 64
+
+# a combined status and output object is COMBINED_MAGIC, the length of the
+# status as a big-endian uint32, the json status and then the pickled output
+COMBINED_MAGIC = b"PWC1"
+COMBINED_HEADER_FORMAT = ">4sI"
+COMBINED_HEADER_SIZE = struct.calcsize(COMBINED_HEADER_FORMAT)
+
+# a chunked archive is its data cut into CHUNKED_ARCHIVE_CHUNK_SIZE chunks
+# which are compressed independently, followed by a json index of the
+# chunks, the length of the index as a big-endian uint64 and
+# CHUNKED_ARCHIVE_MAGIC, so that chunks can be fetched by range and
+# decompressed in parallel
+CHUNKED_ARCHIVE_FORMAT = "chunked"
+CHUNKED_ARCHIVE_EXT = ".tar.chunked"
+CHUNKED_ARCHIVE_MAGIC = b"PWCHUNK1"
+CHUNKED_ARCHIVE_TRAILER_FORMAT = ">Q8s"
+CHUNKED_ARCHIVE_TRAILER_SIZE = struct.calcsize(CHUNKED_ARCHIVE_TRAILER_FORMAT)
+CHUNKED_ARCHIVE_CHUNK_SIZE = 8*1024*1024
+CHUNKED_ARCHIVE_ZLIB_LEVEL = 6
+# chunks of the files of a lazy archive, see write_lazy_chunked_archive
+LAZY_ARCHIVE_CHUNK_SIZE = 1024*1024
+# how much of the end of an archive to fetch when looking for its index
+CHUNKED_ARCHIVE_TAIL_SIZE = 64*1024
+
+# an object pickled with out-of-band buffers is OUT_OF_BAND_MAGIC, the number
+# of buffers, the lengths of the pickle and of each buffer, then the pickle
+# and the raw buffers, each buffer starting at a multiple of OUT_OF_BAND_ALIGN
+# bytes
+OUT_OF_BAND_MAGIC = b"PWB1"
+OUT_OF_BAND_HEADER_FORMAT = ">4sI"
+OUT_OF_BAND_HEADER_SIZE = struct.calcsize(OUT_OF_BAND_HEADER_FORMAT)
+OUT_OF_BAND_ALIGN = 64
+
+_io_pool = None
+_io_pool_pid = None
+_io_pool_lock = threading.Lock()
+
 
 def uuid_str():
     return str(uuid.uuid4())
@@ -116,6 +166,313 @@ class WrappedStreamingBody(object):
 
 
 
+class ParallelChunkReader(object):
+    """
+    Read-only, sequential file object over the concatenation of `chunk_n`
+    chunks, which are fetched ahead of the reader by parallel threads. At
+    most `max_ahead` chunks are buffered, so memory use is bounded however
+    large the data is.
+    """
+
+    def __init__(self, get_chunk, chunk_n, size, parallelism=8, max_ahead=None):
+        """
+        :param get_chunk: function returning the data of a chunk, by index
+        :param chunk_n: number of chunks
+        :param size: total size of the chunks
+        :param parallelism: number of chunks fetched concurrently
+        :param max_ahead: number of chunks that are fetched (or buffered)
+                          ahead of the reader. Default 2 * parallelism.
+        """
+        self.get_chunk = get_chunk
+        self.chunk_n = chunk_n
+        self.size = size
+        self.max_ahead = max_ahead if max_ahead is not None else 2 * parallelism
+
+        self._cond = threading.Condition()
+        # chunk index -> data (or the exception raised fetching it)
+        self._chunks = {}
+        self._next_fetch = 0
+        self._next_read = 0
+        self._closed = False
+        self._buf = memoryview(b"")
+        self._pos = 0
+
+        self._threads = []
+        for _ in range(min(parallelism, self.chunk_n)):
+            t = threading.Thread(target=self._fetch_loop)
+            t.daemon = True
+            t.start()
+            self._threads.append(t)
+
+    def _fetch_loop(self):
+        while True:
+            with self._cond:
+                while (not self._closed and self._next_fetch < self.chunk_n
+                       and self._next_fetch >= self._next_read + self.max_ahead):
+                    self._cond.wait()
+                if self._closed or self._next_fetch >= self.chunk_n:
+                    return
+                chunk_i = self._next_fetch
+                self._next_fetch += 1
+
+            try:
+                data = self.get_chunk(chunk_i)
+            except Exception as e: # pylint: disable=broad-except
+                data = e
+            with self._cond:
+                self._chunks[chunk_i] = data
+                self._cond.notify_all()
+
+    def _next_chunk(self):
+        with self._cond:
+            while self._next_read not in self._chunks:
+                self._cond.wait()
+            data = self._chunks.pop(self._next_read)
+            self._next_read += 1
+            self._cond.notify_all()
+        if isinstance(data, Exception):
+            raise data
+        return memoryview(data)
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.size - self._pos
+        out = io.BytesIO()
+        while size > 0 and self._pos < self.size:
+            if len(self._buf) == 0:
+                self._buf = self._next_chunk()
+            chunk = self._buf[:size]
+            self._buf = self._buf[len(chunk):]
+            out.write(chunk)
+            self._pos += len(chunk)
+            size -= len(chunk)
+        return out.getvalue()
+
+    def tell(self):
+        return self._pos
+
+    def close(self):
+        """
+        Stop fetching chunks
+        """
+        with self._cond:
+            self._closed = True
+            self._chunks = {}
+            self._cond.notify_all()
+
+
+class ParallelRangeReader(ParallelChunkReader):
+    """
+    `ParallelChunkReader` over a remote object, fetching its chunks with
+    parallel ranged requests.
+    """
+
+    def __init__(self, get_range, size, chunk_size=4*1024*1024, parallelism=8,
+                 max_ahead=None):
+        """
+        :param get_range: function returning the data of an inclusive
+                          `(first, last)` byte range of the object
+        :param size: size of the object
+        :param chunk_size: size of each ranged request
+        :param parallelism: number of concurrent requests
+        :param max_ahead: number of chunks that are fetched (or buffered)
+                          ahead of the reader. Default 2 * parallelism.
+        """
+        self.get_range = get_range
+        self.chunk_size = chunk_size
+        chunk_n = (size + chunk_size - 1) // chunk_size
+        super(ParallelRangeReader, self).__init__(self._get_range_chunk, chunk_n, size,
+                                                  parallelism, max_ahead)
+
+    def _get_range_chunk(self, chunk_i):
+        first = chunk_i * self.chunk_size
+        last = min(first + self.chunk_size, self.size) - 1
+        return self.get_range(first, last)
+
+
+def archive_codec(codec):
+    """
+    Return the `(compress, decompress)` functions of a chunked archive
+    codec: "zlib", or "zstd" and "lz4" where the zstandard and lz4
+    packages are installed.
+    """
+    if codec == "zlib":
+        return (lambda data: zlib.compress(data, CHUNKED_ARCHIVE_ZLIB_LEVEL)), zlib.decompress
+    if codec == "zstd":
+        import zstandard
+        return (lambda data: zstandard.ZstdCompressor().compress(data),
+                lambda data: zstandard.ZstdDecompressor().decompress(data))
+    if codec == "lz4":
+        import lz4.frame
+        return lz4.frame.compress, lz4.frame.decompress
+    raise ValueError("unknown archive codec {}".format(codec))
+
+
+class ChunkedArchiveWriter(object):
+    """
+    Write-only file object writing what is written to it to `out_fileobj`
+    as a chunked archive, whose index is written by `finish`.
+    """
+
+    def __init__(self, out_fileobj, codec="zlib", chunk_size=CHUNKED_ARCHIVE_CHUNK_SIZE):
+        """
+        :param codec: codec each chunk is compressed with, see `archive_codec`
+        :param chunk_size: uncompressed size of each chunk, which can be
+                           changed between writes
+        """
+        self.out_fileobj = out_fileobj
+        self.codec = codec
+        self.chunk_size = chunk_size
+        self.chunks = []
+        self._compress, _ = archive_codec(codec)
+        self._buf = io.BytesIO()
+        self._offset = 0
+        self._pos = 0
+
+    def write(self, data):
+        data = memoryview(data)
+        while len(data) > 0:
+            part = data[:self.chunk_size - self._buf.tell()]
+            self._buf.write(part)
+            self._pos += len(part)
+            data = data[len(part):]
+            if self._buf.tell() >= self.chunk_size:
+                self.flush_chunk()
+
+    def tell(self):
+        return self._pos
+
+    def flush_chunk(self):
+        """
+        End the current chunk, so that the next write starts a new one
+        """
+        data = self._buf.getvalue()
+        if len(data) == 0:
+            return
+        compressed = self._compress(data)
+        self.out_fileobj.write(compressed)
+        self.chunks.append([self._offset, len(compressed), len(data)])
+        self._offset += len(compressed)
+        self._buf = io.BytesIO()
+
+    def finish(self, extra_index=None):
+        """
+        Write the last chunk and the index
+
+        :param extra_index: dict of extra entries of the index
+        :return: the index of the archive
+        """
+        self.flush_chunk()
+        index = dict(extra_index or {})
+        index['codec'] = self.codec
+        index['chunks'] = self.chunks
+        index_data = json.dumps(index).encode('ascii')
+        self.out_fileobj.write(index_data)
+        self.out_fileobj.write(struct.pack(CHUNKED_ARCHIVE_TRAILER_FORMAT,
+                                           len(index_data), CHUNKED_ARCHIVE_MAGIC))
+        return index
+
+
+def write_chunked_archive(fileobj, out_fileobj, codec="zlib",
+                          chunk_size=CHUNKED_ARCHIVE_CHUNK_SIZE):
+    """
+    Write the data read from `fileobj` (usually a tar stream) to
+    `out_fileobj` as a chunked archive.
+
+    :param codec: codec each chunk is compressed with, see `archive_codec`
+    :param chunk_size: uncompressed size of each chunk
+    :return: the index of the archive
+    """
+    writer = ChunkedArchiveWriter(out_fileobj, codec, chunk_size)
+    while True:
+        data = fileobj.read(chunk_size)
+        if not data:
+            break
+        writer.write(data)
+    return writer.finish()
+
+
+def write_lazy_chunked_archive(tar, out_fileobj, is_lazy, codec="zlib",
+                               chunk_size=CHUNKED_ARCHIVE_CHUNK_SIZE,
+                               lazy_chunk_size=LAZY_ARCHIVE_CHUNK_SIZE):
+    """
+    Write the members of `tar` to `out_fileobj` as a lazy chunked archive:
+    a tar of the members for which `is_lazy(member)` is False, in the first
+    `eager_chunks` chunks, then the contents of the other regular files,
+    which the `files` entry of the index maps to their uncompressed
+    `[offset, size, mode, mtime]`, so that they can be extracted one by one.
+
+    :param tar: `tarfile.TarFile` opened for random access
+    :return: the index of the archive
+    """
+    members = tar.getmembers()
+    # the targets of hard links must be extracted with them
+    link_targets = set(m.linkname for m in members if m.islnk())
+    lazy_members = [m for m in members
+                    if m.isfile() and m.name not in link_targets and is_lazy(m)]
+    lazy_names = set(m.name for m in lazy_members)
+
+    writer = ChunkedArchiveWriter(out_fileobj, codec, chunk_size)
+    eager_tar = tarfile.open(mode="w|", fileobj=writer)
+    for m in members:
+        if m.name not in lazy_names:
+            eager_tar.addfile(m, tar.extractfile(m) if m.isfile() else None)
+    eager_tar.close()
+    writer.flush_chunk()
+    eager_chunks = len(writer.chunks)
+
+    # smaller chunks, as single files are fetched
+    writer.chunk_size = lazy_chunk_size
+    files = {}
+    for m in lazy_members:
+        files[os.path.normpath(m.name)] = [writer.tell(), m.size, m.mode, m.mtime]
+        shutil.copyfileobj(tar.extractfile(m), writer)
+    return writer.finish({'eager_chunks' : eager_chunks, 'files' : files})
+
+
+def read_chunked_archive_index(get_range, size):
+    """
+    Fetch the index of a remote chunked archive
+
+    :param get_range: function returning the data of an inclusive
+                      `(first, last)` byte range of the archive
+    :param size: size of the archive
+    """
+    # usually a single request gets the whole index
+    tail_first = max(0, size - CHUNKED_ARCHIVE_TAIL_SIZE)
+    tail = get_range(tail_first, size - 1)
+    index_len, magic = struct.unpack(CHUNKED_ARCHIVE_TRAILER_FORMAT,
+                                     tail[-CHUNKED_ARCHIVE_TRAILER_SIZE:])
+    if magic != CHUNKED_ARCHIVE_MAGIC:
+        raise ValueError("not a chunked archive")
+    index_first = size - CHUNKED_ARCHIVE_TRAILER_SIZE - index_len
+    if index_first < tail_first:
+        tail = get_range(index_first, tail_first - 1) + tail
+        tail_first = index_first
+    index_data = tail[index_first - tail_first:len(tail) - CHUNKED_ARCHIVE_TRAILER_SIZE]
+    return json.loads(index_data.decode('ascii'))
+
+
+def chunked_archive_reader(get_range, index, parallelism=8, max_ahead=None):
+    """
+    Return a `ParallelChunkReader` over the uncompressed data of a remote
+    chunked archive, whose chunks are fetched and decompressed in parallel.
+
+    :param get_range: function returning the data of an inclusive
+                      `(first, last)` byte range of the archive
+    :param index: index of the archive, see `read_chunked_archive_index`
+    """
+    _, decompress = archive_codec(index['codec'])
+    chunks = index['chunks']
+
+    def get_chunk(chunk_i):
+        offset, length, _ = chunks[chunk_i]
+        return decompress(get_range(offset, offset + length - 1))
+
+    size = sum(raw_length for _, _, raw_length in chunks)
+    return ParallelChunkReader(get_chunk, len(chunks), size, parallelism, max_ahead)
+
+
 def sdb_to_dict(item):
     attr = item['Attributes']
     return {c['Name'] : c['Value'] for c in attr}
@@ -131,6 +488,170 @@ def b64str_to_bytes(str_data):
     byte_data = base64.b64decode(str_ascii)
     return byte_data
 
+class BufferListIO(object):
+    """
+    Read-only file object over the concatenation of a list of buffers,
+    which reads them in place instead of joining them into one object.
+    """
+
+    def __init__(self, buffers):
+        self._buffers = [memoryview(b) for b in buffers]
+        # start offset of each buffer
+        self._starts = []
+        self._size = 0
+        for b in self._buffers:
+            self._starts.append(self._size)
+            self._size += len(b)
+        self._pos = 0
+
+    def __len__(self):
+        return self._size
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self._size - self._pos
+        end = min(self._pos + size, self._size)
+        out = io.BytesIO()
+        buffer_i = bisect.bisect_right(self._starts, self._pos) - 1
+        while self._pos < end:
+            start = self._starts[buffer_i]
+            chunk = self._buffers[buffer_i][self._pos - start:end - start]
+            out.write(chunk)
+            self._pos += len(chunk)
+            buffer_i += 1
+        return out.getvalue()
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self._pos
+        elif whence == 2:
+            offset += self._size
+        self._pos = max(0, offset)
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+    def readable(self): # pylint: disable=no-self-use
+        return True
+
+    def seekable(self): # pylint: disable=no-self-use
+        return True
+
+
+def atomic_write(filename, data):
+    """
+    Write `data` (or a list of buffers making it up) to `filename` by writing
+    a temporary file in the same directory and renaming it into place, so
+    readers never observe a partial file.
+    """
+    dirname = os.path.dirname(filename)
+    try:
+        os.makedirs(dirname)
+    except OSError as e:
+        if e.errno != 17: # EEXIST
+            raise e
+    fd, tmp_filename = tempfile.mkstemp(prefix=ATOMIC_WRITE_TMP_PREFIX, dir=dirname)
+    try:
+        with os.fdopen(fd, 'wb') as fid:
+            if isinstance(data, list):
+                for part in data:
+                    fid.write(part)
+            else:
+                fid.write(data)
+        os.rename(tmp_filename, filename)
+    except:
+        os.remove(tmp_filename)
+        raise
+
+def get_io_pool():
+    """
+    Return the process-wide thread pool shared by waiting, result
+    fetching and invocation. It is created on first use (and again
+    in a forked child, which doesn't inherit the pool's threads).
+    """
+    global _io_pool, _io_pool_pid # pylint: disable=global-statement
+    with _io_pool_lock:
+        if _io_pool is None or _io_pool_pid != os.getpid():
+            _io_pool = ThreadPool(IO_POOL_SIZE)
+            _io_pool_pid = os.getpid()
+        return _io_pool
+
+
+def pack_combined(status, output):
+    """
+    Frame the (json encoded) status and the pickled output of a call as
+    a single object
+    """
+    return b"".join([struct.pack(COMBINED_HEADER_FORMAT, COMBINED_MAGIC, len(status)),
+                     status, output])
+
+
+def combined_status_end(data):
+    """
+    Return the offset where the status of a combined object ends (and its output
+    starts), given at least the first COMBINED_HEADER_SIZE bytes of the object.
+    """
+    magic, status_len = struct.unpack(COMBINED_HEADER_FORMAT, data[:COMBINED_HEADER_SIZE])
+    if magic != COMBINED_MAGIC:
+        raise ValueError("not a combined status and output object")
+    return COMBINED_HEADER_SIZE + status_len
+
+
+def pack_out_of_band(pickled, buffers):
+    """
+    Frame a pickle and the byte buffers it keeps out of band (see
+    `serialize.util.out_of_band_persistent_id`) as a single object, with
+    each buffer as a raw, aligned segment. The frame is returned as the
+    bytearray it is built in, so it isn't copied again.
+    """
+    frame = bytearray(struct.pack(OUT_OF_BAND_HEADER_FORMAT, OUT_OF_BAND_MAGIC, len(buffers)))
+    frame += struct.pack(">{}Q".format(len(buffers) + 1),
+                         len(pickled), *[len(b) for b in buffers])
+    frame += pickled
+    for buf in buffers:
+        frame += b"\0" * (-len(frame) % OUT_OF_BAND_ALIGN)
+        frame += buf
+    return frame
+
+
+def is_out_of_band(data):
+    return memoryview(data)[:len(OUT_OF_BAND_MAGIC)].tobytes() == OUT_OF_BAND_MAGIC
+
+
+def unpack_out_of_band(data):
+    """
+    Return the pickle and the buffers of an object framed by `pack_out_of_band`,
+    as memoryviews into `data`, so nothing is copied. On python 2 the buffers
+    are old-style buffer objects instead, which numpy can read.
+    """
+    if sys.version_info[0] == 2 and isinstance(data, memoryview):
+        data = data.tobytes()
+    view = memoryview(data)
+    _, buffer_n = struct.unpack_from(OUT_OF_BAND_HEADER_FORMAT, view)
+    lens = struct.unpack_from(">{}Q".format(buffer_n + 1), view, OUT_OF_BAND_HEADER_SIZE)
+    offset = OUT_OF_BAND_HEADER_SIZE + struct.calcsize(">Q") * (buffer_n + 1)
+    pickled = view[offset:offset + lens[0]]
+    offset += lens[0]
+    buffers = []
+    for buffer_len in lens[1:]:
+        offset += -offset % OUT_OF_BAND_ALIGN
+        if sys.version_info[0] == 2:
+            buffers.append(buffer(data, offset, buffer_len)) # pylint: disable=undefined-variable
+        else:
+            buffers.append(view[offset:offset + buffer_len])
+        offset += buffer_len
+    return pickled, buffers
+
+
+def unpack_combined(data):
+    """
+    Split a combined object into the status and the pickled output
+    """
+    status_end = combined_status_end(data)
+    return data[COMBINED_HEADER_SIZE:status_end], data[status_end:]
+
+
 def split_s3_url(s3_url):
     if s3_url[:5] != "s3://":
         raise ValueError("URL {} is not valid".format(s3_url))
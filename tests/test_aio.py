@@ -0,0 +1,99 @@
+#
+# Copyright 2018 PyWren Team
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import pytest
+import pywren
+
+if sys.version_info < (3, 5):
+    pytest.skip("pywren.aio needs python 3.5+", allow_module_level=True)
+
+import asyncio
+from pywren import aio
+
+
+class AsyncLocal(unittest.TestCase):
+    """
+    The asyncio API against local storage and a local executor
+    """
+
+    def setUp(self):
+        self.storage_path = tempfile.mkdtemp()
+        config = {'storage_backend' : 'local',
+                  'storage_prefix' : 'pywren.jobs',
+                  'local' : {'storage_path' : self.storage_path},
+                  'runtime' : {'runtime_storage' : 'local'}}
+        self.wrenexec = pywren.local_executor(config, num_workers=2,
+                                              run_dir=os.path.join(self.storage_path, "run"))
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        self.loop.run_until_complete(aio.close_async_storages())
+        self.loop.close()
+        self.wrenexec.shutdown()
+        shutil.rmtree(self.storage_path, True)
+
+    def test_map_await(self):
+
+        def plus_one(x):
+            return x + 1
+
+        futures = self.loop.run_until_complete(self.wrenexec.map_async(plus_one, range(5),
+                                                                       chunksize=2))
+        assert self.loop.run_until_complete(asyncio.ensure_future(futures[3])) == 4
+        res = self.loop.run_until_complete(aio.get_all_results(futures))
+        assert res == [1, 2, 3, 4, 5]
+
+    def test_exception(self):
+
+        def throwexcept(x):
+            raise Exception("Throw me out!")
+
+        fut = self.wrenexec.call_async(throwexcept, None)
+        with pytest.raises(Exception) as execinfo:
+            self.loop.run_until_complete(asyncio.ensure_future(fut))
+        assert 'Throw me out!' in str(execinfo.value)
+
+    def test_as_completed(self):
+
+        def plus_one(x):
+            return x + 1
+
+        futures = self.wrenexec.map(plus_one, range(3)) + \
+                  self.wrenexec.map(plus_one, range(3, 6))
+        completed = aio.as_completed(futures, poll_interval=0.1)
+        res = []
+        while True:
+            try:
+                f = self.loop.run_until_complete(completed.__anext__())
+            except StopAsyncIteration:
+                break
+            res.append(f.result())
+        assert sorted(res) == [1, 2, 3, 4, 5, 6]
+
+    def test_close_async_storages(self):
+        storage_path = self.wrenexec.call_async(abs, -1).storage_path
+        async_storage = aio.get_async_storage(storage_path)
+        assert aio.get_async_storage(storage_path) is async_storage
+        self.loop.run_until_complete(aio.close_async_storages())
+        assert self.loop not in aio._async_storages
+        assert aio.get_async_storage(storage_path) is not async_storage
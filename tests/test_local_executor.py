@@ -0,0 +1,255 @@
+#
+# Copyright 2018 PyWren Team
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from multiprocessing.pool import ThreadPool
+
+import numpy as np
+import pytest
+from six.moves.queue import Queue
+
+import pywren
+from pywren import completion
+
+
+class LocalExecutor(unittest.TestCase):
+    """
+    Runs jobs in local worker processes against local storage,
+    so these tests need no AWS resources.
+    """
+
+    def setUp(self):
+        self.storage_path = tempfile.mkdtemp()
+        config = {'storage_backend' : 'local',
+                  'storage_prefix' : 'pywren.jobs',
+                  'local' : {'storage_path' : self.storage_path},
+                  'runtime' : {'runtime_storage' : 'local'}}
+        self.wrenexec = pywren.local_executor(config, num_workers=2,
+                                              run_dir=os.path.join(self.storage_path, "run"))
+
+    def tearDown(self):
+        self.wrenexec.shutdown()
+        shutil.rmtree(self.storage_path, True)
+
+    def test_map(self):
+
+        def plus_one(x):
+            return x + 1
+
+        x = np.arange(6)
+        futures = self.wrenexec.map(plus_one, x)
+        res = pywren.get_all_results(futures)
+        np.testing.assert_array_equal(res, x + 1)
+
+        # every job ran in one of the pool's worker processes
+        worker_pids = set(f.run_status['worker_pid'] for f in futures)
+        assert len(worker_pids) <= 2
+        assert os.getpid() not in worker_pids
+
+    def test_func_upload_dedup(self):
+
+        def plus_one(x):
+            return x + 1
+
+        futures = self.wrenexec.map(plus_one, range(2))
+        assert pywren.get_all_results(futures) == [1, 2]
+        # the second map reuses the function uploaded by the first one
+        futures2 = self.wrenexec.map(plus_one, range(2, 4))
+        assert pywren.get_all_results(futures2) == [3, 4]
+        meta, meta2 = futures[0]._invoke_metadata, futures2[0]._invoke_metadata
+        assert meta['func_uploaded'] and meta['module_zip_uploaded']
+        assert meta2['func_key'] == meta['func_key']
+        assert not meta2['func_uploaded'] and not meta2['module_zip_uploaded']
+
+    def test_out_of_band_buffers(self):
+        config = {'storage_backend' : 'local',
+                  'storage_prefix' : 'pywren.jobs',
+                  'local' : {'storage_path' : self.storage_path},
+                  'runtime' : {'runtime_storage' : 'local'},
+                  'scheduler' : {'out_of_band_buffers' : True}}
+
+        def double(x):
+            # arrays are loaded in place, so they are read-only
+            assert not x.flags.writeable
+            return x * 2
+
+        x = [np.arange(1000.0) + i for i in range(4)]
+        with pywren.local_executor(config, num_workers=2,
+                                   run_dir=os.path.join(self.storage_path, "run_oob")) as wrenexec:
+            futures = wrenexec.map(double, x) + wrenexec.map(double, x, chunksize=2)
+            res = pywren.get_all_results(futures)
+        for r, x_i in zip(res, x + x):
+            np.testing.assert_array_equal(r, x_i * 2)
+
+    def test_tree_reduce(self):
+
+        def plus_one(x):
+            return x + 1
+
+        futures = self.wrenexec.map(plus_one, range(4))
+        reduce_future = self.wrenexec.reduce(sum, futures, fan_in=2)
+        assert reduce_future.result() == 10
+
+    def test_fetch_results(self):
+
+        def maybe_throw(x):
+            if x == 2:
+                raise ValueError("two")
+            return x
+
+        futures = self.wrenexec.map(maybe_throw, range(4), chunksize=3)
+        res = pywren.fetch_results(futures, parallelism=4, return_exceptions=True)
+        assert res[:2] == [0, 1] and res[3] == 3
+        assert isinstance(res[2], ValueError)
+        with pytest.raises(ValueError):
+            pywren.fetch_results(futures)
+
+    def test_combined_output(self):
+
+        def maybe_throw(x):
+            if x == 2:
+                raise ValueError("two")
+            return x
+
+        config = {'storage_backend' : 'local',
+                  'storage_prefix' : 'pywren.jobs',
+                  'local' : {'storage_path' : self.storage_path},
+                  'runtime' : {'runtime_storage' : 'local'},
+                  'scheduler' : {'combined_output' : True}}
+        with pywren.local_executor(config, num_workers=2,
+                                   run_dir=os.path.join(self.storage_path, "run")) as wrenexec:
+            futures = wrenexec.map(maybe_throw, range(3), chunksize=2)
+            assert futures[0].result() == 0
+            res = pywren.fetch_results(futures, return_exceptions=True)
+            assert res[:2] == [0, 1]
+            assert isinstance(res[2], ValueError)
+
+        # one object per invocation
+        callset_dir = os.path.join(self.storage_path, 'pywren.jobs', futures[0].callset_id)
+        assert sorted(os.listdir(os.path.join(callset_dir, 'status'))) == \
+            ['00000.combined', '00002.combined']
+        assert not os.path.exists(os.path.join(callset_dir, '00000', 'output.pickle'))
+
+    def test_exception(self):
+
+        def throwexcept(x):
+            raise Exception("Throw me out!")
+
+        fut = self.wrenexec.call_async(throwexcept, None)
+        with pytest.raises(Exception) as execinfo:
+            fut.result()
+        assert 'Throw me out!' in str(execinfo.value)
+
+    def test_result_timeout(self):
+
+        def sleep_for(x):
+            import time
+            time.sleep(x)
+            return x
+
+        fut = self.wrenexec.call_async(sleep_for, 2)
+        with pytest.raises(pywren.future.TimeoutError):
+            fut.result(timeout=0.1)
+        assert fut.result() == 2
+
+    def test_exception_state(self):
+
+        def throwexcept(x):
+            raise ValueError("Throw me out!")
+
+        fut = self.wrenexec.call_async(throwexcept, None)
+        exc = fut.exception()
+        assert isinstance(exc, ValueError)
+        assert fut.done() and not fut.running()
+        # raises the same exception every time, without fetching it again
+        for _ in range(2):
+            with pytest.raises(ValueError):
+                fut.result()
+
+    def test_done_callback(self):
+
+        def plus_one(x):
+            return x + 1
+
+        results = Queue()
+        futures = self.wrenexec.map(plus_one, range(4))
+        for f in futures:
+            f.add_done_callback(lambda f: results.put(f.result()))
+        assert sorted(results.get(timeout=30) for _ in futures) == [1, 2, 3, 4]
+
+        # futures that are already done run the callback right away
+        futures[0].add_done_callback(lambda f: results.put(f.result()))
+        assert results.get_nowait() == 1
+
+    def test_completion_notified(self):
+
+        def plus_one(x):
+            return x + 1
+
+        futures = self.wrenexec.map(plus_one, range(4))
+        assert completion.notified(futures[0])
+
+        fs_dones, fs_notdones = pywren.wait(futures, pywren.ALL_COMPLETED)
+        assert len(fs_dones) == 4 and len(fs_notdones) == 0
+        for f in futures:
+            assert completion.done(f)
+        assert [f.result() for f in futures] == [1, 2, 3, 4]
+        # the callset is forgotten once all of its calls are done
+        assert futures[0].callset_id not in completion._callsets
+        assert futures[0].callset_id not in self.wrenexec.storage._callset_status
+
+    def test_as_completed(self):
+
+        def sleep_for(x):
+            import time
+            time.sleep(x)
+            return x
+
+        futures = self.wrenexec.map(sleep_for, [2, 0, 0, 0])
+        yielded = list(pywren.as_completed(futures))
+        assert sorted(f.call_id for f in yielded) == sorted(f.call_id for f in futures)
+        # the slow call is the straggler
+        assert yielded[-1] is futures[0]
+        assert [f.result() for f in yielded][-1] == 2
+
+    def test_runtime_etag_lookup(self):
+        lookups = []
+
+        def get_runtime_etag(runtime_config, runtime_url=""): # pylint: disable=unused-argument
+            lookups.append(runtime_url)
+            time.sleep(0.1)
+            return '"etag"'
+
+        real_get_runtime_etag = pywren.executor.storage.get_runtime_etag
+        pywren.executor.storage.get_runtime_etag = get_runtime_etag
+        pool = ThreadPool(8)
+        try:
+            # concurrent invocations wait for one lookup per runtime url
+            etags = pool.map(self.wrenexec.get_runtime_etag, [""] * 8 + ["s3://b/k"] * 8)
+            assert etags == ['"etag"'] * 16
+            assert sorted(lookups) == ["", "s3://b/k"]
+
+            # the ETag is looked up again once a call ran into a changed runtime
+            pywren.future._runtime_changed()
+            assert self.wrenexec.get_runtime_etag("") == '"etag"'
+            assert sorted(lookups) == ["", "", "s3://b/k"]
+        finally:
+            pool.close()
+            pywren.executor.storage.get_runtime_etag = real_get_runtime_etag
@@ -28,7 +28,14 @@ import extmodule
 import extmoduleutf8
 import extmodule_otherencode
 from pywren import wrenconfig, wrenutil, runtime
+from pywren.serialize import create_mod_zip
+from pywren.serialize.module_dependency import ImportCache, ModuleDependencyAnalyzer
+import io
 import os
+import shutil
+import sys
+import tempfile
+import zipfile
 
 class SimpleAsync(unittest.TestCase):
 
@@ -125,6 +132,60 @@ class DummyExecutorImport(unittest.TestCase):
         for f in info['pkg_ver_list']:
             print(f[0])
 
+class ImportCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.module_dir = tempfile.mkdtemp()
+        self.module_filename = os.path.join(self.module_dir, "cachedmod.py")
+        with open(self.module_filename, 'w') as fid:
+            fid.write("import json\n")
+        sys.path.insert(0, self.module_dir)
+
+    def tearDown(self):
+        sys.path.remove(self.module_dir)
+        shutil.rmtree(self.module_dir, True)
+
+    def test_cached_imports(self):
+        cache_path = os.path.join(self.module_dir, "imports.json")
+        cache = ImportCache(cache_path)
+        analyzer = ModuleDependencyAnalyzer(cache)
+        analyzer.ignore(["json", "csv"])
+        analyzer.add("cachedmod")
+        self.assertEqual(analyzer.get_and_clear_paths(), {self.module_filename})
+        self.assertEqual(cache.get(self.module_filename), {"json"})
+
+        # the cache survives across processes
+        cache.save()
+        self.assertEqual(ImportCache(cache_path).get(self.module_filename), {"json"})
+
+        # changed files are parsed again
+        with open(self.module_filename, 'w') as fid:
+            fid.write("import json, csv\n")
+        self.assertIsNone(cache.get(self.module_filename))
+        analyzer = ModuleDependencyAnalyzer(cache)
+        analyzer.ignore(["json", "csv"])
+        analyzer.add("cachedmod")
+        self.assertEqual(cache.get(self.module_filename), {"json", "csv"})
+
+
+class ModuleZipTest(unittest.TestCase):
+
+    def test_create_mod_zip(self):
+        test_dir = os.path.dirname(os.path.abspath(__file__))
+        mod_paths = [os.path.join(test_dir, "extmodule.py"),
+                     os.path.dirname(os.path.abspath(pywren.serialize.__file__))]
+        module_zip = create_mod_zip(set(mod_paths))
+        # the same modules give the same zip, whatever the order
+        self.assertEqual(module_zip, create_mod_zip(set(reversed(mod_paths))))
+
+        zip_file = zipfile.ZipFile(io.BytesIO(module_zip))
+        names = zip_file.namelist()
+        self.assertIn("extmodule.py", names)
+        self.assertIn("serialize/util.py", names)
+        with open(mod_paths[0], 'rb') as fid:
+            self.assertEqual(zip_file.read("extmodule.py"), fid.read())
+
+
 class InteractiveTest(unittest.TestCase):
 
     ''' pywren handles module serialization slightly differently in interactive mode vs regular script mode
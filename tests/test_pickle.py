@@ -30,6 +30,7 @@ import unittest
 import numpy as np
 from flaky import flaky
 import sys
+from pywren.serialize.util import dumps_out_of_band, loads_out_of_band
 
 
 class CantPickle(object):
@@ -176,3 +177,28 @@ class PickleSafety(unittest.TestCase):
             res = fut.result() 
             assert 'Fun exception' in str(execinfo.value)
 
+
+class OutOfBandPickle(unittest.TestCase):
+
+    def test_round_trip(self):
+        obj = {'c' : np.arange(1000.0).reshape(10, 100),
+               'f' : np.asfortranarray(np.arange(2000).reshape(20, 100)),
+               'strided' : np.arange(2000)[::2],
+               'small' : np.arange(4),
+               'objects' : np.array([None, "a"] * 1000, dtype=object),
+               'other' : [1, "two"]}
+        data = dumps_out_of_band(obj)
+        res = loads_out_of_band(data)
+        self.assertEqual(sorted(res.keys()), sorted(obj.keys()))
+        for k in ['c', 'f', 'strided', 'small', 'objects']:
+            np.testing.assert_array_equal(res[k], obj[k])
+            self.assertEqual(res[k].dtype, obj[k].dtype)
+        self.assertEqual(res['other'], obj['other'])
+        self.assertTrue(res['f'].flags.f_contiguous)
+
+        # large plain arrays are used in place, the rest is pickled as usual
+        self.assertFalse(res['c'].flags.writeable)
+        self.assertFalse(res['f'].flags.writeable)
+        self.assertTrue(res['strided'].flags.writeable)
+        self.assertTrue(res['small'].flags.writeable)
+
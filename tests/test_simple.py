@@ -103,6 +103,17 @@ class SimpleAsync(unittest.TestCase):
         assert exc_type_wren == exc_type_true
         assert type(exc_value_wren) == type(exc_value_true)
 
+    def test_result_timeout(self):
+
+        def sleep_and_return(x):
+            time.sleep(x)
+            return x
+
+        fut = self.wrenexec.call_async(sleep_and_return, 10)
+        with pytest.raises(pywren.future.TimeoutError):
+            fut.result(timeout=1)
+        self.assertEqual(fut.result(), 10)
+
 
 class SimpleMap(unittest.TestCase):
 
@@ -159,6 +170,69 @@ class SimpleMap(unittest.TestCase):
         res = np.array(pywren.get_all_results(futures))
         np.testing.assert_array_equal(res, x + 1)
 
+class BatchedMap(unittest.TestCase):
+
+    def setUp(self):
+        self.wrenexec = pywren.default_executor()
+
+    def test_map_chunksize(self):
+
+        def plus_one(x):
+            return x + 1
+        N = 10
+
+        x = np.arange(N)
+        futures = self.wrenexec.map(plus_one, x, chunksize=4)
+        self.assertEqual(len(futures), N)
+
+        res = np.array(pywren.get_all_results(futures))
+        np.testing.assert_array_equal(res, x + 1)
+
+    def test_map_chunksize_exception(self):
+
+        def throw_on_odd(x):
+            if x % 2 == 1:
+                raise Exception("odd {}".format(x))
+            return x
+
+        futures = self.wrenexec.map(throw_on_odd, range(6), chunksize=3)
+        pywren.wait(futures)
+        for i, f in enumerate(futures):
+            if i % 2 == 1:
+                with pytest.raises(Exception) as execinfo:
+                    f.result()
+                assert "odd {}".format(i) in str(execinfo.value)
+            else:
+                self.assertEqual(f.result(), i)
+
+
+class StreamingMap(unittest.TestCase):
+
+    def setUp(self):
+        self.wrenexec = pywren.default_executor()
+
+    def test_map_stream(self):
+
+        def plus_one(x):
+            return x + 1
+        N = 25
+
+        def gen():
+            for i in range(N):
+                yield i
+
+        futures = self.wrenexec.map_stream(plus_one, gen(), window_size=4)
+        futures = list(futures)
+        self.assertEqual(len(futures), N)
+
+        res = np.array(pywren.get_all_results(futures))
+        np.testing.assert_array_equal(res, np.arange(N) + 1)
+
+    def test_map_stream_empty(self):
+        futures = self.wrenexec.map_stream(lambda x: x, iter([]))
+        self.assertEqual(futures.wait_submitted(), [])
+
+
 class SimpleReduce(unittest.TestCase):
 
     def setUp(self):
@@ -177,6 +251,19 @@ class SimpleReduce(unittest.TestCase):
 
         np.testing.assert_array_equal(reduce_future.result(), 55)
 
+    def test_tree_reduce(self):
+
+        def plus_one(x):
+            return x + 1
+        N = 10
+
+        x = np.arange(N)
+        futures = self.wrenexec.map(plus_one, x)
+
+        reduce_future = self.wrenexec.reduce(sum, futures, fan_in=3)
+
+        np.testing.assert_array_equal(reduce_future.result(), 55)
+
 class RuntimeCaching(unittest.TestCase):
 
     def setUp(self):
@@ -295,6 +382,39 @@ class WaitTest(unittest.TestCase):
         res = np.array([f.result() for f in futures])
         np.testing.assert_array_equal(res, x+1)
 
+    def test_multiple_callsets(self):
+        def plus_one(x):
+            return x + 1
+
+        N = 10
+        x = np.arange(N)
+
+        futures1 = self.wrenexec.map(plus_one, x)
+        futures2 = self.wrenexec.map(plus_one, x + N, chunksize=3)
+
+        fs_dones, fs_notdones = pywren.wait(futures1 + futures2,
+                                            return_when=pywren.wren.ALL_COMPLETED)
+        self.assertEqual(len(fs_dones), 2*N)
+        self.assertEqual(len(fs_notdones), 0)
+        res = pywren.get_all_results(futures1 + futures2)
+        np.testing.assert_array_equal(res, np.arange(2*N) + 1)
+
+    def test_as_completed(self):
+        def wait_x_sec_and_plus_one(x):
+            time.sleep(x)
+            return x + 1
+
+        N = 10
+        x = np.arange(N)
+
+        futures = self.wrenexec.map(wait_x_sec_and_plus_one, x)
+
+        fs_completed = list(pywren.as_completed(futures, WAIT_DUR_SEC=1))
+        self.assertEqual(len(fs_completed), N)
+        self.assertEqual(len(set(id(f) for f in fs_completed)), N)
+        res = np.array(sorted(f.result() for f in fs_completed))
+        np.testing.assert_array_equal(res, x+1)
+
 
 # Comment this test out as it doesn't work with the multiple executors (Vaishaal)
 # If we need this later we need to do some more monkey patching but is unclear we actually need this
@@ -0,0 +1,264 @@
+#
+# Copyright 2018 PyWren Team
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import pytest
+from botocore.stub import Stubber, ANY
+import pywren.wrenconfig as wrenconfig
+import pywren.wrenutil as wrenutil
+from pywren.storage import Storage, get_storage, get_storage_for_path, storage_utils
+from pywren.storage.exceptions import StorageNoSuchKeyError, StorageOutputNotFoundError
+from pywren.storage.local_backend import LocalBackend
+from pywren.storage.s3_backend import S3Backend
+
+
+class LocalBackendTest(unittest.TestCase):
+
+    def setUp(self):
+        self.storage_path = tempfile.mkdtemp()
+        self.backend = LocalBackend({'storage_path' : self.storage_path})
+
+    def tearDown(self):
+        shutil.rmtree(self.storage_path, True)
+
+    def test_put_get(self):
+        self.backend.put_object("a/b/c.pickle", b"hello")
+        self.assertEqual(self.backend.get_object("a/b/c.pickle"), b"hello")
+        self.assertTrue(self.backend.key_exists("a/b/c.pickle"))
+
+        # overwrite
+        self.backend.put_object("a/b/c.pickle", b"")
+        self.assertEqual(self.backend.get_object("a/b/c.pickle"), b"")
+
+    def test_no_such_key(self):
+        self.assertFalse(self.backend.key_exists("nonsense"))
+        with pytest.raises(StorageNoSuchKeyError):
+            self.backend.get_object("nonsense")
+
+    def test_list_keys_with_prefix(self):
+        for k in ["jobs/cs1/00001/status.json", "jobs/cs1/00000/status.json",
+                  "jobs/cs10/00000/status.json", "jobs/cs2/00000/status.json",
+                  "other/00000/status.json"]:
+            self.backend.put_object(k, b"{}")
+
+        self.assertEqual(self.backend.list_keys_with_prefix("jobs/cs1/"),
+                         ["jobs/cs1/00000/status.json", "jobs/cs1/00001/status.json"])
+        # prefixes need not end on a directory boundary
+        self.assertEqual(self.backend.list_keys_with_prefix("jobs/cs1"),
+                         ["jobs/cs1/00000/status.json", "jobs/cs1/00001/status.json",
+                          "jobs/cs10/00000/status.json"])
+        self.assertEqual(self.backend.list_keys_with_prefix("nothing/here"), [])
+        self.assertEqual(self.backend.list_keys_with_prefix("jobs/cs1",
+                                                            "jobs/cs1/00001/status.json"),
+                         ["jobs/cs10/00000/status.json"])
+
+
+class S3BackendTest(unittest.TestCase):
+
+    def setUp(self):
+        self.backend = S3Backend({'bucket' : "bucket"})
+        self.backend.MULTIPART_PART_SIZE = 4
+        self.stubber = Stubber(self.backend.s3client)
+        # the bodies sent, by operation
+        self.bodies = []
+
+        def read_body(params, model, **kwargs): # pylint: disable=unused-argument
+            if 'Body' in params:
+                self.bodies.append((model.name, params['Body'].read()))
+                params['Body'].seek(0)
+        self.backend.s3client.meta.events.register('before-parameter-build.s3.*', read_body)
+
+    def test_put_object_parts_small(self):
+        self.stubber.add_response('put_object', {},
+                                  {'Bucket' : "bucket", 'Key' : "k", 'Body' : ANY})
+        with self.stubber:
+            self.backend.put_object_parts("k", [b"ab", memoryview(b"c")])
+        self.stubber.assert_no_pending_responses()
+        self.assertEqual(self.bodies, [("PutObject", b"abc")])
+
+    def test_put_object_parts_multipart(self):
+        key_args = {'Bucket' : "bucket", 'Key' : "k"}
+        upload_args = dict(key_args, UploadId="u1")
+        self.stubber.add_response('create_multipart_upload', {'UploadId' : "u1"}, key_args)
+        for part_n in range(1, 4):
+            self.stubber.add_response('upload_part', {'ETag' : '"e{}"'.format(part_n)},
+                                      dict(upload_args, PartNumber=part_n, Body=ANY))
+        parts = [{'ETag' : '"e{}"'.format(n), 'PartNumber' : n} for n in range(1, 4)]
+        self.stubber.add_response('complete_multipart_upload', {},
+                                  dict(upload_args, MultipartUpload={'Parts' : parts}))
+        with self.stubber:
+            self.backend.put_object_parts("k", [b"abcdef", memoryview(b"g"), b"", b"hij"])
+        self.stubber.assert_no_pending_responses()
+        self.assertEqual(self.bodies, [("UploadPart", b"abcd"), ("UploadPart", b"efgh"),
+                                       ("UploadPart", b"ij")])
+
+    def test_put_object_parts_abort(self):
+        key_args = {'Bucket' : "bucket", 'Key' : "k"}
+        upload_args = dict(key_args, UploadId="u1")
+        self.stubber.add_response('create_multipart_upload', {'UploadId' : "u1"}, key_args)
+        self.stubber.add_client_error('upload_part', 'InternalError')
+        self.stubber.add_response('abort_multipart_upload', {}, upload_args)
+        with self.stubber:
+            with pytest.raises(Exception):
+                self.backend.put_object_parts("k", [b"abcdefgh"])
+        self.stubber.assert_no_pending_responses()
+
+
+class LocalStorageTest(unittest.TestCase):
+
+    def setUp(self):
+        self.storage_path = tempfile.mkdtemp()
+        config = {'storage_backend' : 'local',
+                  'storage_prefix' : 'pywren.jobs',
+                  'local' : {'storage_path' : self.storage_path}}
+        self.storage_config = wrenconfig.extract_storage_config(config)
+        self.storage = Storage(self.storage_config)
+
+    def tearDown(self):
+        shutil.rmtree(self.storage_path, True)
+
+    def test_storage_path(self):
+        self.assertEqual(storage_utils.get_storage_path(self.storage_config),
+                         ['local', os.path.abspath(self.storage_path), 'pywren.jobs'])
+
+    def test_shared_storage(self):
+        storage_handler = get_storage(self.storage_config)
+        self.assertIs(get_storage(self.storage_config), storage_handler)
+        # futures only know their storage path
+        storage_path = storage_utils.get_storage_path(self.storage_config)
+        self.assertIs(get_storage_for_path(storage_path), storage_handler)
+
+    def test_call_status(self):
+        self.assertEqual(self.storage.get_callset_status("cs"), [])
+        self.assertIsNone(self.storage.get_call_status("cs", "00000"))
+
+        status_key = storage_utils.create_status_key("pywren.jobs", "cs", "00001")
+        self.storage.backend_handler.put_object(status_key,
+                                                json.dumps({'exception' : None}).encode('ascii'))
+        self.assertEqual(self.storage.get_callset_status("cs"), ["00001"])
+        self.assertEqual(self.storage.get_call_status("cs", "00001"), {'exception' : None})
+
+        with pytest.raises(StorageOutputNotFoundError):
+            self.storage.get_call_output("cs", "00001")
+
+    def test_callset_status_incremental(self):
+        def put_status(call_id):
+            status_key = storage_utils.create_status_key("pywren.jobs", "cs", call_id)
+            self.storage.backend_handler.put_object(status_key, b"{}")
+
+        put_status("00000")
+        put_status("00002")
+        pending = ["00000", "00001", "00002", "00003"]
+        self.assertEqual(self.storage.get_callset_status("cs", pending),
+                         ["00000", "00002"])
+
+        # only keys from the lowest pending call onward are listed
+        listed = []
+        list_keys_with_prefix = self.storage.backend_handler.list_keys_with_prefix
+        def recording_list(prefix, start_after=None):
+            keys = list_keys_with_prefix(prefix, start_after)
+            listed.extend(keys)
+            return keys
+        self.storage.backend_handler.list_keys_with_prefix = recording_list
+
+        put_status("00001")
+        self.assertEqual(self.storage.get_callset_status("cs", ["00001", "00003"]),
+                         ["00000", "00001", "00002"])
+        self.assertEqual(sorted(listed), [storage_utils.create_status_key("pywren.jobs", "cs", c)
+                                          for c in ["00001", "00002"]])
+
+        # nothing to list once every pending call has been seen
+        del listed[:]
+        self.assertEqual(self.storage.get_callset_status("cs", ["00002"]),
+                         ["00000", "00001", "00002"])
+        self.assertEqual(listed, [])
+
+    def test_call_results(self):
+        status_key = storage_utils.create_status_key("pywren.jobs", "cs", "00000")
+        self.storage.backend_handler.put_object(status_key, b'{"exception": null}')
+        output_key = storage_utils.create_output_key("pywren.jobs", "cs", "00000")
+        self.storage.backend_handler.put_object(output_key, b"output")
+
+        for parallelism in [None, 2]:
+            results = self.storage.get_call_results([("cs", "00000"), ("cs", "00001")],
+                                                    parallelism)
+            self.assertEqual(results[0], ({'exception' : None}, b"output"))
+            # errors are returned in place
+            self.assertIsNone(results[1][0])
+            self.assertIsInstance(results[1][1], StorageOutputNotFoundError)
+
+    def test_put_data_parts(self):
+        self.storage.put_data("pywren.jobs/cs/aggdata.pickle",
+                              [b"abc", memoryview(b"de"), b""])
+        self.assertEqual(self.storage.backend_handler.get_object("pywren.jobs/cs/aggdata.pickle"),
+                         b"abcde")
+
+    def test_put_blob(self):
+        key, uploaded = self.storage.put_blob("abc", b"blob")
+        self.assertTrue(uploaded)
+        self.assertEqual(key, storage_utils.create_blob_key("pywren.jobs", "abc"))
+        self.assertEqual(self.storage.backend_handler.get_object(key), b"blob")
+        self.assertEqual(self.storage.put_blob("abc", b"blob"), (key, False))
+
+        # blobs uploaded by another client are found in storage
+        other = Storage(self.storage_config)
+        self.assertEqual(other.put_blob("abc", b"blob"), (key, False))
+
+        # only the most recently used blob keys are remembered
+        self.storage.BLOB_KEYS = 2
+        self.storage.put_blob("def", b"blob")
+        self.storage.put_blob("abc", b"blob")
+        self.storage.put_blob("ghi", b"blob")
+        self.assertEqual(list(self.storage._blob_keys),
+                         [storage_utils.create_blob_key("pywren.jobs", d) for d in ["abc", "ghi"]])
+
+    def test_callset_status_bounded(self):
+        status_key = storage_utils.create_status_key("pywren.jobs", "cs0", "00000")
+        self.storage.backend_handler.put_object(status_key, b'{"exception": null}')
+        self.storage.STATUS_CALLSETS = 2
+        for callset_id in ["cs0", "cs1", "cs0", "cs2"]:
+            self.storage.get_callset_status(callset_id)
+        self.assertEqual(list(self.storage._callset_status), ["cs0", "cs2"])
+
+        self.storage.forget_callset("cs0")
+        self.assertEqual(list(self.storage._callset_status), ["cs2"])
+        # forgotten callsets are scanned from the start again
+        self.assertEqual(self.storage.get_callset_status("cs0"), ["00000"])
+
+    def test_combined_status_and_output(self):
+        status = {'exception' : None, 'stdout' : "x" * 100}
+        combined_key = storage_utils.create_combined_key("pywren.jobs", "cs", "00000")
+        self.storage.backend_handler.put_object(
+            combined_key, wrenutil.pack_combined(json.dumps(status).encode('ascii'), b"output"))
+
+        self.assertEqual(self.storage.get_callset_status("cs"), ["00000"])
+        # the status is read in two parts if it doesn't fit in the first read
+        self.storage.COMBINED_STATUS_READ_SIZE = 16
+        self.assertEqual(self.storage.get_call_status("cs", "00000", combined=True), status)
+        self.assertEqual(self.storage.get_call_output("cs", "00000", combined=True), b"output")
+        self.assertEqual(self.storage.get_call_status_and_output("cs", "00000"),
+                         (status, b"output"))
+
+        self.assertIsNone(self.storage.get_call_status("cs", "00001", combined=True))
+        self.assertEqual(self.storage.get_call_status_and_output("cs", "00001"), (None, None))
+        results = self.storage.get_call_results([("cs", "00000"), ("cs", "00001")],
+                                                combined=True)
+        self.assertEqual(results, [(status, b"output"), (None, None)])
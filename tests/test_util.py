@@ -14,12 +14,44 @@
 # limitations under the License.
 #
 
+import ast
+import io
+import os
+import shutil
+import sys
+import tarfile
+import tempfile
+import time
 import unittest
 import pytest
 import pywren
 import pywren.wrenutil
 
 
+def load_jobrunner_defs(*names):
+    """
+    Return the top-level functions and classes `names` of the jobrunner
+    script, along with its imports and constants, without running it
+    """
+    path = os.path.join(os.path.dirname(pywren.__file__), "jobrunner", "jobrunner.py")
+    with open(path, 'r') as fid:
+        tree = ast.parse(fid.read(), path)
+
+    def wanted(node):
+        if isinstance(node, (ast.Import, ast.ImportFrom)):
+            return True
+        if isinstance(node, (ast.FunctionDef, ast.ClassDef)):
+            return node.name in names
+        if isinstance(node, ast.Assign):
+            return all(isinstance(t, ast.Name) and t.id.isupper() for t in node.targets)
+        return False
+
+    tree.body = [node for node in tree.body if wanted(node)]
+    defs = {}
+    exec(compile(tree, path, 'exec'), defs) # pylint: disable=exec-used
+    return defs
+
+
 class S3HashingTest(unittest.TestCase):
     def test_s3_split(self):
 
@@ -33,6 +65,195 @@ class S3HashingTest(unittest.TestCase):
             bad_s3_url = "notS3://foo/bar"
             bucket, key = pywren.wrenutil.split_s3_url(bad_s3_url)
 
+class BufferListIOTest(unittest.TestCase):
+    def test_read(self):
+        parts = [b"abc", b"", memoryview(b"defg"), bytearray(b"h")]
+        f = pywren.wrenutil.BufferListIO(parts)
+        self.assertEqual(len(f), 8)
+        self.assertEqual(f.read(2), b"ab")
+        self.assertEqual(f.read(3), b"cde")
+        self.assertEqual(f.tell(), 5)
+        self.assertEqual(f.read(), b"fgh")
+        self.assertEqual(f.read(), b"")
+
+        f.seek(-4, 2)
+        self.assertEqual(f.read(100), b"efgh")
+        f.seek(1)
+        f.seek(2, 1)
+        self.assertEqual(f.read(), b"defgh")
+
+class ParallelRangeReaderTest(unittest.TestCase):
+    def test_read(self):
+        data = bytes(bytearray(range(256))) * 40
+        ranges = []
+        def get_range(first, last):
+            ranges.append((first, last))
+            return data[first:last + 1]
+
+        reader = pywren.wrenutil.ParallelRangeReader(get_range, len(data),
+                                                     chunk_size=1000, parallelism=3)
+        res = reader.read(10) + reader.read(2500)
+        self.assertEqual(reader.tell(), 2510)
+        res += reader.read()
+        reader.close()
+        self.assertEqual(res, data)
+        self.assertEqual(sorted(ranges), [(i, min(i + 1000, len(data)) - 1)
+                                          for i in range(0, len(data), 1000)])
+
+    def test_error(self):
+        def get_range(first, last):
+            if first > 0:
+                raise IOError("can't read")
+            return b"x" * (last - first + 1)
+
+        reader = pywren.wrenutil.ParallelRangeReader(get_range, 300, chunk_size=100)
+        self.assertEqual(reader.read(100), b"x" * 100)
+        with pytest.raises(IOError):
+            reader.read(100)
+        reader.close()
+
+class ChunkedArchiveTest(unittest.TestCase):
+    def test_roundtrip(self):
+        tar_data = io.BytesIO()
+        with tarfile.open(mode="w", fileobj=tar_data) as tar:
+            for i in range(5):
+                content = ("file {}\n".format(i) * 500).encode('ascii')
+                info = tarfile.TarInfo("runtime/file_{}".format(i))
+                info.size = len(content)
+                tar.addfile(info, io.BytesIO(content))
+        tar_data.seek(0)
+
+        archive = io.BytesIO()
+        index = pywren.wrenutil.write_chunked_archive(tar_data, archive,
+                                                      chunk_size=1000)
+        self.assertEqual(len(index['chunks']),
+                         (len(tar_data.getvalue()) + 999) // 1000)
+        archive_data = archive.getvalue()
+
+        def get_range(first, last):
+            return archive_data[first:last + 1]
+
+        self.assertEqual(pywren.wrenutil.read_chunked_archive_index(get_range,
+                                                                    len(archive_data)),
+                         index)
+        reader = pywren.wrenutil.chunked_archive_reader(get_range, index, parallelism=3)
+        with tarfile.open(mode="r|", fileobj=reader) as tar:
+            names = [m.name for m in tar]
+        reader.close()
+        self.assertEqual(names, ["runtime/file_{}".format(i) for i in range(5)])
+
+    def test_lazy(self):
+        tar_data = io.BytesIO()
+        with tarfile.open(mode="w", fileobj=tar_data) as tar:
+            for name in ["runtime/bin/python", "runtime/pkg/__init__.py",
+                         "runtime/pkg/data.txt", "runtime/pkg/mod.py"]:
+                content = (name * 100).encode('ascii')
+                info = tarfile.TarInfo(name)
+                info.size = len(content)
+                tar.addfile(info, io.BytesIO(content))
+        tar_data.seek(0)
+
+        def is_lazy(member):
+            return member.name.endswith(".py")
+
+        archive = io.BytesIO()
+        with tarfile.open(mode="r", fileobj=tar_data) as tar:
+            index = pywren.wrenutil.write_lazy_chunked_archive(tar, archive, is_lazy,
+                                                               chunk_size=1000,
+                                                               lazy_chunk_size=500)
+        archive_data = archive.getvalue()
+
+        def get_range(first, last):
+            return archive_data[first:last + 1]
+
+        eager_index = dict(index, chunks=index['chunks'][:index['eager_chunks']])
+        reader = pywren.wrenutil.chunked_archive_reader(get_range, eager_index)
+        with tarfile.open(mode="r|", fileobj=reader) as tar:
+            names = [m.name for m in tar]
+        reader.close()
+        self.assertEqual(names, ["runtime/bin/python", "runtime/pkg/data.txt"])
+
+        self.assertEqual(sorted(index['files']), ["runtime/pkg/__init__.py",
+                                                  "runtime/pkg/mod.py"])
+        reader = pywren.wrenutil.chunked_archive_reader(get_range, index)
+        uncompressed = reader.read()
+        reader.close()
+        for name, (offset, size, _, _) in index['files'].items():
+            self.assertEqual(uncompressed[offset:offset + size], (name * 100).encode('ascii'))
+
+    def test_lazy_import(self):
+        files = {"runtime/lib/lazypkg/__init__.py" : "value = 42\n",
+                 "runtime/lib/lazypkg/sub.py" : ("from lazypkg import value\n"
+                                                 "sub_value = value + 1\n"),
+                 "runtime/lib/other.txt" : "not lazy\n"}
+        tar_data = io.BytesIO()
+        with tarfile.open(mode="w", fileobj=tar_data) as tar:
+            for name, content in sorted(files.items()):
+                info = tarfile.TarInfo(name)
+                info.size = len(content)
+                info.mtime = 1500000000
+                tar.addfile(info, io.BytesIO(content.encode('ascii')))
+        tar_data.seek(0)
+
+        archive = io.BytesIO()
+        with tarfile.open(mode="r", fileobj=tar_data) as tar:
+            index = pywren.wrenutil.write_lazy_chunked_archive(
+                tar, archive, lambda member: member.name.endswith(".py"),
+                chunk_size=1000, lazy_chunk_size=50)
+        archive_data = archive.getvalue()
+
+        defs = load_jobrunner_defs("decompress_chunk", "lazy_module_key", "LazyRuntimeFinder")
+        runtime_dir = tempfile.mkdtemp()
+        finder = defs['LazyRuntimeFinder'](runtime_dir, index, "http://unused", '"etag"')
+
+        def get_chunk(chunk_i):
+            offset, length, _ = index['chunks'][chunk_i]
+            return defs['decompress_chunk'](index['codec'],
+                                            archive_data[offset:offset + length])
+        finder._get_chunk = get_chunk
+
+        # the package directory only holds lazy files, so it isn't there yet
+        lib_dir = os.path.join(runtime_dir, "runtime", "lib")
+        os.makedirs(lib_dir)
+        sys.path.insert(0, lib_dir)
+        sys.meta_path.insert(0, finder)
+        try:
+            import lazypkg.sub # pylint: disable=import-error
+            self.assertEqual(lazypkg.value, 42)
+            self.assertEqual(lazypkg.sub.sub_value, 43)
+        finally:
+            sys.meta_path.remove(finder)
+            sys.path.remove(lib_dir)
+            sys.modules.pop("lazypkg.sub", None)
+            sys.modules.pop("lazypkg", None)
+            shutil.rmtree(runtime_dir)
+        self.assertEqual(finder.extracted_n, 2)
+        self.assertEqual(finder.modules, {})
+
+    def test_not_chunked(self):
+        data = b"x" * 100
+        with pytest.raises(ValueError):
+            pywren.wrenutil.read_chunked_archive_index(lambda f, l: data[f:l + 1],
+                                                       len(data))
+
+class ModuleCacheTest(unittest.TestCase):
+    def test_evict(self):
+        defs = load_jobrunner_defs("evict_module_cache")
+        defs['MODULE_CACHE_SIZE'] = 1
+        cache_dir = tempfile.mkdtemp()
+        try:
+            now = time.time()
+            for name, age in [("old", 7200), ("older", 7300), ("recent", 60), ("keep", 8000)]:
+                path = os.path.join(cache_dir, name + ".zip")
+                with open(path, 'wb') as fid:
+                    fid.write(b"zip")
+                os.utime(path, (now - age, now - age))
+            defs['evict_module_cache'](cache_dir, os.path.join(cache_dir, "keep.zip"))
+            # zips used within the grace period stay, even beyond the cache size
+            self.assertEqual(sorted(os.listdir(cache_dir)), ["keep.zip", "recent.zip"])
+        finally:
+            shutil.rmtree(cache_dir)
+
 def test_version():
     """
     test that __version__ exists
@@ -87,3 +87,28 @@ class General(unittest.TestCase):
 
             
 
+
+
+class RuntimeEtagCache(unittest.TestCase):
+
+    def test_cached(self):
+        from pywren import wrenhandler
+
+        heads = []
+        class FakeS3Client(object):
+            def head_object(self, Bucket, Key):
+                heads.append((Bucket, Key))
+                return {'ETag' : '"etag{}"'.format(len(heads))}
+
+        s3_client = FakeS3Client()
+        key = "runtime-{}.tar.gz".format(uuid.uuid4().hex)
+        assert wrenhandler.get_runtime_etag(s3_client, "bucket", key) == '"etag1"'
+        assert wrenhandler.get_runtime_etag(s3_client, "bucket", key) == '"etag1"'
+        assert len(heads) == 1
+
+        # looked up again once the cached ETag expires
+        etag, lookup_time = wrenhandler._runtime_etag_cache[("bucket", key)]
+        wrenhandler._runtime_etag_cache[("bucket", key)] = (
+            etag, lookup_time - wrenhandler.RUNTIME_ETAG_CACHE_TTL_SEC)
+        assert wrenhandler.get_runtime_etag(s3_client, "bucket", key) == '"etag2"'
+        assert len(heads) == 2